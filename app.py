@@ -1,7 +1,7 @@
 # app.py - Version finale avec une machine à états robuste pour la fonctionnalité "Retour"
 
 import logging
-from flask import Flask, request, jsonify, send_file, Response, render_template,send_from_directory,after_this_request, url_for, redirect, session
+from flask import Flask, request, jsonify, send_file, Response, render_template,send_from_directory, url_for, redirect, session
 import requests
 from flask_cors import CORS
 from core_logic import generate_lesson_logic, generate_integration_logic, generate_evaluation_logic, generate_digital_lesson_logic
@@ -10,15 +10,32 @@ import uuid
 import re
 import shutil # Importé pour le nettoyage des dossiers
 import secrets
-from utils import create_pdf_with_pandoc
+import json
+import datetime
+from jobs import job_manager, JobQueueFull
+from llm_health import llm_breakers, latency_tracker
+from generation_cache import generation_cache
+from llm_clients import llm_clients
+from render_pool import render_pool, RenderQueueFull
+from render_limits import RenderLimitExceeded
+from render_cache import render_cache, make_render_key
+from prerender import prerenderer
+from downloads import download_folder, RENDER_RESERVE_BYTES
+from artifact_store import artifact_store, ArtifactNotFound, make_download_token, read_download_token
+from history_export import ExportEntry, ExportLinkInvalid, stream_zip, make_export_token, read_export_token
+from export_formats import EXPORT_FORMATS, output_extension
+from user_cache import user_cache
+from markdown_repair import repair_markdown
 from functools import wraps
+from werkzeug.exceptions import HTTPException
 from database import increment_stat, get_all_stats, init_db , supabase 
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from authlib.integrations.flask_client import OAuth
-from config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, APP_SECRET_KEY
+from config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, APP_SECRET_KEY, GENERATION_DEADLINE, PDF_ENGINE, PDF_ENGINES, DOWNLOAD_SENDFILE, DOWNLOAD_ACCEL_PREFIX, EXPORT_MAX_DOCUMENTS
+from deadlines import Deadline, DeadlineExceeded
 
 # On importe les dictionnaires de menus de notre code original
-from bot_data import CLASSES, MATIERES, SUBSYSTEME_FR, SUBSYSTEME_EN, LANGUES_CONTENU_COMPLET, LANGUES_CONTENU_SIMPLIFIE,  REGENERATE_OPTION_FR, REGENERATE_OPTION_EN
+from bot_data import CLASSES, MATIERES, SUBSYSTEME_FR, SUBSYSTEME_EN, LANGUES_CONTENU_COMPLET, LANGUES_CONTENU_SIMPLIFIE,  REGENERATE_OPTION_FR, REGENERATE_OPTION_EN, RETRY_RENDER_OPTION_FR, RETRY_RENDER_OPTION_EN
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 app = Flask(__name__)
@@ -27,6 +44,13 @@ CORS(app)
 # initialisation de la bd
 init_db()
 
+# Ouvre les connexions vers Gemini/OpenAI dès le démarrage du worker
+llm_clients.warm_up_in_background()
+# Démarre le pool de rendu et construit les préambules LaTeX précompilés
+render_pool.warm_up_in_background()
+# Supprime régulièrement les PDF jamais téléchargés
+download_folder.start_janitor()
+
 # --- Configuration de l'Authentification ---
 app.secret_key = APP_SECRET_KEY
 login_manager = LoginManager()
@@ -68,17 +92,16 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    # Charge l'utilisateur depuis la base de données
-    response = supabase.table('users').select('*').eq('id', user_id).single().execute()
-    if response.data:
-        return User(response.data)
+    # Charge l'utilisateur depuis la base de données, ou depuis le cache (voir user_cache.py)
+    user_data = user_cache.get(user_id)
+    if user_data:
+        return User(user_data)
     return None
 
 
 # --- Configuration pour les fichiers temporaires ---
-# On s'assure que le dossier pour les téléchargements temporaires existe.
-TEMP_FOLDER = '/tmp/tchatchiai_downloads'
-os.makedirs(TEMP_FOLDER, exist_ok=True)
+# Le dossier est créé, purgé et borné en taille par downloads.py (config.DOWNLOAD_DIR).
+TEMP_FOLDER = download_folder.directory
 
 
 # =======================================================================
@@ -164,10 +187,15 @@ def check_session(f):
         # Récupère le jeton de la session du navigateur
         session_token = session.get('session_token')
         
-        # Récupère le jeton actuel depuis la base de données
-        response = supabase.table('users').select('session_token').eq('id', current_user.id).single().execute()
+        # Récupère le jeton actuel : même ligne que load_user, déjà lue pour cette requête
+        user_data = user_cache.get(current_user.id)
+        if user_data and session_token != user_data.get('session_token'):
+            # La ligne en cache peut dater d'avant une connexion faite sur une autre
+            # instance : relue avant de refuser, pour ne jamais rejeter la nouvelle session.
+            user_cache.invalidate(current_user.id)
+            user_data = user_cache.get(current_user.id)
         
-        if not response.data or session_token != response.data.get('session_token'):
+        if not user_data or session_token != user_data.get('session_token'):
             # Si les jetons ne correspondent pas, on déconnecte l'utilisateur
             logout_user()
             return jsonify({'error': 'Session invalide. Vous avez été déconnecté car une nouvelle session a été ouverte ailleurs.'}), 401 # Unauthorized
@@ -179,6 +207,134 @@ def check_session(f):
 # On l'ajoute à la route du chat
 
 
+# =======================================================================
+# GÉNÉRATION EN ARRIÈRE-PLAN
+# =======================================================================
+def pdf_render_args(markdown_text, state, pdf_engine=None, export_format='pdf'):
+    """
+    Clé du cache de rendu et arguments de create_pdf_with_pandoc pour le PDF de
+    `markdown_text`. Partagée par /api/generate-pdf et le rendu anticipé
+    (prerender.py) pour qu'ils tombent sur la même entrée du cache.
+    `export_format` 'docx' ou 'html' : document modifiable, sans moteur PDF.
+    """
+    lang_code = (state.get('lang') or 'fr').lower()
+    doc_type = state.get('collectedData', {}).get('flow_type', 'document')
+    if export_format in EXPORT_FORMATS:
+        # Écrit par pandoc seul : le moteur PDF ne joue aucun rôle.
+        output_format, pdf_engine = export_format, 'pandoc'
+    else:
+        output_format = 'beamer' if doc_type == 'digital' else 'pdf'
+        pdf_engine = pdf_engine if pdf_engine in PDF_ENGINES else PDF_ENGINE
+    render_key = make_render_key(markdown_text, lang_code, doc_type, output_format, pdf_engine)
+    return render_key, {'text': markdown_text, 'lang_contenu_code': lang_code, 'doc_type': doc_type,
+                        'output_format': output_format, 'pdf_engine': pdf_engine}
+
+
+def run_generation(user, collected_data, lang, state, deadline=None, use_cache=True, on_chunk=None):
+    """
+    Exécute la génération demandée dans un thread du pool LLM (voir jobs.py).
+    `user` est un instantané de l'utilisateur, car `current_user` n'est pas
+    disponible en dehors du contexte de la requête.
+    `deadline` est le budget de temps créé par handle_chat pour cette requête.
+    `use_cache=False` force un nouvel appel au LLM (option "Régénérer").
+    `on_chunk` reçoit le texte au fil de l'eau (voir /api/chat/stream).
+    Renvoie le dictionnaire de réponse que /api/chat aurait renvoyé.
+    """
+    is_admin = user['is_admin']
+    flow_type = collected_data.get('flow_type')
+    try:
+        if not flow_type:
+            raise ValueError("flow_type est manquant dans collected_data. Impossible de générer.")
+        
+        generated_text = ""
+        lesson_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'module', 'lecon', 'syllabus', 'langue_contenu']}
+        integration_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'liste_lecons', 'objectifs_lecons', 'langue_contenu']}
+        evaluation_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'liste_lecons', 'duree', 'coeff', 'langue_contenu', 'type_epreuve_key', 'contexte_syllabus']}
+        digital_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'module', 'lecon', 'langue_contenu']}
+
+        if flow_type == 'lecon':
+            generated_text, _ = generate_lesson_logic(**lesson_args, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
+            if not is_admin and user['plan_type'] == 'free':
+                new_count = user['generation_count'] + 1
+                user_cache.update(user['id'], {'generation_count': new_count})
+            increment_stat('lessons_generated')
+        elif flow_type == 'digital':
+            generated_text, _ = generate_digital_lesson_logic(**digital_args, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
+            if not is_admin and user['plan_type'] == 'free':
+                new_count = user['generation_count'] + 1
+                user_cache.update(user['id'], {'generation_count': new_count})
+            increment_stat('digital_lessons_generated')
+        elif flow_type == 'integration':
+             generated_text, _ = generate_integration_logic(**integration_args, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
+             if not is_admin and user['plan_type'] == 'free':
+                new_count = user['generation_count'] + 1
+                user_cache.update(user['id'], {'generation_count': new_count})
+             increment_stat('integrations_generated')
+        elif flow_type == 'evaluation':
+            user_choice = collected_data.get('type_epreuve', '')
+            collected_data['type_epreuve_key'] = "junior_mcq" if 'QCM' in user_choice else "junior_resources_competencies"
+            collected_data['contexte_syllabus'] = collected_data.get('syllabus', "Non fourni.")
+            evaluation_args['type_epreuve_key'] = collected_data['type_epreuve_key']
+            evaluation_args['contexte_syllabus'] = collected_data['contexte_syllabus']
+            args_to_send = {k: v for k, v in collected_data.items() if k in evaluation_args}
+            generated_text, _ = generate_evaluation_logic(**args_to_send, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
+            if not is_admin and user['plan_type'] == 'free':
+                new_count = user['generation_count'] + 1
+                user_cache.update(user['id'], {'generation_count': new_count})
+            increment_stat('evaluations_generated')
+
+        # Constructions qui casseraient LaTeX (formules, tableaux, listes trop profondes)
+        # corrigées avant l'affichage, l'historique et le rendu anticipé.
+        generated_text, repairs = repair_markdown(generated_text, flow_type)
+        if repairs:
+            logging.info(f"Markdown réparé avant rendu (flow: {flow_type}) : {dict(repairs)}")
+        
+        increment_stat('total_documents')
+        response_text = generated_text
+        
+        options_fr = ["Recommencer", REGENERATE_OPTION_FR, "Télécharger en PDF"]
+        options_en = ["Restart", REGENERATE_OPTION_EN, "Download PDF"]
+        if flow_type == 'digital':
+             options_fr = ["Recommencer", REGENERATE_OPTION_FR, "Télécharger en Présentation (PDF)"]
+             options_en = ["Restart", REGENERATE_OPTION_EN, "Download as Presentation (PDF)"]
+        # Versions modifiables (voir export_formats.py), prêtes en une fraction de seconde.
+        options_fr = options_fr + ["Télécharger en Word (DOCX)", "Télécharger en HTML"]
+        options_en = options_en + ["Download as Word (DOCX)", "Download as HTML"]
+        
+        options = options_fr if lang == 'fr' else options_en
+        
+        state['generated_text'] = generated_text
+        state['step_history'] = []
+
+        title_prefix = collected_data.get('flow_type', 'Document')
+        title_main = collected_data.get('lecon') or collected_data.get('liste_lecons') or "Sans titre"
+        history_title = f"{title_prefix.capitalize()} - {title_main[:30]}"
+        
+        supabase.table('generations').insert({
+            'user_id': user['id'],
+            'title': history_title,
+            'flow_type': flow_type,
+            'content': generated_text
+        }).execute()
+
+        # Le PDF est préparé pendant que l'enseignant lit le document.
+        render_key, render_kwargs = pdf_render_args(generated_text, dict(state, lang=lang, collectedData=collected_data))
+        prerenderer.schedule(render_key, **render_kwargs)
+        
+    except DeadlineExceeded as e:
+        # Plus assez de temps pour une nouvelle tentative : on garde l'état pour permettre "Régénérer".
+        logging.error(f"GÉNÉRATION ABANDONNÉE, budget de temps épuisé (flow: {flow_type}): {e}")
+        response_text = "Le service de génération est trop lent en ce moment. Veuillez réessayer dans quelques instants." if lang == 'fr' else "The generation service is too slow right now. Please try again in a few moments."
+        options = [REGENERATE_OPTION_FR, "Recommencer"] if lang == 'fr' else [REGENERATE_OPTION_EN, "Restart"]
+    except Exception as e:
+        logging.error(f"ERREUR LORS DE LA GÉNÉRATION (flow: {flow_type}): {e}")
+        response_text = "Désolé, une erreur est survenue." if lang == 'fr' else "Sorry, an error occurred."
+        options = ["Recommencer"] if lang == 'fr' else ["Restart"]
+        state = {'lang': lang, 'currentStep': 'select_option', 'collectedData': {}, 'step_history': []}
+    
+    return {'response': response_text, 'options': options, 'state': state}
+
+
 # HANDLE CHAT FUNCTION :
 
 @app.route('/api/chat', methods=['POST'])
@@ -200,11 +356,19 @@ def handle_chat():
     collected_data = state.get('collectedData', {})
     step_history = state.get('step_history', [])
 
+    # "Régénérer" doit produire un nouveau document : on contourne le cache de génération.
+    use_generation_cache = user_message not in [REGENERATE_OPTION_FR, REGENERATE_OPTION_EN]
+
     # --- PHASE 1 : GESTION DES ACTIONS SPÉCIALES (PRIORITAIRES) ---
     if user_message in [REGENERATE_OPTION_FR, REGENERATE_OPTION_EN]:
         current_step = 'generation_step'
     elif user_message == "internal_pdf_generation_failed":
-        response_text = "Désolé, la conversion en PDF a échoué. Vous pouvez essayer de régénérer le contenu." if lang == 'fr' else "Sorry, the PDF conversion failed. You can try regenerating the content."
+        # La mise en page peut être retentée sur le texte réparé, sans nouvelle génération.
+        response_text = "Désolé, la conversion en PDF a échoué. Vous pouvez réessayer la mise en page du même contenu, corrigé automatiquement, ou régénérer le contenu." if lang == 'fr' else "Sorry, the PDF conversion failed. You can retry the layout of the same content, automatically corrected, or regenerate the content."
+        options = [RETRY_RENDER_OPTION_FR, REGENERATE_OPTION_FR, "Recommencer"] if lang == 'fr' else [RETRY_RENDER_OPTION_EN, REGENERATE_OPTION_EN, "Restart"]
+        return jsonify({'response': response_text, 'options': options, 'state': state})
+    elif user_message == "internal_pdf_retry_failed":
+        response_text = "Désolé, la mise en page a de nouveau échoué. Vous pouvez essayer de régénérer le contenu." if lang == 'fr' else "Sorry, the layout failed again. You can try regenerating the content."
         options = [REGENERATE_OPTION_FR, "Recommencer"] if lang == 'fr' else [REGENERATE_OPTION_EN, "Restart"]
         return jsonify({'response': response_text, 'options': options, 'state': state})
     elif user_message in [BACK_OPTION_FR, BACK_OPTION_EN]:
@@ -280,80 +444,26 @@ def handle_chat():
                 'state': state
             }), 403
 
-        flow_type = collected_data.get('flow_type')
+        # La génération elle-même (appel LLM de 30 à 110 s) est confiée au pool
+        # d'exécuteurs : on renvoie tout de suite un identifiant de tâche au client.
+        user_snapshot = {
+            'id': current_user.id,
+            'plan_type': current_user.plan_type,
+            'generation_count': current_user.generation_count,
+            'is_admin': is_admin
+        }
+        # Le budget de temps démarre maintenant : l'attente dans la file en fait partie.
+        deadline = Deadline(GENERATION_DEADLINE)
         try:
-            if not flow_type:
-                raise ValueError("flow_type est manquant dans collected_data. Impossible de générer.")
-            
-            generated_text = ""
-            lesson_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'module', 'lecon', 'syllabus', 'langue_contenu']}
-            integration_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'liste_lecons', 'objectifs_lecons', 'langue_contenu']}
-            evaluation_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'liste_lecons', 'duree', 'coeff', 'langue_contenu', 'type_epreuve_key', 'contexte_syllabus']}
-            digital_args = {k: v for k, v in collected_data.items() if k in ['classe', 'matiere', 'module', 'lecon', 'langue_contenu']}
-
-            if flow_type == 'lecon':
-                generated_text, _ = generate_lesson_logic(**lesson_args)
-                if not is_admin and current_user.plan_type == 'free':
-                    new_count = current_user.generation_count + 1
-                    supabase.table('users').update({'generation_count': new_count}).eq('id', current_user.id).execute()
-                increment_stat('lessons_generated')
-            elif flow_type == 'digital':
-                generated_text, _ = generate_digital_lesson_logic(**digital_args)
-                if not is_admin and current_user.plan_type == 'free':
-                    new_count = current_user.generation_count + 1
-                    supabase.table('users').update({'generation_count': new_count}).eq('id', current_user.id).execute()
-                increment_stat('digital_lessons_generated')
-            elif flow_type == 'integration':
-                 generated_text, _ = generate_integration_logic(**integration_args)
-                 if not is_admin and current_user.plan_type == 'free':
-                    new_count = current_user.generation_count + 1
-                    supabase.table('users').update({'generation_count': new_count}).eq('id', current_user.id).execute()
-                 increment_stat('integrations_generated')
-            elif flow_type == 'evaluation':
-                user_choice = collected_data.get('type_epreuve', '')
-                collected_data['type_epreuve_key'] = "junior_mcq" if 'QCM' in user_choice else "junior_resources_competencies"
-                collected_data['contexte_syllabus'] = collected_data.get('syllabus', "Non fourni.")
-                evaluation_args['type_epreuve_key'] = collected_data['type_epreuve_key']
-                evaluation_args['contexte_syllabus'] = collected_data['contexte_syllabus']
-                args_to_send = {k: v for k, v in collected_data.items() if k in evaluation_args}
-                generated_text, _ = generate_evaluation_logic(**args_to_send)
-                if not is_admin and current_user.plan_type == 'free':
-                    new_count = current_user.generation_count + 1
-                    supabase.table('users').update({'generation_count': new_count}).eq('id', current_user.id).execute()
-                increment_stat('evaluations_generated')
-            
-            increment_stat('total_documents')
-            response_text = generated_text
-            
-            options_fr = ["Recommencer", REGENERATE_OPTION_FR, "Télécharger en PDF"]
-            options_en = ["Restart", REGENERATE_OPTION_EN, "Download PDF"]
-            if flow_type == 'digital':
-                 options_fr = ["Recommencer", REGENERATE_OPTION_FR, "Télécharger en Présentation (PDF)"]
-                 options_en = ["Restart", REGENERATE_OPTION_EN, "Download as Presentation (PDF)"]
-            
-            options = options_fr if lang == 'fr' else options_en
-            
-            state['generated_text'] = generated_text
-            state['step_history'] = []
+            job = job_manager.submit(current_user.id, run_generation, user_snapshot, collected_data, lang, state,
+                                     deadline=deadline, use_cache=use_generation_cache)
+        except JobQueueFull as e:
+            logging.warning(f"File de génération pleine, demande refusée : {e}")
+            response_text = "Le service est très sollicité. Veuillez réessayer dans quelques instants." if lang == 'fr' else "The service is very busy. Please try again in a few moments."
+            options = [REGENERATE_OPTION_FR, "Recommencer"] if lang == 'fr' else [REGENERATE_OPTION_EN, "Restart"]
+            return jsonify({'response': response_text, 'options': options, 'state': state}), 503
 
-            title_prefix = collected_data.get('flow_type', 'Document')
-            title_main = collected_data.get('lecon') or collected_data.get('liste_lecons') or "Sans titre"
-            history_title = f"{title_prefix.capitalize()} - {title_main[:30]}"
-            
-            supabase.table('generations').insert({
-                'user_id': current_user.id,
-                'title': history_title,
-                'flow_type': flow_type,
-                'content': generated_text
-            }).execute()
-            
-        except Exception as e:
-            logging.error(f"ERREUR LORS DE LA GÉNÉRATION (flow: {flow_type}): {e}")
-            response_text = "Désolé, une erreur est survenue." if lang == 'fr' else "Sorry, an error occurred."
-            options = ["Recommencer"] if lang == 'fr' else ["Restart"]
-            state = {'lang': lang, 'currentStep': 'select_option', 'collectedData': {}, 'step_history': []}
-        
-        return jsonify({'response': response_text, 'options': options, 'state': state})
+        return jsonify({'job_id': job.id, 'status': job.status, 'state': state}), 202
 
     # --- PHASE 4 : AFFICHAGE DE LA QUESTION POUR L'ÉTAPE EN COURS ---
     step_definition = CONVERSATION_FLOW.get(current_step)
@@ -444,6 +554,57 @@ def handle_chat():
     state['step_history'] = step_history
 
     return jsonify({'response': response_text, 'options': options, 'is_text_input': is_text_input, 'state': state})
+# =======================================================================
+# ROUTE DE SUIVI DES GÉNÉRATIONS EN ARRIÈRE-PLAN
+# =======================================================================
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+@check_session
+def get_generation_job(job_id):
+    """Renvoie l'état d'une génération lancée par /api/chat (et son résultat une fois terminée)."""
+    job = job_manager.get(job_id, current_user.id)
+    if not job:
+        return jsonify({'error': 'Génération non trouvée ou expirée.'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/chat/stream/<job_id>', methods=['GET'])
+@login_required
+@check_session
+def stream_generation_job(job_id):
+    """
+    Diffuse une génération en Server-Sent Events au fur et à mesure que le LLM écrit.
+    Événements : `chunk` (morceau de markdown), `reset` (effacer le texte reçu,
+    le fournisseur a changé), puis `done` avec la réponse complète et le nouvel état.
+    """
+    job = job_manager.get(job_id, current_user.id)
+    if not job:
+        return jsonify({'error': 'Génération non trouvée ou expirée.'}), 404
+
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    def event_stream():
+        cursor, resets_seen = 0, 0
+        while True:
+            reset, new_chunks, finished = job.wait_for_stream(cursor, resets_seen, timeout=15)
+            if reset:
+                resets_seen = job.stream_resets
+                cursor = 0
+                yield sse('reset', {})
+            if new_chunks:
+                cursor += len(new_chunks)
+                yield sse('chunk', {'text': "".join(new_chunks)})
+            if finished:
+                yield sse('done', job.to_dict())
+                return
+            if not reset and not new_chunks:
+                yield ": keep-alive\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(event_stream(), mimetype='text/event-stream', headers=headers)
+
+
 #generation pdf
 #la fonction handle_generate_pdf
 
@@ -451,12 +612,64 @@ def handle_chat():
 # NOUVELLE ARCHITECTURE DE TÉLÉCHARGEMENT EN 2 ÉTAPES
 # =======================================================================
 
+# --- Logique de nommage du fichier final (pour l'utilisateur) ---
+def sanitize_title(title_str):
+    if not title_str: return "Sans_Titre"
+    return re.sub(r'[^\w\s-]', '', title_str).strip().replace(' ', '_')
+
+
+PDF_PREFIX_MAP = {
+    ('lecon', 'fr'): "lecon", ('lecon', 'en'): "lesson",
+    ('digital', 'fr'): "lecon_digitalisee", ('digital', 'en'): "digital_lesson",
+    ('integration', 'fr'): "activite_integration", ('integration', 'en'): "integration_activity",
+    ('evaluation', 'fr'): "evaluation", ('evaluation', 'en'): "assessment"
+}
+
+
+def pdf_download_name(doc_type, lang, title, extension='.pdf'):
+    prefix = PDF_PREFIX_MAP.get((doc_type, lang), "document")
+    return f"tchatchiai_{prefix}_{sanitize_title(title)}{extension}"
+
+
+def download_file_type(download_filename):
+    """Extension et type MIME du fichier à télécharger : PDF, ou l'un des EXPORT_FORMATS."""
+    extension = os.path.splitext(download_filename)[1].lower()
+    for format_extension, mimetype in EXPORT_FORMATS.values():
+        if extension == format_extension:
+            return format_extension, mimetype
+    return '.pdf', 'application/pdf'
+
+
+def render_pdf_file(render_key, render_kwargs, filepath):
+    """
+    Produit le PDF dans `filepath` : depuis le cache de rendu, depuis un rendu
+    anticipé en cours, ou par un rendu dans le pool. Lève RenderQueueFull si le
+    pool est saturé, RenderLimitExceeded si le document dépasse une limite de rendu,
+    une Exception si la conversion échoue.
+    """
+    # Un document déjà rendu avec exactement les mêmes entrées est servi depuis le cache :
+    # en général, le rendu anticipé lancé à la fin de la génération l'y a déjà déposé.
+    extension = output_extension(render_kwargs['output_format'])
+    if render_cache.fetch(render_key, filepath, extension):
+        logging.info(f"PDF servi depuis le cache de rendu ({render_key[:12]}).")
+    elif prerenderer.wait(render_key) and render_cache.fetch(render_key, filepath, extension):
+        logging.info(f"PDF servi après le rendu anticipé en cours ({render_key[:12]}).")
+    else:
+        # Le rendu (pandoc + xelatex) s'exécute dans le pool de processus dédié.
+        pdf_success = render_pool.render(filename=filepath, **render_kwargs)
+        if not pdf_success:
+            raise Exception("La conversion Pandoc/LaTeX a échoué.")
+        render_cache.store(render_key, filepath, extension)
+
+
 # --- ÉTAPE 1 : Génération du PDF ---
 @app.route('/api/generate-pdf', methods=['POST'])
 def handle_generate_pdf():
     """
     Cette fonction ne fait qu'une chose : elle génère le PDF, le sauvegarde
     sur le serveur, et renvoie le nom du fichier à télécharger au frontend.
+    Avec "format": "docx" ou "html", elle produit à la place un document
+    modifiable, sans passer par LaTeX (voir export_formats.py).
     """
     data = request.get_json()
     if not data or 'markdown_text' not in data or 'state' not in data:
@@ -477,84 +690,128 @@ def handle_generate_pdf():
     # On s'assure de récupérer le 'flow_type' depuis 'collectedData' où il est stocké.
     doc_type = collected_data.get('flow_type', 'document')
 
-    # --- Logique de nommage du fichier final (pour l'utilisateur) ---
-    def sanitize_title(title_str):
-        if not title_str: return "Sans_Titre"
-        return re.sub(r'[^\w\s-]', '', title_str).strip().replace(' ', '_')
+    export_format = data.get('format', 'pdf')
+    if export_format != 'pdf' and export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Format de document inconnu."}), 400
+    extension, mimetype = EXPORT_FORMATS.get(export_format, ('.pdf', 'application/pdf'))
 
-    prefix_map = {
-        ('lecon', 'fr'): "lecon", ('lecon', 'en'): "lesson",
-        ('digital', 'fr'): "lecon_digitalisee", ('digital', 'en'): "digital_lesson",
-        ('integration', 'fr'): "activite_integration", ('integration', 'en'): "integration_activity",
-        ('evaluation', 'fr'): "evaluation", ('evaluation', 'en'): "assessment"
-    }
-    prefix = prefix_map.get((doc_type, lang), "document")
     title = collected_data.get('lecon') or collected_data.get('module') or "Sans_Titre"
-    final_download_name = f"tchatchiai_{prefix}_{sanitize_title(title)}.pdf"
+    final_download_name = pdf_download_name(doc_type, lang, title, extension)
 
-    # On génère un nom de fichier temporaire unique pour le stockage sur le serveur
-    temp_filename = f"{uuid.uuid4()}.pdf"
-    temp_filepath = os.path.join(TEMP_FOLDER, temp_filename)
+    # On génère un identifiant unique : le PDF est rendu localement sous ce nom, puis
+    # confié au stockage partagé (artifact_store.py) sous le même identifiant.
+    artifact_id = str(uuid.uuid4())
+    temp_filepath = os.path.join(TEMP_FOLDER, f"{artifact_id}{extension}")
 
-    try:
-        # EXPLICATION : On utilise la variable 'lang' maintenant sécurisée pour créer lang_code.
-        lang_code = lang.lower()
-        output_format = 'beamer' if doc_type == 'digital' else 'pdf'
-
-        pdf_success = create_pdf_with_pandoc(
-            text=markdown_text, filename=temp_filepath, lang_contenu_code=lang_code,
-            doc_type=doc_type, output_format=output_format
-        )
-        if not pdf_success:
-            raise Exception("La conversion Pandoc/LaTeX a échoué.")
+    # "Réessayer la mise en page" : même texte, réparé en mode strict (commandes
+    # inconnues neutralisées, environnements de texte vérifiés), renvoyé au client.
+    repaired_text = None
+    if data.get('repair'):
+        repaired_text, repairs = repair_markdown(markdown_text, doc_type, strict=True)
+        logging.info(f"Nouvelle mise en page après réparation ({doc_type}) : {dict(repairs)}")
+        markdown_text = repaired_text
 
-        # Au lieu d'envoyer le fichier, on envoie une réponse JSON avec les noms
-        return jsonify({
+    try:
+        # Moteur demandé par le client ('latex' ou 'typst'), sinon celui de la configuration.
+        render_key, render_kwargs = pdf_render_args(markdown_text, state, data.get('engine'), export_format)
+        # Place libérée avant le rendu : un disque plein casse pandoc en cours de route.
+        download_folder.enforce_quota(reserve=RENDER_RESERVE_BYTES)
+        render_pdf_file(render_key, render_kwargs, temp_filepath)
+        download_folder.enforce_quota(keep=temp_filepath)
+        artifact_store.put(artifact_id, temp_filepath, extension, mimetype)
+
+        # Au lieu d'envoyer le fichier, on envoie un lien de téléchargement signé et daté,
+        # valable sur n'importe quelle instance de l'application.
+        download_token = make_download_token(artifact_id, final_download_name)
+        response = {
             "success": True,
-            "temp_filename": temp_filename, # Le nom unique sur le serveur
+            "download_url": url_for('download_file', token=download_token),
             "download_filename": final_download_name # Le nom final pour l'utilisateur
-        })
-
+        }
+        if repaired_text is not None:
+            response["repaired_text"] = repaired_text
+        return jsonify(response)
+
+    except RenderQueueFull as e:
+        logging.warning(f"File de rendu PDF pleine, demande refusée : {e}")
+        message = "Beaucoup de PDF sont en préparation. Veuillez réessayer dans quelques instants." if lang == 'fr' else "Many PDFs are being prepared. Please try again in a few moments."
+        return jsonify({"error": message, "busy": True}), 503
+    except RenderLimitExceeded as e:
+        # Le document lui-même est trop lourd : inutile de le renvoyer tel quel.
+        logging.warning(f"Limite de rendu dépassée ({e.limit}) : {e}")
+        message = "Ce document est trop long ou trop complexe pour être mis en page. Essayez de le régénérer ou de le raccourcir." if lang == 'fr' else "This document is too long or too complex to be laid out. Try regenerating or shortening it."
+        return jsonify({"error": message, "too_complex": True, "limit": e.limit}), 422
     except Exception as e:
         # EXPLICATION : On log l'erreur spécifique pour faciliter le débogage futur.
         logging.error(f"Erreur lors de la création du PDF : {e}")
         return jsonify({"error": "Une erreur interne est survenue.", "details": str(e)}), 500
 
 
-# --- ÉTAPE 2 : Téléchargement et Nettoyage ---
-@app.route('/api/download/<temp_filename>/<download_filename>', methods=['GET'])
-def download_and_cleanup_file(temp_filename, download_filename):
+# --- ÉTAPE 2 : Téléchargement ---
+def local_download_response(artifact_id, extension='.pdf', mimetype='application/pdf'):
     """
-    Cette fonction sert le fichier demandé avec le bon nom de téléchargement,
-    puis programme sa suppression.
+    Réponse pour un PDF du stockage local : confiée au serveur frontal si
+    DOWNLOAD_SENDFILE est configuré, sinon send_file conditionnel (Range, ETag).
+    """
+    path = artifact_store.path(artifact_id, extension)
+    if DOWNLOAD_SENDFILE == 'x-accel-redirect':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX + os.path.basename(path)
+        return response
+    if DOWNLOAD_SENDFILE == 'x-sendfile':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = path
+        return response
+    # conditional=True : Werkzeug gère Range / If-Range (reprise) et If-None-Match (304).
+    return send_file(path, mimetype=mimetype, conditional=True, etag=True)
+
+
+def s3_download_response(artifact_id, extension='.pdf', mimetype='application/pdf'):
+    """Réponse pour un PDF du bucket S3 : Range et If-None-Match sont transmis à S3."""
+    status, headers, body = artifact_store.get(
+        artifact_id, byte_range=request.headers.get('Range'),
+        if_none_match=request.headers.get('If-None-Match'), if_range=request.headers.get('If-Range'),
+        extension=extension)
+    if body is None:
+        return Response(status=status, headers=headers)
+    return Response(body.iter_chunks(64 * 1024), status=status, headers=headers,
+                    mimetype=mimetype, direct_passthrough=True)
+
+
+@app.route('/api/download/<token>', methods=['GET'])
+def download_file(token):
+    """
+    Cette fonction sert le fichier désigné par le jeton avec le bon nom de
+    téléchargement. Le fichier n'est plus supprimé au premier envoi : un
+    téléchargement interrompu reprend là où il s'était arrêté (requêtes Range)
+    pendant DOWNLOAD_TTL, après quoi downloads.py (ou le cycle de vie du bucket)
+    le supprime.
     """
     try:
-        # On construit le chemin complet vers le fichier temporaire
-        filepath = os.path.join(TEMP_FOLDER, temp_filename)
-        
-        if not os.path.exists(filepath):
-            return jsonify({"error": "Fichier non trouvé ou déjà supprimé."}), 404
+        # Le jeton signé désigne le PDF dans le stockage partagé et son nom final.
+        try:
+            artifact_id, download_filename = read_download_token(token)
+            # L'extension du nom de téléchargement désigne le fichier stocké (PDF, DOCX, HTML).
+            extension, mimetype = download_file_type(download_filename)
+            if artifact_store.name == 'local':
+                response = local_download_response(artifact_id, extension, mimetype)
+            else:
+                response = s3_download_response(artifact_id, extension, mimetype)
+        except ArtifactNotFound:
+            return jsonify({"error": "Fichier non trouvé ou expiré."}), 404
 
-        # On prépare la réponse en envoyant le fichier
-        response = send_file(filepath, as_attachment=True)
-        
         # **LA CORRECTION EST ICI**
         # On force l'en-tête 'Content-Disposition' pour que le navigateur utilise le bon nom de fichier.
         # C'est la méthode la plus fiable.
         response.headers["Content-Disposition"] = f"attachment; filename=\"{download_filename}\""
-        
-        # On programme le nettoyage du fichier APRES l'envoi de la réponse
-        @after_this_request
-        def cleanup(response):
-            try:
-                os.remove(filepath)
-                logging.info(f"Fichier temporaire supprimé : {temp_filename}")
-            except Exception as e:
-                logging.error(f"Erreur lors de la suppression du fichier temporaire {temp_filename}: {e}")
-            return response
-            
+        # Document propre à l'enseignant : pas de cache partagé, mais revalidation par ETag.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
         return response
 
+    except HTTPException:
+        # Ex : 416 pour une plage hors du fichier, renvoyé tel quel par Flask.
+        raise
     except Exception as e:
         logging.error(f"Erreur inattendue dans la route de téléchargement: {e}")
         return jsonify({"error": "Une erreur de serveur est survenue lors du téléchargement."}), 500
@@ -594,6 +851,77 @@ def get_generation(generation_id):
         logging.error(f"Erreur lors de la récupération d'une génération: {e}")
         return jsonify({'error': 'Erreur interne'}), 500
 
+# =======================================================================
+# ROUTE POUR L'EXPORT GROUPÉ DE L'HISTORIQUE (ZIP)
+# =======================================================================
+@app.route('/api/history/export', methods=['POST'])
+@login_required
+@check_session
+def export_history():
+    """
+    Prépare l'export des générations demandées ({"generation_ids": [...], "lang": "fr",
+    "engine": optionnel}) et renvoie le lien signé de l'archive ({"download_url": ...}),
+    que le navigateur télécharge directement (voir download_history_export).
+    """
+    data = request.get_json() or {}
+    generation_ids = data.get('generation_ids') or []
+    if not isinstance(generation_ids, list) or not generation_ids:
+        return jsonify({'error': 'Aucune génération sélectionnée.'}), 400
+    if len(generation_ids) > EXPORT_MAX_DOCUMENTS:
+        return jsonify({'error': f'{EXPORT_MAX_DOCUMENTS} documents au maximum par export.'}), 400
+    lang = (data.get('lang') or 'fr').lower()
+
+    try:
+        # Vérifiées ici, et non au téléchargement : une erreur reste affichable dans le chat.
+        response = supabase.table('generations').select('id').in_('id', generation_ids).eq('user_id', current_user.id).execute()
+    except Exception as e:
+        logging.error(f"Erreur lors de la vérification des générations à exporter: {e}")
+        return jsonify({'error': 'Erreur interne'}), 500
+    owned_ids = [row['id'] for row in response.data or []]
+    if not owned_ids:
+        return jsonify({'error': 'Génération non trouvée ou non autorisée'}), 404
+
+    token = make_export_token(current_user.id, owned_ids, lang, data.get('engine'))
+    return jsonify({'download_url': url_for('download_history_export', token=token)})
+
+
+@app.route('/api/history/export/<token>', methods=['GET'])
+@login_required
+@check_session
+def download_history_export(token):
+    """
+    Renvoie l'archive ZIP des PDF désignés par le lien signé. Les documents sont rendus
+    en parallèle et l'archive est envoyée au fil des rendus (voir history_export.py).
+    """
+    try:
+        generation_ids, lang, engine = read_export_token(token, current_user.id)
+    except ExportLinkInvalid as e:
+        logging.warning(f"Export de l'historique refusé : {e}")
+        return jsonify({'error': "Lien d'export invalide ou expiré."}), 404
+
+    try:
+        # Une seule requête, limitée aux générations de l'utilisateur connecté.
+        response = supabase.table('generations').select('id, title, flow_type, content, created_at').in_('id', generation_ids).eq('user_id', current_user.id).execute()
+    except Exception as e:
+        logging.error(f"Erreur lors de la récupération des générations à exporter: {e}")
+        return jsonify({'error': 'Erreur interne'}), 500
+    rows = sorted(response.data or [], key=lambda row: row.get('created_at') or '')
+    if not rows:
+        return jsonify({'error': 'Génération non trouvée ou non autorisée'}), 404
+
+    entries = []
+    for index, row in enumerate(rows, start=1):
+        state = {'lang': lang, 'collectedData': {'flow_type': row.get('flow_type')}}
+        render_key, render_kwargs = pdf_render_args(row.get('content') or '', state, engine)
+        # Numéro en tête : noms uniques dans l'archive, même pour deux titres identiques.
+        arcname = f"{index:02d}_{pdf_download_name(row.get('flow_type'), lang, row.get('title'))}"
+        entries.append(ExportEntry(arcname, render_key, render_kwargs))
+
+    export_name = f"tchatchiai_export_{datetime.date.today().isoformat()}.zip"
+    return Response(stream_zip(entries, render_pdf_file), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{export_name}"',
+                             'X-Accel-Buffering': 'no'})
+
 # =======================================================================
 # ROUTES FOR STATS
 # =======================================================================
@@ -607,6 +935,21 @@ def get_stats():
     return jsonify(stats)
 
 
+@app.route('/api/metrics')
+def get_metrics():
+    """Endpoint de supervision : disjoncteurs, latences LLM, cache de génération, rendu PDF (pool, cache, rendu anticipé), dossier des téléchargements et cache des utilisateurs."""
+    return jsonify({
+        'llm_breakers': {provider: breaker.snapshot() for provider, breaker in llm_breakers.items()},
+        'llm_latency': latency_tracker.snapshot(),
+        'generation_cache': {'hits': generation_cache.hits, 'misses': generation_cache.misses},
+        'render_pool': render_pool.snapshot(),
+        'render_cache': render_cache.snapshot(),
+        'prerender': prerenderer.snapshot(),
+        'downloads': download_folder.snapshot(),
+        'user_cache': user_cache.snapshot()
+    })
+
+
 # =======================================================================
 # ROUTES FOR AUTHENTICATION
 # =======================================================================
@@ -659,9 +1002,9 @@ def authorize():
         new_session_token = str(uuid.uuid4())
         
         # 2. Mettre à jour ce jeton dans la base de données pour cet utilisateur
-        supabase.table('users').update({
+        user_cache.update(user_data['id'], {
             'session_token': new_session_token
-        }).eq('id', user_data['id']).execute()
+        })
         
         # 3. Sauvegarder ce même jeton dans la session du navigateur
         session['session_token'] = new_session_token
@@ -0,0 +1,179 @@
+# artifact_store.py - Stockage des PDF prêts à télécharger, partagé entre instances
+#
+# /api/generate-pdf et /api/download peuvent être servis par deux instances
+# différentes derrière le répartiteur de charge : le PDF ne peut donc pas rester
+# sur le disque local de celle qui l'a rendu. Deux backends :
+#   - 'local' : le dossier des téléchargements (downloads.py), pour une instance seule ;
+#   - 's3'    : un bucket compatible S3 (AWS, MinIO, R2...), partagé par toutes.
+# Le client ne reçoit plus de nom de fichier mais un jeton signé et daté
+# (itsdangerous, clé APP_SECRET_KEY) qui désigne le PDF et son nom de téléchargement.
+# Les PDF restent disponibles pendant DOWNLOAD_TTL : un téléchargement interrompu
+# reprend par requêtes Range au lieu de relancer un rendu. Les exports DOCX / HTML
+# (export_formats.py) sont stockés de la même façon, avec leur propre extension.
+
+import logging
+import os
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from werkzeug.http import http_date, parse_date
+from config import (APP_SECRET_KEY, ARTIFACT_STORE, DOWNLOAD_TTL, S3_BUCKET, S3_PREFIX,
+                    S3_ENDPOINT_URL, S3_REGION)
+from downloads import download_folder
+
+
+class ArtifactNotFound(Exception):
+    """Levée quand le PDF demandé n'existe pas (ou plus)."""
+
+
+class LocalArtifactStore:
+    """Les PDF restent dans le dossier des téléchargements, où ils ont été rendus."""
+
+    name = 'local'
+
+    def __init__(self, folder):
+        self._folder = folder
+
+    def _path(self, artifact_id, extension='.pdf'):
+        return self._folder.path(f"{artifact_id}{extension}")
+
+    def put(self, artifact_id, source_path, extension='.pdf', content_type='application/pdf'):
+        """Enregistre le PDF `source_path` sous `artifact_id` (le fichier source est consommé)."""
+        path = self._path(artifact_id, extension)
+        if os.path.abspath(source_path) != os.path.abspath(path):
+            os.replace(source_path, path)
+
+    def path(self, artifact_id, extension='.pdf'):
+        """Chemin du PDF sur le disque (envoyé par send_file ou par le serveur frontal)."""
+        path = self._path(artifact_id, extension)
+        if not os.path.exists(path):
+            raise ArtifactNotFound(artifact_id)
+        return path
+
+    def delete(self, artifact_id, extension='.pdf'):
+        try:
+            os.remove(self._path(artifact_id, extension))
+        except FileNotFoundError:
+            pass
+
+
+class S3ArtifactStore:
+    """
+    Un objet `<prefix><artifact_id>.pdf` par PDF. Les objets sont conservés pour que
+    les téléchargements interrompus puissent reprendre ; ils sont à faire expirer par
+    une règle de cycle de vie du bucket (au-delà de DOWNLOAD_TTL).
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None):
+        import boto3  # Dépendance chargée seulement si ce backend est configuré.
+        self._bucket = bucket
+        self._prefix = prefix
+        # Identifiants lus par boto3 dans l'environnement (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY).
+        self._client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+        self._not_found = self._client.exceptions.NoSuchKey
+
+    def _key(self, artifact_id, extension='.pdf'):
+        return f"{self._prefix}{artifact_id}{extension}"
+
+    def put(self, artifact_id, source_path, extension='.pdf', content_type='application/pdf'):
+        """Envoie le PDF `source_path` dans le bucket, puis le supprime du disque local."""
+        self._client.upload_file(source_path, self._bucket, self._key(artifact_id, extension),
+                                 ExtraArgs={'ContentType': content_type})
+        os.remove(source_path)
+
+    @staticmethod
+    def _if_range_condition(if_range):
+        """
+        Condition S3 équivalente à l'en-tête If-Range : la plage n'est valable que pour
+        cette version de l'objet. Un ETag fort devient IfMatch ; une date, IfUnmodifiedSince
+        (le client renvoie le Last-Modified reçu). Renvoie {} sans If-Range, et None si la
+        plage doit être ignorée : ETag faible (W/...), jamais valable pour une plage, ou
+        valeur illisible. Le contenu est alors envoyé en entier.
+        """
+        if not if_range:
+            return {}
+        if_range = if_range.strip()
+        if if_range.startswith('"') and if_range.endswith('"') and len(if_range) > 1:
+            return {'IfMatch': if_range}
+        if if_range.startswith('W/'):
+            return None
+        modified = parse_date(if_range)
+        if modified is None:
+            return None
+        return {'IfUnmodifiedSince': modified}
+
+    def get(self, artifact_id, byte_range=None, if_none_match=None, if_range=None, extension='.pdf'):
+        """
+        Lit l'objet en transmettant à S3 les en-têtes conditionnels du client.
+        Renvoie (statut HTTP, en-têtes, flux du contenu ou None) : 200, 206 (plage),
+        304 (ETag inchangé) ou 416 (plage invalide).
+        """
+        from botocore.exceptions import ClientError
+        request = {'Bucket': self._bucket, 'Key': self._key(artifact_id, extension)}
+        if if_none_match:
+            request['IfNoneMatch'] = if_none_match
+        if byte_range:
+            condition = self._if_range_condition(if_range)
+            if condition is not None:
+                request['Range'] = byte_range
+                request.update(condition)
+        try:
+            obj = self._client.get_object(**request)
+        except self._not_found:
+            raise ArtifactNotFound(artifact_id)
+        except ClientError as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if status == 304:
+                return 304, {'ETag': if_none_match}, None
+            if status == 412 and 'Range' in request:
+                # Objet modifié depuis le début du téléchargement : on renvoie tout.
+                return self.get(artifact_id, if_none_match=if_none_match, extension=extension)
+            if status == 416:
+                return 416, {}, None
+            if status == 404:
+                raise ArtifactNotFound(artifact_id)
+            raise
+        headers = {'ETag': obj['ETag'], 'Content-Length': str(obj['ContentLength']),
+                   'Accept-Ranges': 'bytes', 'Last-Modified': http_date(obj['LastModified'])}
+        if obj.get('ContentRange'):
+            headers['Content-Range'] = obj['ContentRange']
+            return 206, headers, obj['Body']
+        return 200, headers, obj['Body']
+
+    def delete(self, artifact_id, extension='.pdf'):
+        self._client.delete_object(Bucket=self._bucket, Key=self._key(artifact_id, extension))
+
+
+def _build_store():
+    if ARTIFACT_STORE == 's3':
+        if not S3_BUCKET:
+            raise RuntimeError("ARTIFACT_STORE=s3 exige S3_BUCKET.")
+        logging.info(f"PDF stockés dans le bucket S3 '{S3_BUCKET}'.")
+        return S3ArtifactStore(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+    return LocalArtifactStore(download_folder)
+
+
+artifact_store = _build_store()
+
+
+# --- Jetons de téléchargement ---
+_token_serializer = URLSafeTimedSerializer(APP_SECRET_KEY, salt='pdf-download')
+
+
+def make_download_token(artifact_id, download_filename):
+    """Jeton signé désignant le PDF `artifact_id` et le nom proposé au navigateur."""
+    return _token_serializer.dumps({'id': artifact_id, 'name': download_filename})
+
+
+def read_download_token(token, max_age=DOWNLOAD_TTL):
+    """
+    Renvoie (artifact_id, download_filename). Lève ArtifactNotFound si le jeton est
+    invalide ou a expiré : le client ne distingue pas les deux cas.
+    """
+    try:
+        payload = _token_serializer.loads(token, max_age=max_age)
+    except SignatureExpired:
+        raise ArtifactNotFound("Jeton de téléchargement expiré.")
+    except BadSignature:
+        raise ArtifactNotFound("Jeton de téléchargement invalide.")
+    return payload['id'], payload['name']
@@ -0,0 +1 @@
+# benchmarks - Tests de charge de l'application (voir load_test.py)
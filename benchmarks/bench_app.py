@@ -0,0 +1,38 @@
+# benchmarks/bench_app.py - L'application réelle, branchée sur des remplaçants locaux
+#
+# Importe app.py avec le fournisseur LLM simulé (mock_llm.py) et un Supabase en
+# mémoire (fake_supabase.py). S'utilise directement par load_test.py (mode
+# "inprocess") ou derrière gunicorn, avec les réglages à comparer :
+#
+#   gunicorn --bind 127.0.0.1:10000 --worker-class gthread --threads 8 \
+#            --timeout 120 benchmarks.bench_app:app
+#
+# Les variables d'environnement déjà définies (LLM_MOCK_*, LLM_EXECUTOR_WORKERS...)
+# sont respectées ; seules les valeurs absentes reçoivent un défaut.
+
+import os
+
+os.environ.setdefault("LLM_MOCK_ENABLED", "true")
+os.environ.setdefault("APP_SECRET_KEY", "tchatchiai-loadtest-secret")
+os.environ.setdefault("GENERATION_CACHE_DB_PATH", "/tmp/tchatchiai_loadtest/generations.sqlite3")
+os.environ.setdefault("JOB_STORE_DB_PATH", "/tmp/tchatchiai_loadtest/jobs.sqlite3")
+# Identifiants vides (et non absents, pour que load_dotenv ne les remplisse pas depuis .env) :
+# database.py ne crée alors aucun vrai client Supabase.
+os.environ["SUPABASE_URL"] = ""
+os.environ["SUPABASE_KEY"] = ""
+
+import app as app_module  # noqa: E402
+import database  # noqa: E402
+from benchmarks.fake_supabase import FakeSupabase, seed_users  # noqa: E402
+
+BENCH_USERS = int(os.getenv("LOADTEST_USERS", "500"))
+SUPABASE_LATENCY = float(os.getenv("LOADTEST_SUPABASE_LATENCY", "0.02"))
+
+fake_supabase = FakeSupabase(latency=SUPABASE_LATENCY)
+seed_users(fake_supabase, BENCH_USERS)
+
+# app.py et database.py ont chacun importé leur propre référence au client.
+app_module.supabase = fake_supabase
+database.supabase = fake_supabase
+
+app = app_module.app
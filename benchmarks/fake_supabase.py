@@ -0,0 +1,181 @@
+# benchmarks/fake_supabase.py - Remplaçant en mémoire du client Supabase
+#
+# Implémente le sous-ensemble de l'API supabase-py utilisé par app.py et database.py
+# (table().select/insert/update ... .eq/.in_/.order/.limit/.single().execute(), rpc()).
+# Une latence réseau simulée peut être ajoutée à chaque execute().
+
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Requête construite par chaînage, comme dans supabase-py."""
+
+    def __init__(self, client, table):
+        self._client = client
+        self._table = table
+        self._action = 'select'
+        self._payload = None
+        self._columns = None
+        self._filters = []
+        self._order = None
+        self._limit = None
+        self._single = False
+
+    def select(self, columns='*', count=None):
+        self._action, self._columns = 'select', columns
+        return self
+
+    def insert(self, payload):
+        self._action, self._payload = 'insert', payload
+        return self
+
+    def update(self, payload):
+        self._action, self._payload = 'update', payload
+        return self
+
+    def delete(self):
+        self._action = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, value))
+        return self
+
+    def in_(self, column, values):
+        self._filters.append((column, tuple(values)))
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def _matches(self, row):
+        return all(str(row.get(column)) in {str(v) for v in value} if isinstance(value, tuple)
+                   else str(row.get(column)) == str(value)
+                   for column, value in self._filters)
+
+    def _project(self, row):
+        if self._columns in (None, '*', 'count'):
+            return dict(row)
+        columns = [column.strip() for column in self._columns.split(',')]
+        return {column: row.get(column) for column in columns}
+
+    def execute(self):
+        self._client.simulate_latency()
+        with self._client.lock:
+            rows = self._client.tables.setdefault(self._table, [])
+            if self._action == 'insert':
+                payloads = self._payload if isinstance(self._payload, list) else [self._payload]
+                inserted = []
+                for payload in payloads:
+                    row = {'id': str(uuid.uuid4()),
+                           'created_at': datetime.now(timezone.utc).isoformat(),
+                           **payload}
+                    rows.append(row)
+                    inserted.append(dict(row))
+                return FakeResponse(inserted)
+            matching = [row for row in rows if self._matches(row)]
+            if self._action == 'update':
+                for row in matching:
+                    row.update(self._payload)
+                return FakeResponse([dict(row) for row in matching])
+            if self._action == 'delete':
+                self._client.tables[self._table] = [row for row in rows if not self._matches(row)]
+                return FakeResponse([dict(row) for row in matching])
+            if self._order:
+                column, desc = self._order
+                matching.sort(key=lambda row: str(row.get(column, '')), reverse=desc)
+            if self._limit is not None:
+                matching = matching[:self._limit]
+            data = [self._project(row) for row in matching]
+        if self._single:
+            # supabase-py lève une erreur si .single() ne trouve pas exactement une ligne.
+            if len(data) != 1:
+                raise RuntimeError(f"JSON object requested, multiple (or no) rows returned ({len(data)})")
+            return FakeResponse(data[0])
+        return FakeResponse(data, count=len(data))
+
+
+class FakeRPC:
+    def __init__(self, client, name, params):
+        self._client = client
+        self._name = name
+        self._params = params
+
+    def execute(self):
+        self._client.simulate_latency()
+        if self._name == 'increment_stat_value':
+            key = self._params['key_to_increment']
+            with self._client.lock:
+                stats = self._client.tables.setdefault('stats', [])
+                row = next((row for row in stats if row['stat_key'] == key), None)
+                if row is None:
+                    row = {'stat_key': key, 'stat_value': 0}
+                    stats.append(row)
+                row['stat_value'] += 1
+        return FakeResponse(None)
+
+
+class FakeSupabase:
+    """Client Supabase en mémoire, partagé par tous les threads du processus."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.tables = {'users': [], 'generations': [], 'stats': []}
+        self.calls = itertools.count()
+
+    def simulate_latency(self):
+        next(self.calls)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return FakeRPC(self, name, params)
+
+
+def bench_user_id(index):
+    return f"bench-user-{index}"
+
+
+def bench_session_token(index):
+    return f"bench-session-{index}"
+
+
+def seed_users(client, count, plan_type='premium'):
+    """
+    Crée `count` enseignants fictifs aux identifiants et jetons de session
+    déterministes : chaque worker gunicorn produit ainsi les mêmes comptes.
+    """
+    with client.lock:
+        client.tables['users'] = [{
+            'id': bench_user_id(index),
+            'google_id': f"google-{index}",
+            'email': f"enseignant{index}@example.com",
+            'full_name': f"Enseignant {index}",
+            'plan_type': plan_type,
+            'generation_count': 0,
+            'role': 'user',
+            'session_token': bench_session_token(index),
+        } for index in range(count)]
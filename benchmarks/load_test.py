@@ -0,0 +1,339 @@
+# benchmarks/load_test.py - Test de charge du parcours complet chat -> génération -> PDF
+#
+# Chaque enseignant simulé se connecte (cookie de session signé), parcourt toutes les
+# étapes de CONVERSATION_FLOW via /api/chat, attend sa génération (/api/jobs ou le
+# flux SSE), puis demande le PDF (/api/generate-pdf) et le télécharge (/api/download).
+# Le rapport donne le débit et les latences p50/p95/p99 de chaque endpoint.
+#
+# Deux cibles possibles :
+#   - "inprocess" (défaut) : l'application est chargée dans ce processus
+#     (benchmarks/bench_app.py) et appelée via le client de test de Flask ;
+#   - une URL (ex : http://127.0.0.1:10000) : un serveur lancé séparément avec
+#     `gunicorn ... benchmarks.bench_app:app`, pour comparer des réglages gunicorn.
+#     APP_SECRET_KEY doit être le même des deux côtés.
+#
+# Exemples :
+#   python -m benchmarks.load_test --teachers 20 --sessions 3
+#   LLM_MOCK_LATENCY_MEDIAN=2 python -m benchmarks.load_test --skip-pdf --json run.json
+#   python -m benchmarks.load_test --target http://127.0.0.1:10000 --teachers 50
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("APP_SECRET_KEY", "tchatchiai-loadtest-secret")
+
+from benchmarks.fake_supabase import bench_user_id, bench_session_token  # noqa: E402
+
+# Réponses saisies par l'enseignant aux étapes de texte libre.
+TEXT_ANSWERS = {
+    'lecon_ask_module': "LES GRANDEURS ET MESURES",
+    'lecon_ask_lecon': "Les aires des figures planes",
+    'lecon_get_manual_syllabus': "Calculer l'aire du carré, du rectangle et du triangle.",
+    'int_ask_lecons': "Les aires, les périmètres, les conversions d'unités",
+    'int_ask_objectifs': "Calculer une aire ; convertir des unités",
+    'eval_ask_module': "LES GRANDEURS ET MESURES",
+    'eval_ask_lecons': "Les aires ; les périmètres",
+    'eval_get_manual_syllabus': "Aires et périmètres des figures usuelles.",
+    'eval_ask_duree_coeff': "2h, 3",
+    'digital_ask_module': "LES GRANDEURS ET MESURES",
+    'digital_ask_lecon': "Les aires des figures planes",
+}
+
+# Choix d'ouverture de chaque parcours à l'étape 'select_option'.
+FLOW_CHOICES = {
+    'lecon': "Préparer une leçon",
+    'digital': "Leçon digitalisée",
+    'integration': "Produire une activité d'intégration",
+    'evaluation': "Créer une évaluation",
+}
+
+BACK_OPTIONS = ("⬅️ Retour", "⬅️ Back")
+
+# Étapes dont la réponse reçoit un suffixe aléatoire quand la session doit éviter le cache.
+UNIQUE_STEPS = {'lecon_ask_lecon', 'int_ask_lecons', 'eval_ask_lecons', 'digital_ask_lecon'}
+
+
+def percentile(sorted_values, pct):
+    """Percentile par rang le plus proche (même convention que llm_health.LatencyTracker)."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Collecte les durées et les erreurs de chaque endpoint, depuis plusieurs threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok=True):
+        with self._lock:
+            self.samples[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+    def report(self, wall_time):
+        rows = {}
+        for name in sorted(self.samples):
+            values = sorted(self.samples[name])
+            rows[name] = {
+                'count': len(values),
+                'errors': self.errors.get(name, 0),
+                'throughput_per_s': len(values) / wall_time if wall_time else None,
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'max': values[-1],
+            }
+        return rows
+
+
+class InProcessClient:
+    """Appels via le client de test de Flask (l'application tourne dans ce processus)."""
+
+    def __init__(self, app, cookie):
+        self._client = app.test_client()
+        # Le client de test gère lui-même l'en-tête Cookie à partir de son stock de cookies.
+        self._client.set_cookie('session', cookie)
+
+    def request(self, method, path, json_body=None):
+        # Fermer la réponse, comme le ferait gunicorn, déclenche les callbacks call_on_close.
+        with self._client.open(path, method=method, json=json_body) as response:
+            body = response.get_data()
+            return response.status_code, body, response.headers.get('Content-Type', '')
+
+    def stream_lines(self, path):
+        response = self._client.get(path, buffered=False)
+        try:
+            buffer = ""
+            for piece in response.response:
+                buffer += piece.decode('utf-8') if isinstance(piece, bytes) else piece
+                while "\n" in buffer:
+                    line, buffer = buffer.split("\n", 1)
+                    yield line
+        finally:
+            response.close()
+
+
+class HTTPClient:
+    """Appels HTTP vers un serveur lancé séparément (gunicorn benchmarks.bench_app:app)."""
+
+    def __init__(self, base_url, cookie):
+        import requests
+        self._base_url = base_url.rstrip('/')
+        self._session = requests.Session()
+        self._session.headers['Cookie'] = f"session={cookie}"
+
+    def request(self, method, path, json_body=None):
+        response = self._session.request(method, self._base_url + path, json=json_body, timeout=180)
+        return response.status_code, response.content, response.headers.get('Content-Type', '')
+
+    def stream_lines(self, path):
+        with self._session.get(self._base_url + path, stream=True, timeout=180) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                yield line
+
+
+def session_cookie(secret_key, user_index):
+    """Cookie de session Flask signé, tel que le poserait /auth/callback pour ce compte."""
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+    signer_app = Flask('loadtest')
+    signer_app.secret_key = secret_key
+    serializer = SecureCookieSessionInterface().get_signing_serializer(signer_app)
+    return serializer.dumps({'_user_id': bench_user_id(user_index), '_fresh': True,
+                             'session_token': bench_session_token(user_index)})
+
+
+class Teacher:
+    """Un enseignant simulé qui enchaîne des sessions complètes."""
+
+    def __init__(self, client, recorder, options, rng):
+        self._client = client
+        self._recorder = recorder
+        self._options = options
+        self._rng = rng
+
+    def _call(self, name, method, path, json_body=None, expected=(200,)):
+        started = time.perf_counter()
+        try:
+            status, body, content_type = self._client.request(method, path, json_body)
+        except Exception as e:
+            self._recorder.record(name, time.perf_counter() - started, ok=False)
+            raise RuntimeError(f"{name} : {e}") from e
+        ok = status in expected
+        self._recorder.record(name, time.perf_counter() - started, ok=ok)
+        if not ok:
+            raise RuntimeError(f"{name} : HTTP {status}")
+        return json.loads(body) if 'json' in content_type else body
+
+    def _answer(self, flow, step, reply):
+        if step == 'select_option':
+            return FLOW_CHOICES[flow]
+        if reply.get('is_text_input'):
+            return TEXT_ANSWERS.get(step, "Réponse libre")
+        choices = [option for option in reply.get('options', []) if option not in BACK_OPTIONS]
+        if not choices:
+            raise RuntimeError(f"Aucune option proposée à l'étape {step}")
+        return self._rng.choice(choices)
+
+    def run_session(self, flow):
+        session_started = time.perf_counter()
+        unique = self._rng.random() >= self._options.repeat_ratio
+        # Une leçon unique force un appel au LLM ; une leçon répétée peut venir du cache.
+        # Le suffixe ne dépend pas de --seed, pour ne pas retrouver le cache SQLite d'un run précédent.
+        suffix = f" ({uuid.uuid4().hex[:8]})" if unique else ""
+
+        reply = self._call('POST /api/chat', 'POST', '/api/chat', {'message': "Français", 'state': {}})
+        state = reply['state']
+        for _ in range(30):
+            step = state.get('currentStep')
+            message = self._answer(flow, step, reply)
+            if step in UNIQUE_STEPS:
+                message += suffix
+            reply = self._call('POST /api/chat', 'POST', '/api/chat', {'message': message, 'state': state},
+                               expected=(200, 202))
+            state = reply['state']
+            if 'job_id' in reply:
+                break
+        else:
+            raise RuntimeError(f"Le parcours '{flow}' n'a pas atteint la génération")
+
+        generation_started = time.perf_counter()
+        result = (self._stream_job(reply['job_id']) if self._options.stream
+                  else self._poll_job(reply['job_id']))
+        self._recorder.record('generation (submit -> done)', time.perf_counter() - generation_started,
+                              ok=result.get('status') == 'done' and 'generated_text' in result.get('state', {}))
+        state = result.get('state', state)
+
+        if not self._options.skip_pdf and state.get('generated_text'):
+            pdf = self._call('POST /api/generate-pdf', 'POST', '/api/generate-pdf',
+                             {'markdown_text': state['generated_text'], 'state': state,
+                              'engine': self._options.engine})
+            self._call('GET /api/download', 'GET', pdf['download_url'])
+        self._recorder.record(f'session complète ({flow})', time.perf_counter() - session_started)
+
+    def _poll_job(self, job_id):
+        while True:
+            job = self._call('GET /api/jobs/<id>', 'GET', f"/api/jobs/{job_id}")
+            if job['status'] in ('done', 'error'):
+                return job
+            time.sleep(self._options.poll_interval)
+
+    def _stream_job(self, job_id):
+        started = time.perf_counter()
+        first_chunk_seen = False
+        event = None
+        for line in self._client.stream_lines(f"/api/chat/stream/{job_id}"):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                if event == 'chunk' and not first_chunk_seen:
+                    first_chunk_seen = True
+                    self._recorder.record('SSE premier morceau', time.perf_counter() - started)
+                elif event == 'done':
+                    self._recorder.record('GET /api/chat/stream/<id>', time.perf_counter() - started)
+                    return json.loads(line[len('data: '):])
+        self._recorder.record('GET /api/chat/stream/<id>', time.perf_counter() - started, ok=False)
+        raise RuntimeError("Flux SSE interrompu avant l'événement 'done'")
+
+
+def run(options):
+    if options.target == 'inprocess':
+        from benchmarks.bench_app import app
+        make_client = lambda index: InProcessClient(app, session_cookie(app.secret_key, index))  # noqa: E731
+    else:
+        secret_key = os.environ["APP_SECRET_KEY"]
+        make_client = lambda index: HTTPClient(options.target, session_cookie(secret_key, index))  # noqa: E731
+
+    flows = [flow.strip() for flow in options.flows.split(',') if flow.strip()]
+    recorder = Recorder()
+    failures = []
+    failures_lock = threading.Lock()
+
+    def teacher_loop(index):
+        rng = random.Random(options.seed * 100003 + index)
+        teacher = Teacher(make_client(index), recorder, options, rng)
+        for _ in range(options.sessions):
+            flow = rng.choice(flows)
+            try:
+                teacher.run_session(flow)
+            except Exception as e:
+                with failures_lock:
+                    failures.append(f"enseignant {index}, {flow} : {e}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.teachers) as pool:
+        for index in range(options.teachers):
+            if options.ramp_up:
+                time.sleep(options.ramp_up / options.teachers)
+            pool.submit(teacher_loop, index)
+    wall_time = time.perf_counter() - started
+
+    return {
+        'target': options.target,
+        'teachers': options.teachers,
+        'sessions_per_teacher': options.sessions,
+        'wall_time_s': wall_time,
+        'endpoints': recorder.report(wall_time),
+        'failures': failures,
+    }
+
+
+def print_report(report):
+    print(f"\nCible : {report['target']} - {report['teachers']} enseignants x "
+          f"{report['sessions_per_teacher']} sessions en {report['wall_time_s']:.1f}s\n")
+    header = f"{'endpoint':<38} {'n':>6} {'err':>5} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report['endpoints'].items():
+        print(f"{name:<38} {row['count']:>6} {row['errors']:>5} {row['throughput_per_s']:>7.2f} "
+              f"{row['p50']:>8.3f} {row['p95']:>8.3f} {row['p99']:>8.3f} {row['max']:>8.3f}")
+    if report['failures']:
+        print(f"\n{len(report['failures'])} session(s) en échec, par exemple :")
+        for failure in report['failures'][:5]:
+            print(f"  - {failure}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge du parcours chat -> génération -> PDF.")
+    parser.add_argument('--target', default='inprocess',
+                        help="'inprocess' ou l'URL d'un serveur lancé avec benchmarks.bench_app:app")
+    parser.add_argument('--teachers', type=int, default=10, help="enseignants simulés en parallèle")
+    parser.add_argument('--sessions', type=int, default=2, help="sessions complètes par enseignant")
+    parser.add_argument('--flows', default=','.join(FLOW_CHOICES), help="parcours tirés au sort")
+    parser.add_argument('--repeat-ratio', type=float, default=0.0,
+                        help="part des sessions qui redemandent la même leçon (succès du cache)")
+    parser.add_argument('--stream', action='store_true', help="suivre la génération en SSE plutôt qu'en polling")
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--skip-pdf', action='store_true', help="ne pas appeler /api/generate-pdf (sans pandoc)")
+    parser.add_argument('--engine', choices=('latex', 'typst'),
+                        help="moteur PDF demandé (défaut : PDF_ENGINE du serveur)")
+    parser.add_argument('--ramp-up', type=float, default=0.0, help="durée (s) d'arrivée des enseignants")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="écrit aussi le rapport dans ce fichier (comparaison entre versions)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    report = run(options)
+    print_report(report)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report['failures'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
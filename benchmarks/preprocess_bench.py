@@ -0,0 +1,123 @@
+# benchmarks/preprocess_bench.py - Corpus de référence et micro-benchmarks du prétraitement markdown
+#
+# Vérifie d'abord markdown_preprocess.prepare_markdown sur le corpus de référence
+# (preprocess_golden.json) : sortie identique à l'ancien prétraitement de utils.py
+# pour les cas 'cases', sortie corrigée pour les cas Beamer de 'fixes'. Mesure ensuite
+# le temps de préparation de gros documents construits à partir du corpus : leçon
+# (commentaires et jeu bilingue), évaluation à long corrigé, présentation Beamer.
+#
+# Exemples :
+#   python -m benchmarks.preprocess_bench
+#   python -m benchmarks.preprocess_bench --size-kb 2000 --repeat 50
+#   python -m benchmarks.preprocess_bench --check-only
+
+import argparse
+import difflib
+import json
+import os
+import statistics
+import time
+
+from markdown_preprocess import prepare_markdown
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocess_golden.json')
+
+# Document de chaque micro-benchmark : cas du corpus servant de base, et partie répétée
+# jusqu'à la taille voulue (le texte avant le jeu bilingue, le corrigé, les diapositives).
+BENCH_DOCUMENTS = {
+    'lecon': ('lecon_commentaires', '<bilingual_data>'),
+    'evaluation': ('evaluation_long_corrige', None),
+    'digital': ('digital_listes_profondes', None),
+}
+
+
+def load_golden(path=GOLDEN_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def check_golden(golden):
+    """Renvoie la liste des cas du corpus dont la sortie diffère de la sortie attendue."""
+    failures = []
+    for group in ('cases', 'fixes'):
+        for case in golden[group]:
+            output = prepare_markdown(case['input'], case['lang'], case['doc_type'], case['output_format'])
+            if output != case['expected']:
+                diff = difflib.unified_diff(case['expected'].split('\n'), output.split('\n'),
+                                            'attendu', 'obtenu', lineterm='', n=1)
+                failures.append((f"{group}/{case['name']}", list(diff)[:20]))
+    return failures
+
+
+def build_document(case, split_marker, size_bytes):
+    """Agrandit l'entrée du cas jusqu'à `size_bytes` en répétant sa partie principale."""
+    text = case['input']
+    if split_marker and split_marker in text:
+        body, marker, tail = text.partition(split_marker)
+        tail = marker + tail
+    else:
+        body, tail = text, ""
+    copies = max(1, size_bytes // max(1, len(body.encode('utf-8'))))
+    return (body + "\n\n") * copies + tail
+
+
+def run_benchmarks(golden, size_kb, repeat):
+    cases = {case['name']: case for case in golden['cases']}
+    results = []
+    for label, (case_name, split_marker) in BENCH_DOCUMENTS.items():
+        case = cases[case_name]
+        text = build_document(case, split_marker, size_kb * 1024)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            prepare_markdown(text, case['lang'], case['doc_type'], case['output_format'])
+            timings.append(time.perf_counter() - started)
+        size_mb = len(text.encode('utf-8')) / 1024 / 1024
+        results.append({'document': f"{label} ({case['output_format']})", 'size_kb': round(size_mb * 1024),
+                        'best_ms': min(timings) * 1000, 'median_ms': statistics.median(timings) * 1000,
+                        'mb_per_s': size_mb / min(timings)})
+    return results
+
+
+def print_results(results):
+    header = f"{'document':<22} {'Ko':>7} {'min (ms)':>10} {'médiane (ms)':>13} {'Mo/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(f"{row['document']:<22} {row['size_kb']:>7} {row['best_ms']:>10.2f} "
+              f"{row['median_ms']:>13.2f} {row['mb_per_s']:>8.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Corpus de référence et micro-benchmarks du prétraitement markdown.")
+    parser.add_argument('--size-kb', type=int, default=500, help="taille des documents mesurés")
+    parser.add_argument('--repeat', type=int, default=20, help="mesures par document")
+    parser.add_argument('--check-only', action='store_true', help="vérifier le corpus sans mesurer")
+    parser.add_argument('--json', help="écrit aussi les mesures dans ce fichier (comparaison entre versions)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    golden = load_golden()
+    failures = check_golden(golden)
+    total = len(golden['cases']) + len(golden['fixes'])
+    if failures:
+        print(f"Corpus de référence : {len(failures)}/{total} cas en écart")
+        for name, diff in failures:
+            print(f"\n--- {name}")
+            print('\n'.join(diff))
+        return 1
+    print(f"Corpus de référence : {total} cas conformes.\n")
+    if options.check_only:
+        return 0
+    results = run_benchmarks(golden, options.size_kb, options.repeat)
+    print_results(results)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
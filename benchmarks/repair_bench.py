@@ -0,0 +1,114 @@
+# benchmarks/repair_bench.py - Corpus de référence et micro-benchmark de la réparation du markdown
+#
+# Vérifie markdown_repair.repair_markdown sur le corpus de référence (repair_golden.json) :
+# sortie attendue de chaque cas. Vérifie ensuite l'idempotence, repair(repair(x)) ==
+# repair(x), sur toutes les entrées de ce corpus et de celui du prétraitement, dans chaque
+# mode (le texte réparé garde sa clé dans le cache de rendu). Mesure enfin le temps de
+# réparation d'un gros document construit à partir du corpus.
+#
+# Exemples :
+#   python -m benchmarks.repair_bench
+#   python -m benchmarks.repair_bench --size-kb 2000 --repeat 10
+#   python -m benchmarks.repair_bench --check-only
+
+import argparse
+import difflib
+import json
+import os
+import statistics
+import time
+
+from markdown_repair import repair_markdown
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(BENCH_DIR, 'repair_golden.json')
+PREPROCESS_GOLDEN_PATH = os.path.join(BENCH_DIR, 'preprocess_golden.json')
+
+
+def load_golden(path=GOLDEN_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def check_golden(golden):
+    """Renvoie la liste des cas dont la sortie diffère de l'attendu."""
+    failures = []
+    for case in golden['cases']:
+        output, _ = repair_markdown(case['input'], case['doc_type'], strict=case['strict'])
+        if output != case['expected']:
+            diff = difflib.unified_diff(case['expected'].split('\n'), output.split('\n'),
+                                        'attendu', 'obtenu', lineterm='', n=1)
+            failures.append((case['name'], list(diff)[:20]))
+    return failures
+
+
+def check_idempotence(cases):
+    """
+    Renvoie la liste des cas dont la sortie réparée change à une seconde réparation, chaque
+    entrée étant réparée en mode normal et strict.
+    """
+    failures = []
+    for case in cases:
+        for strict in (False, True):
+            output, _ = repair_markdown(case['input'], case['doc_type'], strict=strict)
+            again, _ = repair_markdown(output, case['doc_type'], strict=strict)
+            if again != output:
+                diff = difflib.unified_diff(output.split('\n'), again.split('\n'),
+                                            'réparé', 'réparé deux fois', lineterm='', n=1)
+                mode = 'strict' if strict else 'normal'
+                failures.append((f"{case['name']} (seconde réparation, {mode})", list(diff)[:20]))
+    return failures
+
+
+def run_benchmark(golden, size_kb, repeat):
+    """Répare un document fait de tous les cas du corpus, répétés jusqu'à `size_kb`."""
+    body = "\n\n".join(case['input'] for case in golden['cases'] if not case['strict']) + "\n\n"
+    text = body * max(1, size_kb * 1024 // len(body.encode('utf-8')))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        repair_markdown(text, 'lecon')
+        timings.append(time.perf_counter() - started)
+    size_mb = len(text.encode('utf-8')) / 1024 / 1024
+    return {'size_kb': round(size_mb * 1024), 'best_ms': min(timings) * 1000,
+            'median_ms': statistics.median(timings) * 1000, 'mb_per_s': size_mb / min(timings)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Corpus de référence et micro-benchmark de la réparation du markdown.")
+    parser.add_argument('--size-kb', type=int, default=500, help="taille du document mesuré")
+    parser.add_argument('--repeat', type=int, default=10, help="mesures")
+    parser.add_argument('--check-only', action='store_true', help="vérifier le corpus sans mesurer")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    golden = load_golden()
+    failures = check_golden(golden)
+    if failures:
+        print(f"Corpus de référence : {len(failures)}/{len(golden['cases'])} cas en écart")
+        for name, diff in failures:
+            print(f"\n--- {name}")
+            print('\n'.join(diff))
+        return 1
+    print(f"Corpus de référence : {len(golden['cases'])} cas conformes.")
+    cases = golden['cases'] + load_golden(PREPROCESS_GOLDEN_PATH)['cases']
+    failures = check_idempotence(cases)
+    if failures:
+        print(f"Idempotence : {len(failures)} réparations instables")
+        for name, diff in failures:
+            print(f"\n--- {name}")
+            print('\n'.join(diff))
+        return 1
+    print(f"Idempotence : {len(cases)} entrées stables en mode normal et strict.\n")
+    if options.check_only:
+        return 0
+    row = run_benchmark(golden, options.size_kb, options.repeat)
+    print(f"{row['size_kb']} Ko : min {row['best_ms']:.1f} ms, médiane {row['median_ms']:.1f} ms, "
+          f"{row['mb_per_s']:.1f} Mo/s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
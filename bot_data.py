@@ -13,6 +13,9 @@ AUTRE_OPTION_EN = "✍️ Other (specify)"
 # =======================================================================
 REGENERATE_OPTION_FR = " régénérer"
 REGENERATE_OPTION_EN = "Regenerate"
+# Nouveau rendu du même texte, réparé (voir markdown_repair.py), sans appel au LLM.
+RETRY_RENDER_OPTION_FR = "Réessayer la mise en page"
+RETRY_RENDER_OPTION_EN = "Retry the layout"
 
 # =======================================================================
 # SOUS-SYSTÈMES
@@ -12,6 +12,142 @@ GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 APP_SECRET_KEY = os.getenv("APP_SECRET_KEY")
 
+# =======================================================================
+# SECTION 1.5 : PARAMÈTRES DE PERFORMANCE
+# =======================================================================
+# Nombre de générations LLM exécutées en parallèle par processus (indépendant des workers web)
+LLM_EXECUTOR_WORKERS = int(os.getenv("LLM_EXECUTOR_WORKERS", "4"))
+# Nombre maximum de générations en attente avant de refuser de nouvelles demandes
+LLM_JOB_QUEUE_MAX = int(os.getenv("LLM_JOB_QUEUE_MAX", "32"))
+# Durée (en secondes) pendant laquelle le résultat d'une génération reste consultable
+LLM_JOB_RESULT_TTL = int(os.getenv("LLM_JOB_RESULT_TTL", "900"))
+# État et résultat des générations, partagés par tous les processus de la machine (voir
+# jobs.py) : /api/jobs répond quel que soit le worker gunicorn qui reçoit l'interrogation.
+# Vide : état gardé dans la mémoire du seul processus qui exécute la génération, ce qui
+# impose un seul worker. Entre plusieurs machines, le répartiteur doit garder chaque
+# utilisateur sur la même instance (sessions persistantes).
+JOB_STORE_DB_PATH = os.getenv("JOB_STORE_DB_PATH", "/tmp/tchatchiai_cache/jobs.sqlite3")
+# Budget total d'une génération (file d'attente + toutes les tentatives LLM), en secondes.
+# La génération tourne dans un job (jobs.py), hors de toute requête HTTP : le '--timeout'
+# de gunicorn (workers gthread) ne surveille que le battement du worker et ne la borne pas.
+# Seuls comptent l'attente que le client accepte en interrogeant /api/jobs (ou le flux SSE)
+# et LLM_JOB_RESULT_TTL, pendant lequel le résultat reste consultable une fois terminé.
+GENERATION_DEADLINE = float(os.getenv("GENERATION_DEADLINE", "115"))
+# Timeout maximal d'un appel à un fournisseur, et temps minimal pour qu'une tentative vaille la peine
+LLM_PROVIDER_TIMEOUT = float(os.getenv("LLM_PROVIDER_TIMEOUT", "110"))
+LLM_MIN_ATTEMPT_SECONDS = float(os.getenv("LLM_MIN_ATTEMPT_SECONDS", "15"))
+# Nombre de mesures de latence conservées par fournisseur LLM
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Requêtes couvertes ("hedging") : si Gemini n'a pas répondu après un délai égal au
+# percentile LLM_HEDGE_PERCENTILE de ses latences récentes, OpenAI est interrogé en parallèle.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "90"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "30"))  # tant qu'il y a trop peu de mesures
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "5"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "60"))
+# Disjoncteurs des fournisseurs LLM : après N échecs (ou appels trop lents) sur la fenêtre,
+# le fournisseur est ignoré pendant LLM_BREAKER_COOLDOWN secondes puis re-testé.
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "3"))
+LLM_BREAKER_WINDOW = float(os.getenv("LLM_BREAKER_WINDOW", "120"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+LLM_BREAKER_SLOW_CALL = float(os.getenv("LLM_BREAKER_SLOW_CALL", "90"))
+# Cache des documents générés (voir generation_cache.py)
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+GENERATION_CACHE_BACKENDS = os.getenv("GENERATION_CACHE_BACKENDS", "memory,sqlite")
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "256"))
+GENERATION_CACHE_DB_PATH = os.getenv("GENERATION_CACHE_DB_PATH", "/tmp/tchatchiai_cache/generations.sqlite3")
+# Clients LLM partagés (voir llm_clients.py) : pool de connexions HTTP keep-alive vers OpenAI
+# et pré-chauffage des connexions au démarrage de chaque worker.
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "120"))
+LLM_WARMUP_ENABLED = os.getenv("LLM_WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Fournisseur LLM simulé (voir mock_llm.py) : remplace Gemini et OpenAI pour les tests de charge
+# locaux. Distributions de latence : fixed, uniform, normal, lognormal (MEDIAN en secondes,
+# SPREAD = sigma du lognormal ou écart relatif pour les autres).
+LLM_MOCK_ENABLED = os.getenv("LLM_MOCK_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_MOCK_LATENCY_DISTRIBUTION = os.getenv("LLM_MOCK_LATENCY_DISTRIBUTION", "lognormal")
+LLM_MOCK_LATENCY_MEDIAN = float(os.getenv("LLM_MOCK_LATENCY_MEDIAN", "8"))
+LLM_MOCK_LATENCY_SPREAD = float(os.getenv("LLM_MOCK_LATENCY_SPREAD", "0.5"))
+LLM_MOCK_TTFT = float(os.getenv("LLM_MOCK_TTFT", "0.8"))  # délai avant le premier morceau
+LLM_MOCK_ERROR_RATE = float(os.getenv("LLM_MOCK_ERROR_RATE", "0"))
+LLM_MOCK_TIMEOUT_RATE = float(os.getenv("LLM_MOCK_TIMEOUT_RATE", "0"))
+# Réglages propres à un fournisseur, en JSON, ex : '{"gemini": {"error_rate": 0.5}}'
+LLM_MOCK_PROVIDER_OVERRIDES = os.getenv("LLM_MOCK_PROVIDER_OVERRIDES", "")
+LLM_MOCK_SEED = os.getenv("LLM_MOCK_SEED")
+# Pool de rendu PDF (voir render_pool.py) : processus dédiés à pandoc/xelatex, pour que les
+# rendus lourds (Beamer) ne bloquent pas les workers web. Par défaut, un processus par cœur.
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", str(os.cpu_count() or 2)))
+# Nombre maximum de rendus en cours ou en attente ; au-delà, /api/generate-pdf répond 503
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "16"))
+# Attente maximale d'un rendu (file d'attente comprise), en secondes
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "90"))
+# Cache des PDF rendus (voir render_cache.py), indexé par le contenu : un même markdown
+# téléchargé deux fois n'est rendu qu'une fois. Taille bornée, éviction LRU.
+RENDER_CACHE_ENABLED = os.getenv("RENDER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", "/tmp/tchatchiai_cache/pdf")
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+# Préambules LaTeX précompilés (voir latex_formats.py) : les packages et le thème Beamer
+# sont chargés une fois dans un fichier .fmt au lieu d'être relus à chaque rendu.
+LATEX_FORMAT_ENABLED = os.getenv("LATEX_FORMAT_ENABLED", "true").lower() in ("1", "true", "yes")
+LATEX_FORMAT_DIR = os.getenv("LATEX_FORMAT_DIR", "/tmp/tchatchiai_cache/latex_formats")
+# Exports DOCX / HTML autonome sans LaTeX (voir export_formats.py) : dossier du document
+# de référence DOCX (styles et en-tête d'images), construit au premier export.
+EXPORT_TEMPLATE_DIR = os.getenv("EXPORT_TEMPLATE_DIR", "/tmp/tchatchiai_cache/export_templates")
+# Limites des sous-processus de rendu pandoc / xelatex / typst (voir render_limits.py) : une
+# sortie de LLM pathologique ne doit pas monopoliser l'instance. 0 désactive une limite.
+RENDER_SUBPROCESS_TIMEOUT = float(os.getenv("RENDER_SUBPROCESS_TIMEOUT", "60"))  # temps réel par rendu, en secondes
+RENDER_CPU_SECONDS = int(os.getenv("RENDER_CPU_SECONDS", "60"))  # temps CPU par processus
+RENDER_MEMORY_MB = int(os.getenv("RENDER_MEMORY_MB", "2048"))  # mémoire virtuelle par processus
+RENDER_MAX_FILE_MB = int(os.getenv("RENDER_MAX_FILE_MB", "200"))  # taille d'un fichier écrit
+RENDER_MAX_PAGES = int(os.getenv("RENDER_MAX_PAGES", "300"))  # pages du PDF produit
+# Rendus de préchauffage au démarrage du worker (formats, polices, processus du pool)
+RENDER_WARMUP_ENABLED = os.getenv("RENDER_WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Moteur PDF par défaut : 'latex' (pandoc + xelatex) ou 'typst' (voir typst_engine.py, bien
+# plus rapide). Une requête peut en demander un autre ; LaTeX sert toujours de repli.
+PDF_ENGINES = ('latex', 'typst')
+PDF_ENGINE = os.getenv("PDF_ENGINE", "latex").lower()
+if PDF_ENGINE not in PDF_ENGINES:
+    PDF_ENGINE = 'latex'
+# Conversions markdown -> LaTeX/Typst par un `pandoc server` persistant (voir pandoc_server.py)
+# plutôt qu'un processus pandoc par document. Repli automatique sur pypandoc.
+PANDOC_SERVER_ENABLED = os.getenv("PANDOC_SERVER_ENABLED", "true").lower() in ("1", "true", "yes")
+PANDOC_SERVER_TIMEOUT = float(os.getenv("PANDOC_SERVER_TIMEOUT", "30"))  # par conversion, en secondes
+PANDOC_SERVER_HEALTH_INTERVAL = float(os.getenv("PANDOC_SERVER_HEALTH_INTERVAL", "30"))  # inactivité avant vérification
+PANDOC_SERVER_COOLDOWN = float(os.getenv("PANDOC_SERVER_COOLDOWN", "300"))  # pause après des démarrages ratés
+# Rendu anticipé du PDF dès la fin d'une génération (voir prerender.py) : le document est
+# déjà dans le cache de rendu quand l'enseignant clique sur "Télécharger".
+PRERENDER_ENABLED = os.getenv("PRERENDER_ENABLED", "true").lower() in ("1", "true", "yes")
+PRERENDER_WORKERS = int(os.getenv("PRERENDER_WORKERS", "2"))  # places de la file de rendu utilisables
+# Dossier des PDF en attente de téléchargement (voir downloads.py) : les PDF sont conservés
+# DOWNLOAD_TTL secondes (reprise des téléchargements interrompus), et le dossier est borné en taille.
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "/tmp/tchatchiai_downloads")
+DOWNLOAD_TTL = int(os.getenv("DOWNLOAD_TTL", "3600"))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+DOWNLOAD_JANITOR_INTERVAL = int(os.getenv("DOWNLOAD_JANITOR_INTERVAL", "300"))
+# Stockage des PDF prêts à télécharger (voir artifact_store.py) : 'local' (une seule
+# instance) ou 's3' (bucket compatible S3 partagé, nécessaire dès qu'il y a plusieurs instances).
+# Identifiants S3 : AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY, lus par boto3.
+ARTIFACT_STORE = os.getenv("ARTIFACT_STORE", "local").lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "downloads/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")  # ex : http://localhost:9000 pour MinIO
+S3_REGION = os.getenv("S3_REGION", "")
+# Envoi des PDF locaux par le serveur frontal plutôt que par Python : '' (send_file, avec
+# Range et ETag), 'x-accel-redirect' (nginx, location interne DOWNLOAD_ACCEL_PREFIX pointant
+# sur DOWNLOAD_DIR) ou 'x-sendfile' (Apache mod_xsendfile, lighttpd).
+DOWNLOAD_SENDFILE = os.getenv("DOWNLOAD_SENDFILE", "").lower()
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/protected-downloads/")
+# Export groupé de l'historique en ZIP (voir history_export.py) : rendus simultanés par
+# export, et nombre maximum de documents par archive (la taille de /api/history).
+EXPORT_MAX_PARALLEL = int(os.getenv("EXPORT_MAX_PARALLEL", "3"))
+EXPORT_MAX_DOCUMENTS = int(os.getenv("EXPORT_MAX_DOCUMENTS", "50"))
+# Cache des lignes `users` lues à chaque requête authentifiée (voir user_cache.py) :
+# durée de validité en secondes (0 : une seule lecture par requête, sans cache entre requêtes).
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "5"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
 
 
 # On déplace le gros dictionnaire de traductions ici
@@ -1,76 +1,336 @@
 # core_logic.py - Version finale avec Gemini en priorité et fallback sur OpenAI
 import logging
-from openai import OpenAI
-import google.generativeai as genai
-from config import OPENAI_API_KEY, GEMINI_API_KEY, TITLES
+import queue
+import threading
+import time
+from config import (TITLES, LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE,
+                    LLM_HEDGE_DEFAULT_DELAY, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MAX_DELAY,
+                    LLM_PROVIDER_TIMEOUT, LLM_MIN_ATTEMPT_SECONDS, LLM_MOCK_ENABLED)
+from deadlines import DeadlineExceeded
+from llm_health import latency_tracker, llm_breakers
+from generation_cache import generation_cache, make_cache_key, template_version
+from llm_clients import llm_clients, GEMINI_MODEL_NAME, OPENAI_MODEL_NAME
+from mock_llm import mock_llm
 
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- CONFIGURATION DES CLIENTS API ---
+# Les clients Gemini et OpenAI sont créés une fois par processus dans llm_clients.py.
 
-# Client OpenAI (pour le fallback)
-if not OPENAI_API_KEY:
-    logging.warning("Clé OPENAI_API_KEY non trouvée. Le fallback OpenAI est désactivé.")
-openai_client = OpenAI(api_key=OPENAI_API_KEY, timeout=110)
+# --- NOUVELLE FONCTION D'APPEL API AVEC GEMINI EN PRIORITÉ ---
 
-# Client Gemini (principal)
-if not GEMINI_API_KEY:
-    logging.warning("Clé GEMINI_API_KEY non trouvée. Le service principal pourrait ne pas fonctionner.")
-else:
+class LLMCallCancelled(Exception):
+    """Levée quand un appel a été abandonné parce qu'un autre fournisseur a gagné la course."""
+
+
+class LLMProviderUnavailable(Exception):
+    """Levée quand un fournisseur est ignoré parce que son disjoncteur est ouvert."""
+
+
+def _check_stream_alive(provider, cancel_event, stop_at):
+    """Interrompt une lecture en streaming annulée ou qui dépasse son timeout."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise LLMCallCancelled(provider)
+    if time.monotonic() > stop_at:
+        raise TimeoutError(f"Le flux {provider} a dépassé son timeout.")
+
+
+def _call_gemini(prompt, timeout, on_chunk=None, cancel_event=None):
+    """Appel brut à Gemini, en streaming si `on_chunk` est fourni."""
+    model = llm_clients.gemini_model(GEMINI_MODEL_NAME)
+    if not on_chunk:
+        response = model.generate_content(prompt, request_options={'timeout': timeout})
+        return response.text
+    stop_at = time.monotonic() + timeout
+    response = model.generate_content(prompt, stream=True, request_options={'timeout': timeout})
+    parts = []
+    for chunk in response:
+        _check_stream_alive("gemini", cancel_event, stop_at)
+        if chunk.text:
+            parts.append(chunk.text)
+            on_chunk(chunk.text)
+    return "".join(parts)
+
+
+def _call_openai(prompt, timeout, on_chunk=None, cancel_event=None):
+    """Appel brut à OpenAI, en streaming si `on_chunk` est fourni."""
+    response = llm_clients.openai.chat.completions.create(
+        model=OPENAI_MODEL_NAME,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.7,
+        max_tokens=4000,
+        stream=bool(on_chunk),
+        timeout=timeout
+    )
+    if not on_chunk:
+        return response.choices[0].message.content
+    stop_at = time.monotonic() + timeout
+    parts = []
     try:
-        genai.configure(
-            api_key=GEMINI_API_KEY,
-            transport='rest', # Important pour que le timeout soit respecté
-            client_options={'api_endpoint': 'generativelanguage.googleapis.com'}
-        )
+        for chunk in response:
+            _check_stream_alive("openai", cancel_event, stop_at)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                on_chunk(delta)
+    finally:
+        # Ferme la connexion HTTP, y compris quand l'appel est annulé en cours de route.
+        response.close()
+    return "".join(parts)
+
+
+def _mock_call(provider):
+    """Appel simulé (mock_llm.py) avec la même signature que les appels réels."""
+    def call(prompt, timeout, on_chunk=None, cancel_event=None):
+        stop_at = time.monotonic() + timeout
+        return mock_llm.generate(provider, prompt, timeout, on_chunk=on_chunk,
+                                 check_alive=lambda: _check_stream_alive(provider, cancel_event, stop_at))
+    return call
+
+
+LLM_PROVIDERS = {
+    'gemini': {'call': _call_gemini, 'label': "Gemini (Principal)"},
+    'openai': {'call': _call_openai, 'label': "OpenAI (Fallback)"},
+}
+if LLM_MOCK_ENABLED:
+    logging.warning("LLM_MOCK_ENABLED : Gemini et OpenAI sont remplacés par le fournisseur simulé.")
+    for _provider, _entry in LLM_PROVIDERS.items():
+        _entry['call'] = _mock_call(_provider)
+        _entry['label'] += " [simulé]"
+
+
+def _provider_order(model_provider):
+    """Fournisseurs à essayer, dans l'ordre, parmi ceux dont la clé est configurée."""
+    order = ['gemini', 'openai'] if model_provider == 'gemini' else [model_provider]
+    if LLM_MOCK_ENABLED:
+        available = {'gemini': True, 'openai': True}
+    else:
+        available = {'gemini': llm_clients.gemini_enabled, 'openai': llm_clients.openai is not None}
+    return [provider for provider in order if available.get(provider)]
+
+
+def _attempt_timeout(deadline):
+    """Timeout d'une tentative : le budget restant de la requête, plafonné à LLM_PROVIDER_TIMEOUT."""
+    if deadline is None:
+        return LLM_PROVIDER_TIMEOUT
+    return deadline.timeout_for(LLM_PROVIDER_TIMEOUT, LLM_MIN_ATTEMPT_SECONDS)
+
+
+def _call_provider(provider, prompt, timeout, on_chunk=None, cancel_event=None):
+    """
+    Appelle un fournisseur en mesurant sa latence (réponse complète et premier morceau)
+    et en informant son disjoncteur du résultat. L'autorisation du disjoncteur doit
+    avoir été obtenue par l'appelant (voir _breaker_allows).
+    """
+    label = LLM_PROVIDERS[provider]['label']
+    logging.info(f"Tentative d'appel à l'API {label} (timeout {timeout:.0f}s)...")
+    started = time.monotonic()
+
+    timed_on_chunk = None
+    if on_chunk:
+        first_chunk_seen = []
+
+        def timed_on_chunk(text):
+            if not first_chunk_seen:
+                first_chunk_seen.append(True)
+                latency_tracker.record(f"{provider}:ttft", time.monotonic() - started)
+            on_chunk(text)
+
+    try:
+        text = LLM_PROVIDERS[provider]['call'](prompt, timeout, on_chunk=timed_on_chunk, cancel_event=cancel_event)
+    except LLMCallCancelled:
+        raise  # Une annulation ne dit rien de la santé du fournisseur.
     except Exception as e:
-        logging.error(f"Erreur de configuration de l'API Gemini: {e}")
-        GEMINI_API_KEY = None
+        llm_breakers[provider].record_failure(reason=type(e).__name__)
+        raise
+    latency = time.monotonic() - started
+    latency_tracker.record(provider, latency)
+    llm_breakers[provider].record_success(latency)
+    logging.info(f"Appel {label} réussi en {latency:.1f}s.")
+    return text
+
+
+def _breaker_allows(provider):
+    """Consulte le disjoncteur du fournisseur juste avant de l'appeler."""
+    if llm_breakers[provider].allow_request():
+        return True
+    logging.warning(f"Disjoncteur ouvert : l'API {LLM_PROVIDERS[provider]['label']} est ignorée.")
+    return False
+
+
+def _hedge_delay(provider, streaming):
+    """Délai avant la requête de couverture : percentile des latences récentes, borné."""
+    metric = f"{provider}:ttft" if streaming else provider
+    delay = latency_tracker.percentile(metric, LLM_HEDGE_PERCENTILE)
+    if delay is None:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return min(max(delay, LLM_HEDGE_MIN_DELAY), LLM_HEDGE_MAX_DELAY)
 
-# --- NOUVELLE FONCTION D'APPEL API AVEC GEMINI EN PRIORITÉ ---
 
-def call_llm_api(prompt, model_provider='gemini'):
+def _call_llm_hedged(prompt, primary, secondary, on_chunk=None, deadline=None):
     """
-    Appelle l'API du LLM spécifié, avec Gemini en priorité.
+    Lance `primary`, puis `secondary` en parallèle si `primary` n'a pas répondu
+    dans le délai de couverture. La première réponse complète l'emporte et l'autre
+    appel est annulé. En streaming, c'est le premier fournisseur à envoyer du texte
+    qui garde la main : l'autre est annulé aussitôt pour ne pas mélanger les flux.
+    Chaque tentative ne reçoit que le temps restant dans `deadline`.
     """
-    # ÉTAPE 1 : Essai avec Gemini (le service principal et moins cher)
-    if model_provider == 'gemini' and GEMINI_API_KEY:
+    results = queue.Queue()
+    cancel_events = {primary: threading.Event(), secondary: threading.Event()}
+    stream_owner = []
+    owner_lock = threading.Lock()
+
+    def cancel_others(winner):
+        for provider, event in cancel_events.items():
+            if provider != winner:
+                event.set()
+
+    def gated_on_chunk(provider):
+        def _on_chunk(text):
+            with owner_lock:
+                if not stream_owner:
+                    stream_owner.append(provider)
+                    cancel_others(provider)
+                if stream_owner[0] != provider:
+                    return
+            on_chunk(text)
+        return _on_chunk
+
+    def attempt(provider, timeout):
         try:
-            logging.info("Tentative d'appel à l'API Gemini (Principal)...")
-            model = genai.GenerativeModel("gemini-pro")
-            response = model.generate_content(prompt, request_options={'timeout': 110})
-            logging.info("Appel Gemini (Principal) réussi.")
-            return response.text
+            text = _call_provider(provider, prompt, timeout, gated_on_chunk(provider) if on_chunk else None,
+                                  cancel_events[provider])
+            results.put((provider, text, None))
         except Exception as e:
-            logging.error(f"ERREUR lors de l'appel à l'API Gemini (Principal): {e}")
-            logging.warning("Basculement vers l'API OpenAI (Fallback) en raison de l'erreur Gemini.")
-            # Si Gemini échoue, on relance l'appel en demandant OpenAI
-            return call_llm_api(prompt, model_provider='openai')
+            results.put((provider, None, e))
 
-    # ÉTAPE 2 : Fallback sur OpenAI si Gemini a échoué ou n'était pas disponible
-    elif model_provider == 'openai' and OPENAI_API_KEY:
-        try:
-            logging.info("Tentative d'appel à l'API OpenAI (Fallback)...")
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=4000
-            )
-            logging.info("Appel OpenAI (Fallback) réussi.")
-            return response.choices[0].message.content
-        except Exception as e:
-            logging.error(f"ERREUR lors de l'appel à l'API OpenAI (Fallback): {e}")
-            # Si OpenAI échoue aussi, c'est une erreur finale
-            raise e
-    else:
+    threading.Thread(target=attempt, args=(primary, _attempt_timeout(deadline)), daemon=True).start()
+    delay = _hedge_delay(primary, streaming=bool(on_chunk))
+    try:
+        provider, text, error = results.get(timeout=delay)
+    except queue.Empty:
+        provider = None
+        with owner_lock:
+            already_streaming = bool(stream_owner)
+        if already_streaming:
+            # Le principal a déjà commencé à répondre : inutile de le couvrir.
+            provider, text, error = results.get()
+
+    if provider is not None:
+        if error is None:
+            return text
+        # Échec rapide du fournisseur principal : simple bascule, sans course.
+        logging.error(f"ERREUR lors de l'appel à l'API {LLM_PROVIDERS[primary]['label']}: {error}")
+        timeout = _attempt_timeout(deadline)
+        if not _breaker_allows(secondary):
+            raise error
+        logging.warning(f"Basculement vers l'API {LLM_PROVIDERS[secondary]['label']}.")
+        if on_chunk:
+            on_chunk(None)
+        return _call_provider(secondary, prompt, timeout, on_chunk)
+
+    try:
+        secondary_timeout = _attempt_timeout(deadline)
+    except DeadlineExceeded:
+        secondary_timeout = None
+    if secondary_timeout is None or not _breaker_allows(secondary):
+        # Pas de couverture possible : on attend simplement le fournisseur principal.
+        provider, text, error = results.get()
+        if error is not None:
+            raise error
+        return text
+
+    logging.info(f"{LLM_PROVIDERS[primary]['label']} n'a pas répondu après {delay:.1f}s : "
+                 f"requête de couverture envoyée à {LLM_PROVIDERS[secondary]['label']}.")
+    threading.Thread(target=attempt, args=(secondary, secondary_timeout), daemon=True).start()
+
+    errors = {}
+    for _ in range(2):
+        provider, text, error = results.get()
+        if error is None and on_chunk and stream_owner and stream_owner[0] != provider:
+            # Réponse d'un fournisseur dont le flux a été écarté : elle ne compte pas.
+            error = LLMCallCancelled(provider)
+        if error is None:
+            cancel_others(provider)
+            logging.info(f"Requête couverte : réponse retenue de {LLM_PROVIDERS[provider]['label']}.")
+            return text
+        logging.error(f"ERREUR lors de l'appel à l'API {LLM_PROVIDERS[provider]['label']}: {error}")
+        errors[provider] = error
+
+    # Le fournisseur qui diffusait a échoué après avoir fait annuler l'autre :
+    # on relance seul celui qui avait été annulé.
+    cancelled = [provider for provider, error in errors.items() if isinstance(error, LLMCallCancelled)]
+    if cancelled:
+        timeout = _attempt_timeout(deadline)
+        if on_chunk:
+            on_chunk(None)
+        return _call_provider(cancelled[0], prompt, timeout, on_chunk)
+    raise errors[secondary]
+
+
+def call_llm_api(prompt, model_provider='gemini', on_chunk=None, deadline=None):
+    """
+    Appelle l'API du LLM spécifié, avec Gemini en priorité et OpenAI en fallback.
+    Si `on_chunk` est fourni, la réponse est demandée en streaming et chaque
+    morceau de texte lui est transmis dès son arrivée. `on_chunk(None)` signale
+    que le texte déjà transmis doit être oublié (bascule vers le fallback).
+    Avec LLM_HEDGE_ENABLED, le fallback est lancé en parallèle au lieu d'attendre
+    l'échec du fournisseur principal (voir _call_llm_hedged).
+    Un fournisseur dont le disjoncteur est ouvert est ignoré sans être appelé.
+    `deadline` (voir deadlines.py) limite chaque tentative au temps restant et lève
+    DeadlineExceeded plutôt que de lancer un fallback voué à dépasser le budget.
+    Renvoie toujours le texte complet.
+    """
+    providers = _provider_order(model_provider)
+    if not providers:
         # Si aucune des deux clés n'est valide ou disponible
         error_message = "Aucune clé API (Gemini ou OpenAI) n'est configurée ou valide. Impossible de générer le contenu."
         logging.critical(error_message)
         raise ValueError(error_message)
-    
+
+    last_error = None
+    for index, provider in enumerate(providers):
+        timeout = _attempt_timeout(deadline)
+        if not _breaker_allows(provider):
+            last_error = last_error or LLMProviderUnavailable(
+                "Tous les fournisseurs LLM sont temporairement indisponibles. Veuillez réessayer dans quelques instants.")
+            continue
+        remaining = providers[index + 1:]
+        if LLM_HEDGE_ENABLED and remaining:
+            return _call_llm_hedged(prompt, provider, remaining[0], on_chunk=on_chunk, deadline=deadline)
+        try:
+            return _call_provider(provider, prompt, timeout, on_chunk)
+        except Exception as e:
+            logging.error(f"ERREUR lors de l'appel à l'API {LLM_PROVIDERS[provider]['label']}: {e}")
+            last_error = e
+            if remaining:
+                logging.warning(f"Basculement vers l'API {LLM_PROVIDERS[remaining[0]]['label']} en raison de l'erreur.")
+                if on_chunk:
+                    on_chunk(None)
+    # Si le dernier fournisseur échoue aussi (ou si tous sont coupés), c'est une erreur finale
+    raise last_error
+
+
+def generate_with_cache(flow_type, cache_inputs, final_prompt, on_chunk=None, use_cache=True, deadline=None):
+    """
+    Renvoie le document pour ces entrées depuis le cache de génération si possible,
+    sinon appelle le LLM et mémorise le résultat. `use_cache=False` (option
+    "Régénérer") ignore l'entrée existante et la remplace par la nouvelle génération.
+    """
+    key = make_cache_key(flow_type, PROMPT_VERSIONS[flow_type], cache_inputs)
+    if use_cache:
+        cached_text = generation_cache.get(key)
+        if cached_text is not None:
+            logging.info(f"Document '{flow_type}' servi depuis le cache de génération.")
+            if on_chunk:
+                on_chunk(cached_text)
+            return cached_text
+    generated_text = call_llm_api(final_prompt, on_chunk=on_chunk, deadline=deadline)
+    generation_cache.set(key, generated_text)
+    return generated_text
+
 
 # Le "Prompt Maître" pour la leçon - Version complète et vérifiée
 # Dans core_logic.py, remplacez PROMPT_UNIVERSAL
@@ -229,8 +489,8 @@ def call_openai_api(prompt):
     """Appelle l'API OpenAI."""
     try:
         logging.info("Appel à l'API OpenAI...")
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = llm_clients.openai.chat.completions.create(
+            model=OPENAI_MODEL_NAME,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
             max_tokens=4000
@@ -249,7 +509,7 @@ def call_openai_api(prompt):
 
 #LOGIQUE POUR LA LECON
 
-def generate_lesson_logic(classe, matiere, module, lecon, langue_contenu, syllabus="N/A"):
+def generate_lesson_logic(classe, matiere, module, lecon, langue_contenu, syllabus="N/A", on_chunk=None, use_cache=True, deadline=None):
     logging.info(f"Début de la génération pour la leçon : {lecon}")
     lang_contenu_input = langue_contenu.lower()
     titles_lang_code = 'fr'
@@ -283,7 +543,9 @@ def generate_lesson_logic(classe, matiere, module, lecon, langue_contenu, syllab
         header_lecon=selected_titles.get("HEADER_LECON")
     )
      # MODIFICATION : On utilise la nouvelle fonction avec fallback
-    generated_text = call_llm_api(final_prompt)
+    generated_text = generate_with_cache(
+        'lecon', dict(classe=classe, matiere=matiere, module=module, lecon=lecon, langue_contenu=langue_contenu, syllabus=syllabus),
+        final_prompt, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
     logging.info("Texte de la leçon généré avec succès.")
     return generated_text, titles_lang_code
 
@@ -367,7 +629,7 @@ Génère la fiche en format Markdown (`**Titre**`, `*italique*`, `- liste`), en
 """
 
 
-def generate_integration_logic(classe, matiere, liste_lecons, objectifs_lecons, langue_contenu):
+def generate_integration_logic(classe, matiere, liste_lecons, objectifs_lecons, langue_contenu, on_chunk=None, use_cache=True, deadline=None):
     """
     Prépare le prompt et appelle l'API OpenAI pour générer une activité d'intégration.
     """
@@ -408,7 +670,9 @@ def generate_integration_logic(classe, matiere, liste_lecons, objectifs_lecons,
 
     # Appeler l'IA 
      # MODIFICATION : On utilise la nouvelle fonction avec fallback
-    generated_text = call_llm_api(final_prompt)
+    generated_text = generate_with_cache(
+        'integration', dict(classe=classe, matiere=matiere, liste_lecons=liste_lecons, objectifs_lecons=objectifs_lecons, langue_contenu=langue_contenu),
+        final_prompt, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
     logging.info("Activité d'intégration générée avec succès.")
     
     return generated_text, titles_lang_code
@@ -542,7 +806,7 @@ Commence à générer l'épreuve complète MAINTENANT.
 """
 
 
-def generate_evaluation_logic(classe, matiere, liste_lecons, duree, coeff, langue_contenu, type_epreuve_key, contexte_syllabus):
+def generate_evaluation_logic(classe, matiere, liste_lecons, duree, coeff, langue_contenu, type_epreuve_key, contexte_syllabus, on_chunk=None, use_cache=True, deadline=None):
     """
     Prépare le prompt et appelle l'API pour générer une évaluation.
     Version corrigée pour éviter les KeyError.
@@ -592,7 +856,10 @@ def generate_evaluation_logic(classe, matiere, liste_lecons, duree, coeff, langu
     # --- FIN DE LA CORRECTION MAJEURE ---
 
     # On appelle l'IA avec le prompt maintenant correctement et complètement formaté.
-    generated_text = call_llm_api(final_prompt)
+    generated_text = generate_with_cache(
+        'evaluation', dict(classe=classe, matiere=matiere, liste_lecons=liste_lecons, duree=duree, coeff=coeff, langue_contenu=langue_contenu,
+                           type_epreuve_key=type_epreuve_key, contexte_syllabus=contexte_syllabus),
+        final_prompt, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
     logging.info("Évaluation générée avec succès.")
     
     return generated_text, titles_lang_code
@@ -715,7 +982,7 @@ Ta mission est de créer une présentation de leçon digitalisée au format Mark
 
 # FONCTION DE LA LECON DIGITALISEE
 
-def generate_digital_lesson_logic(classe, matiere, module, lecon, langue_contenu="Français", **kwargs):
+def generate_digital_lesson_logic(classe, matiere, module, lecon, langue_contenu="Français", on_chunk=None, use_cache=True, deadline=None, **kwargs):
     logging.info(f"Début de la génération de la leçon digitalisée : {lecon}")
     
     lang_contenu_input = langue_contenu.lower()
@@ -741,6 +1008,18 @@ def generate_digital_lesson_logic(classe, matiere, module, lecon, langue_contenu
     )
 
      # MODIFICATION : On utilise la nouvelle fonction avec fallback
-    generated_text = call_llm_api(final_prompt)
+    generated_text = generate_with_cache(
+        'digital', dict(classe=classe, matiere=matiere, module=module, lecon=lecon, langue_contenu=langue_contenu),
+        final_prompt, on_chunk=on_chunk, use_cache=use_cache, deadline=deadline)
     logging.info("Présentation digitalisée générée avec succès.")
-    return generated_text, titles_lang_code
\ No newline at end of file
+    return generated_text, titles_lang_code
+
+
+# Empreintes des prompts : toute modification d'un prompt ou des titres traduits
+# change la clé de cache et invalide donc les documents générés avec l'ancienne version.
+PROMPT_VERSIONS = {
+    'lecon': template_version(PROMPT_UNIVERSAL, TITLES),
+    'integration': template_version(PROMPT_INTEGRATION, TITLES),
+    'evaluation': template_version(PROMPT_EVALUATION, INSTRUCTIONS_EVALUATION, TITLES),
+    'digital': template_version(PROMPT_DIGITAL_LESSON, TITLES),
+}
@@ -0,0 +1,35 @@
+# deadlines.py - Budget de temps d'une requête, propagé jusqu'aux appels LLM
+#
+# Chaque tentative auprès d'un fournisseur ne reçoit que le temps qui reste dans le
+# budget : on échoue proprement au lieu de lancer un fallback qui n'a aucune chance
+# de se terminer à temps.
+
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Levée quand le budget restant ne suffit plus pour une nouvelle tentative."""
+
+
+class Deadline:
+    """Échéance absolue, créée au début de la requête (voir handle_chat)."""
+
+    def __init__(self, budget_seconds):
+        self.budget = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout_for(self, max_timeout, min_timeout):
+        """
+        Timeout à accorder à la prochaine tentative : le temps restant, plafonné à
+        `max_timeout`. Lève DeadlineExceeded s'il reste moins de `min_timeout`.
+        """
+        remaining = self.remaining()
+        if remaining < min_timeout:
+            raise DeadlineExceeded(f"Budget de {self.budget:.0f}s épuisé ({remaining:.1f}s restantes).")
+        return min(max_timeout, remaining)
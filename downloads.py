@@ -0,0 +1,122 @@
+# downloads.py - Dossier des PDF en attente de téléchargement, borné en âge et en taille
+#
+# /api/generate-pdf écrit le PDF dans ce dossier ; /api/download le sert autant de fois
+# que nécessaire (reprise des téléchargements interrompus). Sans ménage, les PDF y
+# restaient pour toujours, jusqu'au "No space left on device" qui casse pandoc en plein
+# rendu. Un thread de ménage supprime les fichiers plus vieux que `max_age`, et la taille
+# totale est vérifiée à chaque écriture : les fichiers les plus anciens partent d'abord.
+
+import logging
+import os
+import threading
+import time
+from config import DOWNLOAD_DIR, DOWNLOAD_TTL, DOWNLOAD_MAX_BYTES, DOWNLOAD_JANITOR_INTERVAL
+
+
+# Place gardée libre avant un rendu : pandoc/xelatex écrivent le PDF en cours de route.
+RENDER_RESERVE_BYTES = 10 * 1024 * 1024
+
+
+class DownloadFolder:
+    """
+    Le dossier peut être partagé par plusieurs workers : chacun fait le ménage,
+    et un fichier déjà supprimé par un autre est simplement ignoré.
+    """
+
+    def __init__(self, directory, max_age, max_bytes, janitor_interval):
+        self.directory = directory
+        self._max_age = max_age
+        self._max_bytes = max_bytes
+        self._janitor_interval = janitor_interval
+        self._lock = threading.Lock()
+        self._janitor = None
+        self.expired = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.is_file(follow_symlinks=False):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logging.error(f"Suppression impossible de {path} : {e}")
+            return False
+
+    def remove_expired(self):
+        """Supprime les fichiers plus vieux que `max_age` ; renvoie leur nombre."""
+        cutoff = time.time() - self._max_age
+        removed = 0
+        for mtime, size, path in self._entries():
+            if mtime < cutoff and self._remove(path):
+                removed += 1
+                with self._lock:
+                    self.expired += 1
+                    self.evicted_bytes += size
+        if removed:
+            logging.info(f"{removed} PDF non téléchargé(s) supprimé(s) de {self.directory}.")
+        return removed
+
+    def enforce_quota(self, keep=None, reserve=0):
+        """
+        Ramène le dossier sous `max_bytes - reserve` en supprimant les fichiers les
+        plus anciens, sauf `keep` (le fichier qui vient d'être écrit).
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        limit = max(0, self._max_bytes - reserve)
+        if total <= limit:
+            return
+        for _, size, path in sorted(entries):
+            if path == keep:
+                continue
+            if self._remove(path):
+                total -= size
+                with self._lock:
+                    self.evicted += 1
+                    self.evicted_bytes += size
+            if total <= limit:
+                break
+        logging.warning(f"Quota de {self.directory} atteint : dossier réduit à {total / 1024 / 1024:.1f} Mo.")
+
+    def _run_janitor(self):
+        while True:
+            try:
+                self.remove_expired()
+            except Exception as e:
+                logging.error(f"Erreur du ménage de {self.directory} : {e}")
+            time.sleep(self._janitor_interval)
+
+    def start_janitor(self):
+        """Lance le thread de ménage (une fois par worker)."""
+        with self._lock:
+            if self._janitor is None:
+                self._janitor = threading.Thread(target=self._run_janitor, name='download-janitor', daemon=True)
+                self._janitor.start()
+
+    def snapshot(self):
+        entries = self._entries()
+        with self._lock:
+            return {'files': len(entries), 'bytes': sum(size for _, size, _ in entries),
+                    'max_bytes': self._max_bytes, 'max_age': self._max_age,
+                    'expired': self.expired, 'evicted': self.evicted, 'evicted_bytes': self.evicted_bytes}
+
+
+download_folder = DownloadFolder(DOWNLOAD_DIR, DOWNLOAD_TTL, DOWNLOAD_MAX_BYTES, DOWNLOAD_JANITOR_INTERVAL)
@@ -0,0 +1,227 @@
+# export_formats.py - Export DOCX et HTML autonome, sans passer par LaTeX
+#
+# Beaucoup d'enseignants retouchent la leçon dans un traitement de texte après l'avoir
+# téléchargée : pour eux, le PDF (et les secondes de xelatex) ne sert à rien. pandoc
+# écrit directement un .docx ou une page HTML autonome en une fraction de seconde, à
+# partir du même markdown préparé par utils.create_pdf_with_pandoc (jeu bilingue,
+# séparateur du corrigé).
+#
+# L'en-tête d'images (barcode, camtrade_pass) du DOCX est porté par un document de
+# référence (--reference-doc) : le modèle par défaut de pandoc, auquel on ajoute un
+# en-tête de page contenant les deux images. Il est construit au premier usage dans
+# EXPORT_TEMPLATE_DIR, sous un nom qui dépend de pandoc et des images.
+#
+# Le markdown vient du client (/api/generate-pdf) : pandoc tourne avec --sandbox, qui
+# l'empêche de lire un fichier local ou une URL cités dans le texte (`![](/proc/self/environ)`,
+# adresse interne) pour l'intégrer au document. Les images d'en-tête du HTML sont donc
+# intégrées ici, en URI data:.
+
+import base64
+import hashlib
+import io
+import logging
+import os
+import struct
+import subprocess
+import tempfile
+import zipfile
+import pypandoc
+from config import EXPORT_TEMPLATE_DIR
+from render_limits import run_pandoc
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Format d'export -> (extension du fichier, type MIME).
+EXPORT_FORMATS = {
+    'docx': ('.docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    'html': ('.html', 'text/html'),
+}
+
+
+def output_extension(output_format):
+    """Extension du fichier rendu pour `output_format` : celle de l'export, sinon '.pdf'."""
+    return EXPORT_FORMATS.get(output_format, ('.pdf',))[0]
+
+# Images de l'en-tête : (chemin relatif, dimension imposée, valeur en cm). Mêmes
+# proportions que l'en-tête LaTeX de utils.py, réduites pour tenir dans un en-tête de page.
+HEADER_IMAGES = [
+    ('static/img/barcode.png', 'width', 3.5),
+    ('static/img/camtrade_pass.png', 'height', 1.5),
+]
+
+EMU_PER_CM = 360000
+HEADER_REL_ID = 'rIdTchatchiHeader'
+
+_HEADER_NAMESPACES = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"'
+)
+
+_DRAWING_TEMPLATE = (
+    '<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+    '<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{index}" name="{name}"/>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="{index}" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr></pic:pic>'
+    '</a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+)
+
+
+class ExportError(Exception):
+    """Levée quand l'export DOCX ou HTML est impossible."""
+
+
+def _png_size(path):
+    """Largeur et hauteur en pixels, lues dans l'en-tête IHDR du PNG."""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if header[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ExportError(f"{path} n'est pas une image PNG.")
+    return struct.unpack('>II', header[16:24])
+
+
+def _header_parts():
+    """XML de l'en-tête de page, ses relations, et les images à ajouter au document."""
+    drawings, relationships, media = [], [], {}
+    for index, (relative_path, dimension, size_cm) in enumerate(HEADER_IMAGES, start=1):
+        path = os.path.join(BASE_DIR, relative_path)
+        width, height = _png_size(path)
+        if dimension == 'width':
+            cx = int(size_cm * EMU_PER_CM)
+            cy = int(cx * height / width)
+        else:
+            cy = int(size_cm * EMU_PER_CM)
+            cx = int(cy * width / height)
+        name = os.path.basename(relative_path)
+        rel_id = f"rIdTchatchiImage{index}"
+        drawings.append(_DRAWING_TEMPLATE.format(cx=cx, cy=cy, index=index, name=name, rel_id=rel_id))
+        relationships.append(
+            f'<Relationship Id="{rel_id}" Target="media/tchatchi_{name}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"/>')
+        with open(path, 'rb') as f:
+            media[f"word/media/tchatchi_{name}"] = f.read()
+
+    spacer = '<w:r><w:t xml:space="preserve">    </w:t></w:r>'
+    header_xml = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:hdr {_HEADER_NAMESPACES}>'
+                  f'<w:p><w:pPr><w:jc w:val="center"/></w:pPr>{spacer.join(drawings)}</w:p></w:hdr>')
+    header_rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   + ''.join(relationships) + '</Relationships>')
+    return header_xml, header_rels, media
+
+
+def _add_header(default_reference):
+    """Copie du document de référence `default_reference` (octets) avec l'en-tête d'images."""
+    header_xml, header_rels, media = _header_parts()
+    source = zipfile.ZipFile(io.BytesIO(default_reference))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename == '[Content_Types].xml':
+                text = data.decode('utf-8')
+                if 'Extension="png"' not in text:
+                    text = text.replace('</Types>', '<Default Extension="png" ContentType="image/png"/></Types>')
+                text = text.replace('</Types>',
+                                    '<Override PartName="/word/header1.xml" ContentType="application/'
+                                    'vnd.openxmlformats-officedocument.wordprocessingml.header+xml"/></Types>')
+                data = text.encode('utf-8')
+            elif item.filename == 'word/_rels/document.xml.rels':
+                data = data.decode('utf-8').replace(
+                    '</Relationships>',
+                    f'<Relationship Id="{HEADER_REL_ID}" Target="header1.xml" Type="http://schemas.'
+                    'openxmlformats.org/officeDocument/2006/relationships/header"/></Relationships>').encode('utf-8')
+            elif item.filename == 'word/document.xml':
+                # Le dernier <w:sectPr> du corps porte la mise en page reprise par pandoc.
+                text = data.decode('utf-8')
+                position = text.rfind('<w:sectPr')
+                if position < 0:
+                    raise ExportError("Section absente du document de référence de pandoc.")
+                position = text.index('>', position) + 1
+                data = (text[:position] + f'<w:headerReference w:type="default" r:id="{HEADER_REL_ID}"/>'
+                        + text[position:]).encode('utf-8')
+            target.writestr(item, data)
+        target.writestr('word/header1.xml', header_xml)
+        target.writestr('word/_rels/header1.xml.rels', header_rels)
+        for name, data in media.items():
+            target.writestr(name, data)
+    return buffer.getvalue()
+
+
+_reference_docx = None
+
+
+def reference_docx(template_dir=EXPORT_TEMPLATE_DIR):
+    """
+    Chemin du document de référence DOCX avec l'en-tête d'images, construit si besoin.
+    Plusieurs processus peuvent le construire en même temps : chacun écrit un fichier
+    temporaire, puis le renomme (remplacement atomique, contenus identiques).
+    """
+    global _reference_docx
+    if _reference_docx and os.path.exists(_reference_docx):
+        return _reference_docx
+    default_reference = subprocess.run(
+        [pypandoc.get_pandoc_path(), '--print-default-data-file', 'reference.docx'],
+        capture_output=True, check=True).stdout
+    digest = hashlib.sha256(default_reference)
+    for relative_path, dimension, size_cm in HEADER_IMAGES:
+        with open(os.path.join(BASE_DIR, relative_path), 'rb') as f:
+            digest.update(f.read())
+        digest.update(f"{dimension}:{size_cm}".encode('utf-8'))
+    path = os.path.join(template_dir, f"reference_{digest.hexdigest()[:16]}.docx")
+    if not os.path.exists(path):
+        os.makedirs(template_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=template_dir, suffix='.docx')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_add_header(default_reference))
+        os.replace(tmp_path, path)
+        logging.info(f"Document de référence DOCX construit : {path}")
+    _reference_docx = path
+    return path
+
+
+def _metadata_args(title, author, date, lang):
+    return [f'--metadata=title:{title}', f'--metadata=author:{author}',
+            f'--metadata=date:{date}', f'--metadata=lang:{lang}']
+
+
+def _data_uri(relative_path):
+    """Image d'en-tête en URI data: (PNG), intégrable sans accès au disque par pandoc."""
+    with open(os.path.join(BASE_DIR, relative_path), 'rb') as f:
+        return 'data:image/png;base64,' + base64.b64encode(f.read()).decode('ascii')
+
+
+def render_docx(markdown_doc, filename, title, author, date, lang, pandoc_format='markdown'):
+    """Écrit `markdown_doc` en DOCX dans `filename`, avec l'en-tête d'images."""
+    extra_args = ['--sandbox', '--reference-doc', reference_docx()]
+    run_pandoc(markdown_doc, [f'--from={pandoc_format}', '--to=docx', f'--output={filename}']
+               + extra_args + _metadata_args(title, author, date, lang))
+
+
+def render_html(markdown_doc, filename, title, author, date, lang, pandoc_format='markdown'):
+    """
+    Écrit `markdown_doc` en une page HTML autonome dans `filename` : images d'en-tête
+    intégrées et formules en MathML, lisible hors ligne sans MathJax.
+    """
+    header_images = ' '.join(
+        f"![]({_data_uri(relative_path)}){{{'width' if dimension == 'width' else 'height'}={size_cm}cm}}"
+        for relative_path, dimension, size_cm in HEADER_IMAGES)
+    source = f"::: {{style=\"text-align: center\"}}\n{header_images}\n:::\n\n{markdown_doc}"
+    extra_args = ['--sandbox', '--standalone', '--embed-resources', '--mathml']
+    run_pandoc(source, [f'--from={pandoc_format}', '--to=html', f'--output={filename}']
+               + extra_args + _metadata_args(title, author, date, lang))
+
+
+def render_export(output_format, markdown_doc, filename, title, author, date, lang):
+    """Point d'entrée de utils.create_pdf_with_pandoc pour les formats de EXPORT_FORMATS."""
+    if output_format == 'docx':
+        render_docx(markdown_doc, filename, title, author, date, lang)
+    elif output_format == 'html':
+        render_html(markdown_doc, filename, title, author, date, lang)
+    else:
+        raise ExportError(f"Format d'export inconnu : {output_format}")
@@ -0,0 +1,187 @@
+# generation_cache.py - Cache des documents générés par le LLM
+#
+# Une même leçon (classe, matière, module, leçon, langue, syllabus) est souvent demandée
+# plusieurs fois par semaine. La clé du cache est calculée sur les entrées normalisées
+# et sur une empreinte du prompt : modifier un prompt invalide automatiquement les
+# anciennes entrées.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import (GENERATION_CACHE_ENABLED, GENERATION_CACHE_BACKENDS, GENERATION_CACHE_TTL,
+                    GENERATION_CACHE_MAX_ENTRIES, GENERATION_CACHE_DB_PATH)
+
+
+def _normalize(value):
+    """Rend équivalentes les saisies qui ne diffèrent que par la casse ou les espaces."""
+    if value is None:
+        return ""
+    text = unicodedata.normalize('NFC', str(value))
+    return " ".join(text.split()).casefold()
+
+
+def template_version(*parts):
+    """Empreinte courte des textes qui composent un prompt (template, titres, instructions)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def make_cache_key(flow_type, version, inputs):
+    """Clé de cache pour un type de document, une version de prompt et ses entrées."""
+    payload = {
+        'flow_type': flow_type,
+        'template_version': version,
+        'inputs': {key: _normalize(value) for key, value in sorted(inputs.items())},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """Cache LRU en mémoire du processus, avec expiration."""
+
+    def __init__(self, max_entries, ttl):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.time() - stored_at > self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCacheBackend:
+    """
+    Cache sur disque (SQLite) qui survit aux redémarrages des workers et est
+    partagé par tous les processus de la machine.
+    """
+
+    def __init__(self, path, max_entries, ttl):
+        self._path = path
+        self._max_entries = max_entries
+        self._ttl = ttl
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS generations ("
+                         "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                         "stored_at REAL NOT NULL, last_access REAL NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        # Une connexion par opération : sqlite3 ne partage pas ses connexions entre threads.
+        conn = sqlite3.connect(self._path, timeout=5)
+        try:
+            with conn:  # commit (ou rollback) automatique
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, stored_at FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self._ttl:
+                conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE generations SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO generations (key, value, stored_at, last_access) "
+                         "VALUES (?, ?, ?, ?)", (key, value, now, now))
+            conn.execute("DELETE FROM generations WHERE stored_at < ?", (now - self._ttl,))
+            conn.execute("DELETE FROM generations WHERE key NOT IN ("
+                         "SELECT key FROM generations ORDER BY last_access DESC LIMIT ?)",
+                         (self._max_entries,))
+
+
+# Les backends disponibles, sélectionnés par GENERATION_CACHE_BACKENDS (ex : "memory,sqlite").
+CACHE_BACKENDS = {
+    'memory': lambda: MemoryCacheBackend(GENERATION_CACHE_MAX_ENTRIES, GENERATION_CACHE_TTL),
+    'sqlite': lambda: SQLiteCacheBackend(GENERATION_CACHE_DB_PATH, GENERATION_CACHE_MAX_ENTRIES * 8,
+                                         GENERATION_CACHE_TTL),
+}
+
+
+class GenerationCache:
+    """
+    Cache à plusieurs niveaux : on lit du plus rapide au plus lent et on recopie
+    une entrée trouvée plus bas dans les niveaux supérieurs. Une panne d'un niveau
+    est journalisée mais ne fait jamais échouer une génération.
+    """
+
+    def __init__(self, backends):
+        self._backends = backends
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        for index, backend in enumerate(self._backends):
+            try:
+                value = backend.get(key)
+            except Exception as e:
+                logging.error(f"Erreur de lecture du cache de génération ({type(backend).__name__}): {e}")
+                continue
+            if value is not None:
+                for upper in self._backends[:index]:
+                    self._safe_set(upper, key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        for backend in self._backends:
+            self._safe_set(backend, key, value)
+
+    def _safe_set(self, backend, key, value):
+        try:
+            backend.set(key, value)
+        except Exception as e:
+            logging.error(f"Erreur d'écriture dans le cache de génération ({type(backend).__name__}): {e}")
+
+
+def _build_cache():
+    if not GENERATION_CACHE_ENABLED:
+        return GenerationCache([])
+    backends = []
+    for name in [name.strip() for name in GENERATION_CACHE_BACKENDS.split(',') if name.strip()]:
+        if name not in CACHE_BACKENDS:
+            logging.warning(f"Backend de cache inconnu ignoré : {name}")
+            continue
+        try:
+            backends.append(CACHE_BACKENDS[name]())
+        except Exception as e:
+            logging.error(f"Impossible d'initialiser le cache '{name}': {e}")
+    return GenerationCache(backends)
+
+
+generation_cache = _build_cache()
@@ -0,0 +1,140 @@
+# history_export.py - Export groupé de l'historique en une archive ZIP diffusée en continu
+#
+# Un enseignant qui veut tous les PDF de son trimestre devait ouvrir et télécharger
+# chaque génération, une requête et un rendu à la fois. /api/history/export rend les
+# documents demandés en parallèle (parallélisme borné, cache de rendu réutilisé) et
+# envoie l'archive au fil des rendus terminés : chaque PDF est écrit dans le ZIP dès
+# qu'il est prêt, sans jamais garder l'archive entière en mémoire.
+#
+# Le client demande d'abord un lien signé (POST /api/history/export, JSON), puis le
+# navigateur télécharge l'archive par un GET sur ce lien : il l'écrit sur le disque au
+# fil de l'eau, au lieu que la page la garde entière en mémoire (blob) avant de l'enregistrer.
+
+import io
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from config import APP_SECRET_KEY, DOWNLOAD_TTL, EXPORT_MAX_PARALLEL, RENDER_TIMEOUT
+from render_pool import RenderQueueFull
+from export_formats import output_extension
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ExportLinkInvalid(Exception):
+    """Levée quand le lien d'export est invalide, expiré ou destiné à un autre utilisateur."""
+
+
+class ExportEntry:
+    """Un document de l'archive : son nom dans le ZIP et de quoi le rendre."""
+
+    def __init__(self, arcname, render_key, render_kwargs):
+        self.arcname = arcname
+        self.render_key = render_key
+        self.render_kwargs = render_kwargs
+
+
+class _ZipStream(io.RawIOBase):
+    """Sortie non positionnable pour zipfile : les octets écrits sont repris par `drain`."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _render_entry(render_file, entry, work_dir, index):
+    """Rend une entrée ; la file de rendu pleine n'est pas une erreur, on patiente."""
+    filepath = os.path.join(work_dir, f"{index}{output_extension(entry.render_kwargs['output_format'])}")
+    deadline = time.monotonic() + RENDER_TIMEOUT
+    delay = 0.5
+    while True:
+        try:
+            render_file(entry.render_key, entry.render_kwargs, filepath)
+            return filepath
+        except RenderQueueFull:
+            if time.monotonic() + delay > deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+def stream_zip(entries, render_file, max_workers=EXPORT_MAX_PARALLEL):
+    """
+    Générateur des octets d'une archive ZIP contenant le PDF de chaque entrée,
+    dans l'ordre où les rendus se terminent. `render_file(render_key, render_kwargs,
+    filepath)` produit un PDF (voir app.render_pdf_file). Les documents en échec
+    sont listés dans ERREURS.txt à la fin de l'archive.
+    """
+    stream = _ZipStream()
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='tchatchiai_export_') as work_dir:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='export')
+        try:
+            futures = {executor.submit(_render_entry, render_file, entry, work_dir, index): entry
+                       for index, entry in enumerate(entries)}
+            # Les PDF sont déjà compressés : ZIP_STORED évite de les recompresser pour rien.
+            with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+                for future in as_completed(futures):
+                    entry = futures[future]
+                    try:
+                        filepath = future.result()
+                    except Exception as e:
+                        logging.error(f"Export : rendu impossible pour {entry.arcname} : {e}")
+                        failures.append(entry.arcname)
+                        continue
+                    with open(filepath, 'rb') as source, archive.open(entry.arcname, 'w') as target:
+                        while True:
+                            chunk = source.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            target.write(chunk)
+                            yield stream.drain()
+                    os.remove(filepath)
+                    yield stream.drain()
+                if failures:
+                    archive.writestr('ERREURS.txt', "Documents non rendus :\n" + "\n".join(failures) + "\n")
+            yield stream.drain()
+        finally:
+            # Client parti en cours de route : les rendus pas encore commencés sont annulés.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Liens d'export signés ---
+_token_serializer = URLSafeTimedSerializer(APP_SECRET_KEY, salt='history-export')
+
+
+def make_export_token(user_id, generation_ids, lang, engine=None):
+    """Jeton signé désignant les générations à exporter pour l'utilisateur `user_id`."""
+    return _token_serializer.dumps({'user': str(user_id), 'ids': generation_ids,
+                                    'lang': lang, 'engine': engine})
+
+
+def read_export_token(token, user_id, max_age=DOWNLOAD_TTL):
+    """
+    Renvoie (generation_ids, lang, engine). Lève ExportLinkInvalid si le jeton est
+    invalide, a expiré ou a été émis pour un autre utilisateur.
+    """
+    try:
+        payload = _token_serializer.loads(token, max_age=max_age)
+    except SignatureExpired:
+        raise ExportLinkInvalid("Lien d'export expiré.")
+    except BadSignature:
+        raise ExportLinkInvalid("Lien d'export invalide.")
+    if payload['user'] != str(user_id):
+        raise ExportLinkInvalid("Lien d'export émis pour un autre utilisateur.")
+    return payload['ids'], payload['lang'], payload['engine']
@@ -0,0 +1,279 @@
+# jobs.py - Exécution des générations LLM en arrière-plan
+#
+# Les appels LLM peuvent durer plus d'une minute. Au lieu de bloquer un worker web
+# pendant tout ce temps, /api/chat dépose la génération dans un pool de threads
+# dédié et renvoie immédiatement un identifiant de tâche que le client interroge.
+#
+# La génération s'exécute dans le processus qui l'a reçue, mais l'interrogation suivante
+# peut arriver sur un autre worker gunicorn. L'état et le résultat de chaque génération
+# sont donc aussi écrits dans une base SQLite partagée par les processus de la machine
+# (JOB_STORE_DB_PATH) : un autre worker y lit l'état, sans le texte en streaming, qui
+# n'existe que dans le processus qui exécute (le flux SSE n'envoie alors que `done`).
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import LLM_EXECUTOR_WORKERS, LLM_JOB_QUEUE_MAX, LLM_JOB_RESULT_TTL, JOB_STORE_DB_PATH
+
+# Intervalle de relecture de la base pour une génération exécutée par un autre processus.
+STORE_POLL_INTERVAL = 1.0
+
+
+class JobQueueFull(Exception):
+    """Levée quand trop de générations sont déjà en attente."""
+
+
+class GenerationJob:
+    """Une génération en cours ou terminée, appartenant à un utilisateur."""
+
+    def __init__(self, owner_id):
+        self.id = str(uuid.uuid4())
+        self.owner_id = owner_id
+        self.status = 'pending'  # pending -> running -> done | error
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        # Texte reçu en streaming depuis le LLM, consommé par /api/chat/stream
+        self.chunks = []
+        self.stream_resets = 0
+        self._cond = threading.Condition()
+        # Base d'où relire l'état quand la génération tourne dans un autre processus.
+        self._store = None
+
+    @classmethod
+    def from_store(cls, job_id, record, store):
+        """Copie d'une génération exécutée par un autre processus (voir SQLiteJobStore.load)."""
+        job = cls(record['owner_id'])
+        job.id = job_id
+        job._store = store
+        job._apply(record)
+        return job
+
+    def _apply(self, record):
+        self.created_at = record['created_at']
+        self.finished_at = record['finished_at']
+        self.result = record['result']
+        self.status = record['status']
+
+    def _wait_in_store(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.is_finished and time.monotonic() < deadline:
+            time.sleep(min(STORE_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+            try:
+                record = self._store.load(self.id)
+            except sqlite3.Error as e:
+                logging.error(f"Erreur de lecture de la génération {self.id} : {e}")
+                continue
+            if record is None:
+                # Purgée entre-temps : le client reçoit une erreur plutôt que d'attendre sans fin.
+                self.result, self.status = {'error': "Génération expirée."}, 'error'
+            else:
+                self._apply(record)
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'error')
+
+    def publish_chunk(self, text):
+        """Callback `on_chunk` de call_llm_api : None efface le texte déjà reçu."""
+        with self._cond:
+            if text is None:
+                self.chunks = []
+                self.stream_resets += 1
+            else:
+                self.chunks.append(text)
+            self._cond.notify_all()
+
+    def wait_for_stream(self, cursor, resets_seen, timeout):
+        """
+        Attend du nouveau texte après la position `cursor`.
+        Renvoie (reset, nouveaux_morceaux, terminé) ; `reset` indique que le
+        client doit effacer ce qu'il a déjà affiché avant d'ajouter les morceaux.
+        """
+        if self._store is not None:
+            # Exécutée par un autre processus : pas de texte en direct, seulement l'état.
+            self._wait_in_store(timeout)
+            return False, [], self.is_finished
+        with self._cond:
+            if (cursor >= len(self.chunks) and resets_seen == self.stream_resets
+                    and not self.is_finished):
+                self._cond.wait(timeout)
+            reset = resets_seen != self.stream_resets
+            new_chunks = self.chunks if reset else self.chunks[cursor:]
+            return reset, list(new_chunks), self.is_finished
+
+    def _notify_finished(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def to_dict(self):
+        data = {'job_id': self.id, 'status': self.status}
+        if self.is_finished and self.result:
+            data.update(self.result)
+        return data
+
+
+class SQLiteJobStore:
+    """
+    État et résultat des générations sur disque (SQLite), partagés par tous les processus
+    de la machine. Les lignes sont oubliées `ttl` secondes après leur dernière mise à jour.
+    """
+
+    def __init__(self, path, ttl):
+        self._path = path
+        self._ttl = ttl
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                         "id TEXT PRIMARY KEY, owner_id TEXT NOT NULL, status TEXT NOT NULL, "
+                         "result TEXT, created_at REAL NOT NULL, finished_at REAL, "
+                         "updated_at REAL NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        # Une connexion par opération : sqlite3 ne partage pas ses connexions entre threads.
+        conn = sqlite3.connect(self._path, timeout=5)
+        try:
+            with conn:  # commit (ou rollback) automatique
+                yield conn
+        finally:
+            conn.close()
+
+    def save(self, job):
+        now = time.time()
+        result = json.dumps(job.result) if job.result is not None else None
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO jobs (id, owner_id, status, result, created_at, "
+                         "finished_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (job.id, str(job.owner_id), job.status, result, job.created_at,
+                          job.finished_at, now))
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (now - self._ttl,))
+
+    def load(self, job_id):
+        """Renvoie l'état enregistré de la génération (dictionnaire), ou None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT owner_id, status, result, created_at, finished_at "
+                               "FROM jobs WHERE id = ? AND updated_at >= ?",
+                               (job_id, time.time() - self._ttl)).fetchone()
+        if row is None:
+            return None
+        return {'owner_id': row[0], 'status': row[1], 'result': json.loads(row[2]) if row[2] else None,
+                'created_at': row[3], 'finished_at': row[4]}
+
+
+class JobManager:
+    """
+    Pool borné d'exécuteurs LLM, dimensionné indépendamment des workers web.
+    Les résultats sont conservés en mémoire pendant `result_ttl` secondes, et dans
+    `store` (SQLiteJobStore, optionnel) pour les autres processus.
+    """
+
+    def __init__(self, max_workers, max_pending, result_ttl, store=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-job')
+        self._max_pending = max_pending
+        self._result_ttl = result_ttl
+        self._store = store
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner_id, func, *args, **kwargs):
+        """
+        Dépose une génération dans le pool. `func` doit renvoyer le dictionnaire
+        de réponse du chat ; une exception est convertie en résultat d'erreur.
+        `func` reçoit en plus l'argument nommé `on_chunk` pour diffuser le texte.
+        Si l'utilisateur a déjà une génération active, celle-ci est renvoyée.
+        """
+        with self._lock:
+            self._purge_expired()
+            for job in self._jobs.values():
+                if job.owner_id == owner_id and not job.is_finished:
+                    return job
+            pending = sum(1 for job in self._jobs.values() if not job.is_finished)
+            if pending >= self._max_pending:
+                raise JobQueueFull(f"{pending} générations déjà en attente.")
+            job = GenerationJob(owner_id)
+            self._jobs[job.id] = job
+
+        self._save(job)
+        self._executor.submit(self._run, job, func, args, kwargs)
+        logging.info(f"Génération {job.id} mise en file d'attente ({pending + 1} active(s)).")
+        return job
+
+    def get(self, job_id, owner_id):
+        """
+        Renvoie la tâche si elle existe et appartient bien à `owner_id` : celle de ce
+        processus, sinon la copie lue dans la base partagée.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            job = self._load(job_id)
+        if job is None or str(job.owner_id) != str(owner_id):
+            return None
+        return job
+
+    def _save(self, job):
+        # Une erreur de la base est journalisée : la génération continue dans ce processus.
+        if self._store is None:
+            return
+        try:
+            self._store.save(job)
+        except sqlite3.Error as e:
+            logging.error(f"Erreur d'écriture de la génération {job.id} : {e}")
+
+    def _load(self, job_id):
+        if self._store is None:
+            return None
+        try:
+            record = self._store.load(job_id)
+        except sqlite3.Error as e:
+            logging.error(f"Erreur de lecture de la génération {job_id} : {e}")
+            return None
+        if record is None:
+            return None
+        return GenerationJob.from_store(job_id, record, self._store)
+
+    def _run(self, job, func, args, kwargs):
+        job.status = 'running'
+        self._save(job)
+        started = time.time()
+        try:
+            result, status = func(*args, on_chunk=job.publish_chunk, **kwargs), 'done'
+        except Exception as e:
+            logging.error(f"Erreur inattendue dans la génération {job.id}: {e}")
+            result, status = {'error': str(e)}, 'error'
+        # `finished_at` et `result` doivent être posés avant le statut final,
+        # qui est lu sans verrou par les autres threads.
+        job.finished_at = time.time()
+        job.result = result
+        job.status = status
+        self._save(job)
+        job._notify_finished()
+        logging.info(f"Génération {job.id} terminée ({status}) en {job.finished_at - started:.1f}s.")
+
+    def _purge_expired(self):
+        # Appelée sous verrou : on oublie les résultats trop anciens.
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.is_finished and now - job.finished_at > self._result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def _build_store():
+    if not JOB_STORE_DB_PATH:
+        return None
+    try:
+        return SQLiteJobStore(JOB_STORE_DB_PATH, LLM_JOB_RESULT_TTL)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Base des générations indisponible, état gardé en mémoire : {e}")
+        return None
+
+
+job_manager = JobManager(LLM_EXECUTOR_WORKERS, LLM_JOB_QUEUE_MAX, LLM_JOB_RESULT_TTL, _build_store())
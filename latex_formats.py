@@ -0,0 +1,169 @@
+# latex_formats.py - Rendu PDF avec préambule LaTeX précompilé
+#
+# À chaque rendu, xelatex relit graphicx, amsmath, unicode-math, le thème Beamer...
+# Ce préambule ne change presque jamais : on le "dumpe" une fois dans un fichier
+# de format (.fmt) et les rendus suivants démarrent directement avec ce format.
+#
+# Le document LaTeX produit par pandoc est coupé au marqueur DUMP_MARKER (première
+# ligne des header-includes, voir utils.py) :
+#   - avant le marqueur : \documentclass et les packages -> compilés dans le format ;
+#   - après : les polices (\setmainfont, \setmathfont), le titre et le corps.
+# Les polices restent après le marqueur car XeTeX ne peut pas enregistrer une police
+# système dans un format. Le nom du format est un hash du préambule : un nouveau
+# template pandoc ou une nouvelle langue produit simplement un nouveau format.
+#
+# Les formats sont construits au premier usage, ou d'avance avec :
+#   python -m latex_formats
+# (voir Dockerfile). En cas d'échec, utils.py revient au rendu pandoc classique.
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from config import LATEX_FORMAT_DIR
+from pandoc_server import pandoc_server
+from render_limits import run_limited, RenderDeadline
+
+# Commentaire LaTeX inséré tel quel par pandoc (`...`{=latex}) : sans effet sur un rendu classique.
+DUMP_MARKER = "% tchatchi-endofdump"
+DUMP_MARKER_YAML = f'"`{DUMP_MARKER}`{{=latex}}"'
+
+# Nombre maximum de passes xelatex (références, navigation Beamer), comme pandoc.
+MAX_LATEX_RUNS = 3
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LatexFormatError(Exception):
+    """Levée quand le rendu avec un préambule précompilé est impossible."""
+
+
+_xelatex_version = None
+
+
+def _engine_version():
+    """Première ligne de `xelatex --version` : un format n'est valable que pour ce moteur."""
+    global _xelatex_version
+    if _xelatex_version is None:
+        result = subprocess.run(['xelatex', '--version'], capture_output=True, text=True, check=True)
+        _xelatex_version = result.stdout.splitlines()[0] if result.stdout else "xelatex"
+    return _xelatex_version
+
+
+def split_preamble(latex_source):
+    """Coupe la source LaTeX au marqueur ; renvoie (préambule fixe, reste du document)."""
+    lines = latex_source.split('\n')
+    for index, line in enumerate(lines):
+        if line.strip() == DUMP_MARKER:
+            return '\n'.join(lines[:index]) + '\n', '\n'.join(lines[index + 1:])
+    raise LatexFormatError("Marqueur de fin de préambule absent de la source LaTeX.")
+
+
+def format_name(preamble):
+    digest = hashlib.sha256((_engine_version() + '\n' + preamble).encode('utf-8')).hexdigest()
+    return f"tchatchi_{digest[:16]}"
+
+
+def _latex_env(format_dir):
+    env = dict(os.environ)
+    # Le ':' final conserve les chemins de recherche par défaut de kpathsea.
+    env['TEXFORMATS'] = f"{format_dir}:{env.get('TEXFORMATS', '')}"
+    return env
+
+
+def ensure_format(preamble, format_dir=LATEX_FORMAT_DIR):
+    """
+    Renvoie le nom du format contenant `preamble`, en le construisant si besoin.
+    Plusieurs processus peuvent l'appeler en même temps : un verrou de fichier
+    garantit une seule construction. Un échec est mémorisé pour ne pas réessayer
+    à chaque rendu.
+    """
+    name = format_name(preamble)
+    fmt_path = os.path.join(format_dir, f"{name}.fmt")
+    failed_path = os.path.join(format_dir, f"{name}.failed")
+    if os.path.exists(fmt_path):
+        return name
+    if os.path.exists(failed_path):
+        raise LatexFormatError(f"La construction du format {name} a déjà échoué.")
+
+    os.makedirs(format_dir, exist_ok=True)
+    with open(os.path.join(format_dir, f"{name}.lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.exists(fmt_path):
+            return name
+        with tempfile.TemporaryDirectory(dir=format_dir) as build_dir:
+            source_path = os.path.join(build_dir, f"{name}.tex")
+            with open(source_path, 'w', encoding='utf-8') as f:
+                f.write(preamble + "\\dump\n")
+            result = run_limited(
+                ['xelatex', '-ini', '-interaction=nonstopmode', '-halt-on-error',
+                 f'-jobname={name}', f'-output-directory={build_dir}', '&xelatex', source_path],
+                cwd=BASE_DIR)
+            built_path = os.path.join(build_dir, f"{name}.fmt")
+            if result.returncode != 0 or not os.path.exists(built_path):
+                with open(failed_path, 'w', encoding='utf-8') as f:
+                    f.write(result.stdout[-5000:])
+                raise LatexFormatError(f"Échec de la construction du format {name} (voir {failed_path}).")
+            os.replace(built_path, fmt_path)
+    logging.info(f"Format LaTeX précompilé construit : {fmt_path}")
+    return name
+
+
+def render_pdf(document_source, pandoc_format, pandoc_to, filename, format_dir=LATEX_FORMAT_DIR, deadline=None):
+    """
+    Convertit `document_source` (markdown + en-tête YAML contenant le marqueur) en PDF
+    avec un préambule précompilé. Lève LatexFormatError ou une erreur de pandoc/xelatex
+    si ce chemin échoue ; l'appelant revient alors au rendu classique. La conversion et
+    les passes xelatex partagent l'échéance `deadline` (RenderLimitExceeded au-delà).
+    """
+    deadline = deadline or RenderDeadline()
+    latex_source = pandoc_server.convert_text(document_source, pandoc_to, pandoc_format, standalone=True,
+                                              timeout=deadline.timeout())
+    preamble, body = split_preamble(latex_source)
+    name = ensure_format(preamble, format_dir)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        body_path = os.path.join(work_dir, 'document.tex')
+        with open(body_path, 'w', encoding='utf-8') as f:
+            f.write(body)
+        command = ['xelatex', '-interaction=nonstopmode', '-halt-on-error', f'-fmt={name}',
+                   f'-output-directory={work_dir}', body_path]
+        for _ in range(MAX_LATEX_RUNS):
+            # Lancé depuis le dossier de l'application pour résoudre static/img/...
+            result = run_limited(command, timeout=deadline.timeout(), cwd=BASE_DIR, env=_latex_env(format_dir))
+            if result.returncode != 0:
+                raise LatexFormatError(f"xelatex a échoué avec le format {name} : {result.stdout[-1500:]}")
+            with open(os.path.join(work_dir, 'document.log'), encoding='utf-8', errors='replace') as log:
+                if 'Rerun to get' not in log.read():
+                    break
+        shutil.copyfile(os.path.join(work_dir, 'document.pdf'), filename)
+
+
+# Documents courts rendus au démarrage pour construire les formats et chauffer les caches.
+WARMUP_DOCUMENTS = {
+    'pdf': ("lecon", "**Préchauffage**\n\nFormule : $x^2 + y^2 = z^2$\n\n| A | B |\n|:---|:---|\n| 1 | 2 |\n"),
+    'beamer': ("digital", "## Diapositive 1 : Préchauffage\n- Formule : $x^2$\n  - Niveau 2\n"),
+}
+WARMUP_LANGUAGES = ('fr', 'en')
+
+
+def warmup_jobs():
+    """Arguments de create_pdf_with_pandoc pour chaque rendu de préchauffage."""
+    jobs = []
+    for output_format, (doc_type, text) in WARMUP_DOCUMENTS.items():
+        for lang in WARMUP_LANGUAGES:
+            jobs.append({'text': text, 'lang_contenu_code': lang, 'doc_type': doc_type,
+                         'output_format': output_format})
+    return jobs
+
+
+if __name__ == '__main__':
+    # Construction des formats à l'avance (étape de build de l'image Docker).
+    from utils import create_pdf_with_pandoc
+    for job in warmup_jobs():
+        with tempfile.TemporaryDirectory() as out_dir:
+            ok = create_pdf_with_pandoc(filename=os.path.join(out_dir, 'warmup.pdf'), **job)
+            print(f"{job['output_format']}/{job['lang_contenu_code']} : {'ok' if ok else 'ÉCHEC'}")
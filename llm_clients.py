@@ -0,0 +1,106 @@
+# llm_clients.py - Clients LLM partagés par tous les threads d'un worker
+#
+# Construire un client (et ouvrir une connexion TLS vers googleapis.com ou
+# api.openai.com) à chaque génération coûte plusieurs centaines de millisecondes.
+# Les clients sont donc créés une seule fois par processus, gardent leurs
+# connexions ouvertes (keep-alive) et sont pré-chauffés au démarrage du worker.
+
+import logging
+import threading
+import time
+import httpx
+import google.generativeai as genai
+from openai import OpenAI
+from config import (OPENAI_API_KEY, GEMINI_API_KEY, LLM_PROVIDER_TIMEOUT, LLM_HTTP_MAX_CONNECTIONS,
+                    LLM_HTTP_MAX_KEEPALIVE, LLM_HTTP_KEEPALIVE_EXPIRY, LLM_WARMUP_ENABLED,
+                    LLM_MOCK_ENABLED)
+
+GEMINI_MODEL_NAME = "gemini-pro"
+OPENAI_MODEL_NAME = "gpt-4o"
+
+# Timeout des requêtes de pré-chauffage : elles ne doivent jamais retarder le démarrage.
+WARMUP_TIMEOUT = 10
+
+
+class LLMClients:
+    """
+    Détient le client OpenAI (avec son pool de connexions httpx) et les objets
+    `GenerativeModel` de Gemini. Les deux SDK sont utilisables depuis plusieurs
+    threads ; seule la création paresseuse des modèles est protégée par un verrou.
+    """
+
+    def __init__(self, openai_api_key, gemini_api_key):
+        self._lock = threading.Lock()
+        self._gemini_models = {}
+        self.gemini_enabled = self._configure_gemini(gemini_api_key)
+        self.openai = self._build_openai(openai_api_key)
+
+    @staticmethod
+    def _configure_gemini(api_key):
+        if not api_key:
+            logging.warning("Clé GEMINI_API_KEY non trouvée. Le service principal pourrait ne pas fonctionner.")
+            return False
+        try:
+            genai.configure(
+                api_key=api_key,
+                transport='rest', # Important pour que le timeout soit respecté
+                client_options={'api_endpoint': 'generativelanguage.googleapis.com'}
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Erreur de configuration de l'API Gemini: {e}")
+            return False
+
+    @staticmethod
+    def _build_openai(api_key):
+        if not api_key:
+            logging.warning("Clé OPENAI_API_KEY non trouvée. Le fallback OpenAI est désactivé.")
+            return None
+        # Un seul pool httpx par processus : les connexions restent ouvertes entre deux générations.
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+                                keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY),
+            timeout=httpx.Timeout(LLM_PROVIDER_TIMEOUT, connect=10.0),
+        )
+        return OpenAI(api_key=api_key, timeout=LLM_PROVIDER_TIMEOUT, http_client=http_client)
+
+    def gemini_model(self, name=GEMINI_MODEL_NAME):
+        """Renvoie le `GenerativeModel` partagé pour `name`, créé au premier appel."""
+        model = self._gemini_models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._gemini_models.get(name)
+                if model is None:
+                    model = genai.GenerativeModel(name)
+                    self._gemini_models[name] = model
+        return model
+
+    def warm_up(self):
+        """
+        Ouvre les connexions vers les fournisseurs avec des requêtes gratuites
+        (comptage de jetons, description du modèle). Un échec est seulement journalisé.
+        """
+        if self.gemini_enabled:
+            started = time.monotonic()
+            try:
+                self.gemini_model().count_tokens("ping", request_options={'timeout': WARMUP_TIMEOUT})
+                logging.info(f"Client Gemini pré-chauffé en {time.monotonic() - started:.2f}s.")
+            except Exception as e:
+                logging.warning(f"Pré-chauffage Gemini impossible : {e}")
+        if self.openai is not None:
+            started = time.monotonic()
+            try:
+                self.openai.models.retrieve(OPENAI_MODEL_NAME, timeout=WARMUP_TIMEOUT)
+                logging.info(f"Client OpenAI pré-chauffé en {time.monotonic() - started:.2f}s.")
+            except Exception as e:
+                logging.warning(f"Pré-chauffage OpenAI impossible : {e}")
+
+    def warm_up_in_background(self):
+        """Pré-chauffe les clients sans bloquer le démarrage du worker."""
+        if not LLM_WARMUP_ENABLED or LLM_MOCK_ENABLED:
+            return
+        threading.Thread(target=self.warm_up, name='llm-warmup', daemon=True).start()
+
+
+llm_clients = LLMClients(OPENAI_API_KEY, GEMINI_API_KEY)
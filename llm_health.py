@@ -0,0 +1,141 @@
+# llm_health.py - Suivi des performances des fournisseurs LLM (Gemini, OpenAI)
+
+import logging
+import threading
+import time
+from collections import deque
+from config import (LLM_LATENCY_WINDOW, LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_WINDOW,
+                    LLM_BREAKER_COOLDOWN, LLM_BREAKER_SLOW_CALL)
+
+# En dessous de ce nombre de mesures, un percentile n'a pas de sens.
+MIN_SAMPLES_FOR_PERCENTILE = 10
+
+
+class LatencyTracker:
+    """
+    Garde les N dernières latences (en secondes) de chaque métrique, par exemple
+    'gemini' (réponse complète) ou 'gemini:ttft' (délai avant le premier morceau).
+    """
+
+    def __init__(self, window):
+        self._window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, metric, seconds):
+        with self._lock:
+            self._samples.setdefault(metric, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, metric, pct):
+        """Renvoie le percentile `pct` (0-100) des mesures, ou None s'il y en a trop peu."""
+        with self._lock:
+            samples = sorted(self._samples.get(metric, ()))
+        if len(samples) < MIN_SAMPLES_FOR_PERCENTILE:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+        return samples[index]
+
+    def snapshot(self):
+        """Résumé p50/p90/p99 de chaque métrique, pour la supervision."""
+        with self._lock:
+            metrics = list(self._samples)
+        return {metric: {'samples': len(self._samples[metric]),
+                         'p50': self.percentile(metric, 50),
+                         'p90': self.percentile(metric, 90),
+                         'p99': self.percentile(metric, 99)}
+                for metric in metrics}
+
+
+latency_tracker = LatencyTracker(LLM_LATENCY_WINDOW)
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur d'un fournisseur LLM.
+    - fermé : les appels passent ; les échecs (erreurs, timeouts, appels plus lents
+      que `slow_call`) sont comptés sur une fenêtre glissante de `window` secondes ;
+    - ouvert : après `failure_threshold` échecs dans la fenêtre, le fournisseur est
+      ignoré pendant `cooldown` secondes ;
+    - semi-ouvert : un seul appel de test est autorisé ; son succès referme le
+      disjoncteur, son échec le rouvre pour un nouveau `cooldown`.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, window, cooldown, slow_call):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._window = window
+        self._cooldown = cooldown
+        self._slow_call = slow_call
+        self._state = self.CLOSED
+        self._failures = deque()
+        self._opened_at = None
+        self._probe_started_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Indique si le fournisseur peut être appelé maintenant (et réserve l'appel de test)."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN:
+                if now - self._opened_at < self._cooldown:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_started_at = None
+                logging.info(f"Disjoncteur {self.name} : semi-ouvert, appel de test autorisé.")
+            if self._state == self.HALF_OPEN:
+                # Un test à la fois ; un test jamais conclu est abandonné après `cooldown`.
+                if self._probe_started_at is not None and now - self._probe_started_at < self._cooldown:
+                    return False
+                self._probe_started_at = now
+            return True
+
+    def record_success(self, latency):
+        if latency > self._slow_call:
+            self.record_failure(reason=f"appel lent ({latency:.1f}s)")
+            return
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                logging.info(f"Disjoncteur {self.name} : appel de test réussi, fermeture.")
+            self._state = self.CLOSED
+            self._probe_started_at = None
+
+    def record_failure(self, reason="erreur"):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.HALF_OPEN:
+                self._open(now, f"échec de l'appel de test ({reason})")
+                return
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self._window:
+                self._failures.popleft()
+            if self._state == self.CLOSED and len(self._failures) >= self._failure_threshold:
+                self._open(now, f"{len(self._failures)} échecs en {self._window:.0f}s, dernier : {reason}")
+
+    def _open(self, now, reason):
+        # Appelée sous verrou.
+        self._state = self.OPEN
+        self._opened_at = now
+        self._probe_started_at = None
+        self._failures.clear()
+        logging.warning(f"Disjoncteur {self.name} ouvert pour {self._cooldown:.0f}s : {reason}.")
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            recent_failures = sum(1 for failed_at in self._failures if now - failed_at <= self._window)
+            cooldown_remaining = None
+            if self._state == self.OPEN:
+                cooldown_remaining = max(0.0, self._cooldown - (now - self._opened_at))
+            return {'state': self._state, 'recent_failures': recent_failures,
+                    'cooldown_remaining': cooldown_remaining}
+
+
+llm_breakers = {
+    provider: CircuitBreaker(provider, LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_WINDOW,
+                             LLM_BREAKER_COOLDOWN, LLM_BREAKER_SLOW_CALL)
+    for provider in ('gemini', 'openai')
+}
@@ -0,0 +1,285 @@
+# markdown_preprocess.py - Préparation du markdown avant pandoc, en une seule passe
+#
+# utils.create_pdf_with_pandoc parcourait le texte une dizaine de fois avant pandoc :
+# trois re.sub pour Beamer, une boucle d'échappement des underscores ligne par ligne,
+# deux recherches du bloc <bilingual_data>, le retrait des commentaires HTML, la
+# substitution du corrigé... Sur une évaluation avec un long corrigé, cela finissait
+# par se voir dans les profils. Chaque type de document est maintenant préparé en un
+# seul balayage :
+#   - document (PDF, DOCX, HTML) : une expression unique repère commentaires et bloc
+#     bilingue ; le texte s'arrête au premier bloc bilingue, converti en tableau ;
+#   - évaluation : seule la substitution du séparateur ---CORRIGE--- est faite ;
+#   - Beamer : une boucle sur les lignes applique titres, listes et échappement.
+#
+# Le résultat est identique à l'ancienne implémentation sur le corpus de référence
+# (benchmarks/preprocess_golden.json, vérifié par benchmarks/preprocess_bench.py),
+# sauf pour l'échappement Beamer, corrigé dans les cas où il cassait le document :
+# underscores dans les formules, le code et les chemins d'images, `\_` déjà échappé,
+# lignes contenant une URL, titres `###` coupés en deux, bloc bilingue affiché.
+
+import re
+from config import TITLES
+
+LANG_DISPLAY_NAMES = {'fr': 'Français', 'en': 'English', 'de': 'Deutsch', 'es': 'Español',
+                      'it': 'Italiano', 'zh': '中文', 'ar': 'العربية'}
+
+# Document : commentaire HTML, ou bloc du jeu bilingue. Le '<' commun en tête permet
+# au moteur d'expressions de sauter directement d'un '<' au suivant.
+_DOCUMENT_TOKENS = re.compile(
+    r'<(?:!--.*?-->|(?i:bilingual_data>)(?P<bilingual>.*?)(?i:</bilingual_data>))',
+    re.DOTALL)
+_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+_CORRIGE_SEPARATOR = re.compile(r'---\s*CORRIGE\s*---', re.IGNORECASE)
+
+# Beamer : `## ` précédé de texte sur sa ligne (pas `###`).
+_INLINE_HEADING = re.compile(r'[ \t]*(?<!#)##(?=[ \t])')
+# Beamer : débuts et fins des passages masqués (commentaires, bloc bilingue).
+_HIDDEN_OPEN = re.compile(r'<!--|<bilingual_data>', re.IGNORECASE)
+_HIDDEN_CLOSE = {'<!--': re.compile(r'-->'), '<bilingual_data>': re.compile(r'</bilingual_data>', re.IGNORECASE)}
+# Passages où un underscore n'est pas de l'emphase : code, formules, URL, cibles de
+# liens et d'images, underscore déjà échappé.
+_PROTECTED = re.compile(
+    r'(`+).*?\1'
+    r'|\$\$.*?\$\$'
+    r'|\$(?![\s$])(?:\\.|[^$\\])*?(?<!\s)\$(?!\d)'
+    r'|\\_'
+    r'|https?://[^\s)>\]]*'
+    r'|\]\([^)]*\)')
+
+
+def bilingual_table(bilingual_raw, lang_contenu_code):
+    """Tableau markdown du jeu bilingue (lignes `mot;traduction`), ou '' s'il est vide."""
+    content = _COMMENT.sub('', bilingual_raw).strip()
+    lines = [line.strip() for line in content.split('\n') if line.strip() and ';' in line]
+    if not lines:
+        return ""
+    table_title = TITLES.get(lang_contenu_code, TITLES['fr'])['JEU_BILINGUE']
+    source_name = LANG_DISPLAY_NAMES.get(lang_contenu_code, lang_contenu_code.capitalize())
+    target_name = 'English' if lang_contenu_code == 'fr' else 'Français'
+    rows = [f"\n\n**{table_title}**\n\n", f"| N° | {source_name} | {target_name} |\n", "|:---:|:---|:---|\n"]
+    for i, line in enumerate(lines):
+        parts = [p.strip() for p in line.split(';')]
+        if len(parts) == 2:
+            rows.append(f"| {i+1} | {parts[0]} | {parts[1]} |\n")
+    return ''.join(rows)
+
+
+def _document_markdown(text, lang_contenu_code):
+    """Texte avant le premier bloc bilingue, sans commentaires, suivi du tableau bilingue."""
+    pieces = []
+    position = 0
+    bilingual_raw = ""
+    for match in _DOCUMENT_TOKENS.finditer(text):
+        pieces.append(text[position:match.start()])
+        position = match.end()
+        if match.group('bilingual') is not None:
+            bilingual_raw = match.group('bilingual')
+            break
+    else:
+        pieces.append(text[position:])
+    # Balises orphelines (bloc non refermé) effacées après coup, comme avant.
+    main_markdown = ''.join(pieces).strip().replace('bilingual_data', '')
+    return main_markdown + bilingual_table(bilingual_raw, lang_contenu_code)
+
+
+def _evaluation_markdown(text, lang_contenu_code):
+    """Texte brut de l'évaluation, le séparateur du corrigé remplacé par son titre."""
+    corrige_title = TITLES.get(lang_contenu_code, TITLES['fr']).get('EVAL_CORRIGE_TITRE', 'CORRIGÉ DÉTAILLÉ')
+    return _CORRIGE_SEPARATOR.sub(f"\n\n---\n\n**{corrige_title}**\n\n---", text)
+
+
+def escape_underscores(line):
+    """Échappe les underscores d'une ligne de texte, hors code, formules et URL."""
+    if '_' not in line:
+        return line
+    pieces = []
+    position = 0
+    for match in _PROTECTED.finditer(line):
+        pieces.append(line[position:match.start()].replace('_', '\\_'))
+        pieces.append(match.group(0))
+        position = match.end()
+    pieces.append(line[position:].replace('_', '\\_'))
+    return ''.join(pieces)
+
+
+def _last_closings(text):
+    """Début de la dernière balise fermante de chaque passage masqué (-1 si absente)."""
+    last = {'<!--': text.rfind('-->'), '<bilingual_data>': -1}
+    for match in _HIDDEN_CLOSE['<bilingual_data>'].finditer(text):
+        last['<bilingual_data>'] = match.start()
+    return last
+
+
+def _visible_parts(line, hidden, closed_from):
+    """
+    Parties visibles d'une ligne (commentaires et bloc bilingue retirés). `hidden` est
+    la balise ouvrante en cours depuis une ligne précédente, ou None. `closed_from(balise,
+    position)` dit si la balise est refermée après `position` (indice dans la ligne) :
+    une balise jamais refermée reste du texte, comme dans le chemin des documents. Renvoie
+    (parties visibles, balise encore ouverte en fin de ligne, ligne touchée par un passage masqué).
+    """
+    parts = []
+    position = 0
+    touched = hidden is not None
+    while True:
+        if hidden is None:
+            match = _HIDDEN_OPEN.search(line, position)
+            if match is None:
+                parts.append(line[position:])
+                return parts, None, touched
+            tag = match.group(0).lower()
+            if not closed_from(tag, match.end()):
+                parts.append(line[position:match.end()])
+                position = match.end()
+                continue
+            parts.append(line[position:match.start()])
+            hidden = tag
+            position = match.end()
+            touched = True
+        else:
+            match = _HIDDEN_CLOSE[hidden].search(line, position)
+            if match is None:
+                return parts, hidden, True
+            hidden = None
+            position = match.end()
+
+
+def _is_heading(stripped):
+    """Titre de diapositive `## ` (et non `###`), indentation déjà retirée."""
+    return stripped.startswith('##') and (len(stripped) == 2 or stripped[2].isspace())
+
+
+def _split_inline_headings(text):
+    """
+    `## ` au milieu d'une ligne (« Intro. ## Diapositive 2 ») : la suite commence une
+    nouvelle diapositive, sur sa propre ligne. Ni `###`, ni le code, ni les formules.
+    """
+    if '##' not in text:
+        return text
+    lines = text.split('\n')
+    in_fence = False
+    for index, line in enumerate(lines):
+        stripped = line.lstrip()
+        if stripped.startswith(('```', '~~~')):
+            in_fence = not in_fence
+        elif not in_fence and '##' in stripped[2:]:
+            lines[index] = _split_headings_line(line)
+    return '\n'.join(lines)
+
+
+def _split_headings_line(line):
+    protected = [match.span() for match in _PROTECTED.finditer(line)]
+    pieces = []
+    position = 0
+    for match in _INLINE_HEADING.finditer(line):
+        heading = match.end() - 2
+        if not line[position:match.start()].strip():
+            continue  # Titre en début de ligne, ou `## ##`.
+        if any(start <= heading < end for start, end in protected):
+            continue
+        pieces.append(line[position:match.start()])
+        pieces.append('\n\n')
+        position = heading
+    if not pieces:
+        return line
+    pieces.append(line[position:])
+    return ''.join(pieces)
+
+
+def _trim(out, barrier):
+    """Retire les espaces en fin de sortie, sans remonter avant l'indice `barrier`."""
+    while len(out) > barrier:
+        stripped = out[-1].rstrip()
+        if stripped:
+            out[-1] = stripped
+            return
+        out.pop()
+
+
+def _beamer_markdown(text):
+    """
+    Markdown d'une présentation Beamer : titres `## ` précédés d'une ligne vide (et
+    séparés du texte qui les précède sur leur ligne),
+    listes trop profondes ramenées au niveau 2 (erreur LaTeX "Too deeply nested"),
+    underscores du texte échappés. Le code délimité (```) est laissé tel quel.
+
+    Les lignes blanches sont retenues jusqu'à la ligne suivante : un titre ou une puce
+    profonde les absorbe. `barrier` marque la fin du dernier passage masqué
+    (commentaire, jeu bilingue), que les espaces absorbés par un titre ne franchissent pas.
+    """
+    out = []
+    pending_blank = []
+    barrier = 0
+    hidden = None
+    in_fence = False
+    in_display_math = False
+    text = _split_inline_headings(text)
+    last_closings = _last_closings(text) if '<' in text else {}
+    offset = 0  # Position de la ligne courante dans le texte.
+    lines = text.split('\n')
+    last = len(lines) - 1
+    for index, line in enumerate(lines):
+        newline = '\n' if index < last else ''
+        line_offset = offset
+        offset += len(line) + 1
+        touched = hidden is not None or '<' in line
+        if touched:
+            parts, hidden, touched = _visible_parts(
+                line, hidden, lambda tag, end: last_closings[tag] >= line_offset + end)
+            line = ''.join(parts)
+            if hidden is not None:
+                newline = ''  # Le saut de ligne appartient au passage masqué.
+        stripped = line.lstrip()
+
+        if touched:
+            # Ligne (partiellement) masquée : jamais blanche, et barrière pour les titres.
+            if pending_blank:
+                out.extend(pending_blank)
+                pending_blank = []
+            if not in_fence and _is_heading(stripped):
+                _trim(out, barrier)
+                out.append('\n\n' + escape_underscores(stripped))
+            else:
+                out.append(line if in_fence else escape_underscores(line))
+            barrier = len(out)
+            out.append(newline)
+            continue
+
+        if stripped.startswith(('```', '~~~')):
+            in_fence = not in_fence
+        elif not in_fence:
+            if not stripped:
+                pending_blank.append(line + newline)
+                continue
+            if _is_heading(stripped):
+                pending_blank = []
+                _trim(out, barrier)
+                out.append('\n\n' + escape_underscores(stripped) + newline)
+                continue
+            if stripped[:1] in ('*', '-') and stripped[1:2].isspace():
+                blank_width = sum(len(blank) for blank in pending_blank)
+                if blank_width + len(line) - len(stripped) >= 4:
+                    pending_blank = []
+                    line = '  - ' + stripped[2:]
+            if stripped.startswith('$$') and stripped.count('$$') % 2 == 1:
+                in_display_math = not in_display_math
+            elif not in_display_math:
+                line = escape_underscores(line)
+        if pending_blank:
+            out.extend(pending_blank)
+            pending_blank = []
+        out.append(line + newline)
+    out.extend(pending_blank)
+    return ''.join(out).strip()
+
+
+def prepare_markdown(text, lang_contenu_code='fr', doc_type='lecon', output_format='pdf'):
+    """
+    Corps markdown du document, prêt à recevoir l'en-tête YAML : présentation Beamer
+    (sans jeu bilingue), évaluation (corrigé séparé) ou document (jeu bilingue en tableau).
+    """
+    if output_format == 'beamer':
+        return _beamer_markdown(text)
+    if doc_type == 'evaluation':
+        return _evaluation_markdown(text, lang_contenu_code)
+    return _document_markdown(text, lang_contenu_code)
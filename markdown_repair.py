@@ -0,0 +1,492 @@
+# markdown_repair.py - Vérification et réparation du markdown généré, avant tout rendu
+#
+# Quand le PDF échouait, le chat proposait "Régénérer" : un nouvel appel au LLM, payant
+# et long d'une minute, alors que le contenu était bon et que seule la mise en page avait
+# cassé. Les constructions qui font échouer LaTeX sont connues et se réparent sans LLM ;
+# repair_markdown les corrige de façon déterministe, dès la fin de la génération :
+#   - listes trop profondes (plus de 2 niveaux en Beamer, 4 ailleurs) ;
+#   - formules déséquilibrées : accolades, \left / \right, \begin / \end, `$$` non refermé ;
+#   - `%` et `&` dans une formule (commentaire et tabulation pour LaTeX), `&` d'une formule
+#     centrée sans environnement d'alignement ;
+#   - commandes LaTeX hors formule : `\frac{a}{b}` dans le texte est mis en formule, un chemin
+#     `C:\Users` affiché tel quel ;
+#   - tableaux mal formés : ligne de séparation absente ou déplacée, colonnes en nombre variable.
+# Le code (``` et `...`) n'est jamais modifié. La réparation est idempotente : un texte
+# réparé ressort identique, et garde donc sa clé dans le cache de rendu. Une réparation
+# pouvant en appeler une autre (`$$` isolé retiré, puis `\[...\]` converti), chaque passage
+# est repris jusqu'à ce qu'une passe ne change plus rien (MAX_REPAIR_PASSES au plus).
+#
+# Le mode strict sert au nouvel essai de rendu après un échec ("Réessayer la mise en page") :
+# il remplace aussi les commandes inconnues des formules par du texte droit, et affiche
+# telles quelles les commandes et environnements inconnus du texte. Hors mode strict, le
+# LaTeX brut du texte (\section, \href, \begin{figure}...) est laissé à LaTeX.
+
+import re
+from collections import Counter
+
+# Profondeur maximale des listes : Beamer casse au-delà de 2 ("Too deeply nested").
+MAX_LIST_DEPTH = {'digital': 2}
+DEFAULT_MAX_LIST_DEPTH = 4
+# Passes de réparation au plus par passage : la dernière doit ne plus rien changer.
+MAX_REPAIR_PASSES = 6
+
+# Seules les commandes du noyau LaTeX et des packages toujours chargés (amsmath, amssymb,
+# xcolor, graphicx, hyperref) sont connues : mhchem (\ce), siunitx (\SI), cancel, gensymb ou eurosym
+# ne le sont pas dans l'en-tête de utils.py, et leurs commandes cassent le rendu.
+# Commandes de texte laissées à LaTeX telles quelles.
+TEXT_COMMANDS = {
+    'newpage', 'pagebreak', 'clearpage', 'newline', 'linebreak', 'noindent', 'centering',
+    'hfill', 'vfill', 'smallskip', 'medskip', 'bigskip', 'vspace', 'hspace', 'textbf',
+    'textit', 'emph', 'underline', 'texttt', 'textsc', 'footnote', 'LaTeX', 'TeX', 'today',
+    'ldots', 'dots', 'textdegree', 'section', 'subsection', 'subsubsection', 'href', 'url',
+    'textsuperscript', 'textsubscript',
+}
+# Commandes de formule : hors formule, elles y sont placées ; dans une formule, les autres
+# sont remplacées par du texte droit en mode strict.
+MATH_COMMANDS = {
+    # Lettres grecques
+    'alpha', 'beta', 'gamma', 'delta', 'epsilon', 'varepsilon', 'zeta', 'eta', 'theta',
+    'vartheta', 'iota', 'kappa', 'lambda', 'mu', 'nu', 'xi', 'pi', 'varpi', 'rho', 'varrho',
+    'sigma', 'varsigma', 'tau', 'upsilon', 'phi', 'varphi', 'chi', 'psi', 'omega', 'Gamma',
+    'Delta', 'Theta', 'Lambda', 'Xi', 'Pi', 'Sigma', 'Upsilon', 'Phi', 'Psi', 'Omega',
+    # Opérateurs et relations
+    'times', 'div', 'cdot', 'pm', 'mp', 'ast', 'star', 'circ', 'bullet', 'oplus', 'otimes',
+    'leq', 'le', 'geq', 'ge', 'neq', 'ne', 'approx', 'equiv', 'sim', 'simeq', 'cong',
+    'propto', 'll', 'gg', 'in', 'notin', 'ni', 'subset', 'subseteq', 'supset', 'supseteq',
+    'cup', 'cap', 'setminus', 'emptyset', 'varnothing', 'forall', 'exists', 'neg', 'land',
+    'lor', 'wedge', 'vee', 'perp', 'parallel', 'mid', 'nmid', 'angle', 'triangle',
+    'infty', 'partial', 'nabla', 'prime', 'hbar', 'ell', 'Re', 'Im', 'aleph',
+    # Flèches
+    'to', 'gets', 'rightarrow', 'leftarrow', 'leftrightarrow', 'Rightarrow', 'Leftarrow',
+    'Leftrightarrow', 'longrightarrow', 'longleftarrow', 'Longrightarrow', 'iff', 'implies',
+    'mapsto', 'uparrow', 'downarrow', 'rightleftharpoons',
+    # Structures
+    'frac', 'dfrac', 'tfrac', 'sqrt', 'sum', 'prod', 'int', 'iint', 'iiint', 'oint', 'lim',
+    'limsup', 'liminf', 'max', 'min', 'sup', 'inf', 'binom', 'overline', 'underline',
+    'overrightarrow', 'vec', 'hat', 'bar', 'tilde', 'dot', 'ddot', 'widehat', 'widetilde',
+    'overbrace', 'underbrace', 'mathbb', 'mathcal', 'mathrm', 'mathbf', 'mathit', 'mathsf',
+    'boldsymbol', 'operatorname', 'text', 'textrm', 'mbox', 'left', 'right', 'big', 'Big',
+    'bigg', 'Bigg', 'langle', 'rangle', 'lfloor', 'rfloor', 'lceil', 'rceil', 'vert', 'Vert',
+    'cdots', 'ldots', 'vdots', 'ddots', 'dots', 'quad', 'qquad', 'displaystyle', 'limits',
+    'stackrel', 'overset', 'underset', 'pmod', 'bmod', 'mod', 'not', 'begin', 'end', 'hline',
+    'sin', 'cos', 'tan', 'cot', 'sec', 'csc', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh',
+    'tanh', 'log', 'ln', 'lg', 'exp', 'det', 'dim', 'ker', 'deg', 'gcd', 'arg',
+    'checkmark', 'square', 'Box', 'color', 'textcolor', 'boxed', 'N', 'Z', 'Q', 'R', 'C',
+}
+# Environnements LaTeX bruts du texte : gardés tels quels (même en mode strict), mis en
+# formule centrée, ou à l'intérieur desquels `&` sépare les colonnes.
+TEXT_ENVIRONMENTS = {'center', 'flushleft', 'flushright', 'tabular', 'itemize', 'enumerate',
+                     'description', 'quote', 'quotation', 'minipage'}
+DISPLAY_MATH_ENVIRONMENTS = {'equation', 'equation*', 'align', 'align*', 'gather', 'gather*',
+                             'multline', 'multline*', 'eqnarray', 'eqnarray*'}
+INNER_MATH_ENVIRONMENTS = {'aligned', 'gathered', 'split', 'cases', 'array', 'matrix', 'pmatrix',
+                           'bmatrix', 'vmatrix', 'Vmatrix', 'smallmatrix'}
+ALIGNMENT_ENVIRONMENTS = {'align', 'align*', 'eqnarray', 'eqnarray*', 'aligned', 'split', 'cases',
+                          'array', 'matrix', 'pmatrix', 'bmatrix', 'vmatrix', 'Vmatrix',
+                          'smallmatrix', 'tabular'}
+# Ensembles de nombres écrits sans \mathbb (\R n'existe pas en LaTeX).
+_BLACKBOARD = re.compile(r'\\([NZQRC])(?![A-Za-z])')
+
+_FENCE = ('```', '~~~')
+_LIST_ITEM = re.compile(r'([ \t]*)((?:[*+-]|\d+[.)])[ \t]+.*)')
+_DISPLAY_DELIMITER = re.compile(r'(?<!\\)\$\$')
+_SEPARATOR_CELL = re.compile(r'\s*:?-+:?\s*')
+# Cellules d'un tableau : un `|` dans du code ou une formule (`$|x|$`) ne sépare pas deux
+# colonnes pour pandoc, ni un `\|` échappé.
+_CELL_TOKENS = re.compile(
+    r'(`+).*?(?<!`)\1(?!`)'
+    r'|\$\$.*?\$\$'
+    r'|\$(?![\s$])(?:\\.|[^$\\])*?(?<!\s)\$(?!\d)'
+    r'|\\.|\|')
+
+# Un passage de formule ou de code ne franchit pas une ligne blanche (règle de pandoc).
+_LINE = r'(?:[^\n]|\n(?![ \t]*\n))'
+_TEXT_TOKENS = re.compile(
+    r'(?P<code>(?P<ticks>`+)' + _LINE + r'+?(?<!`)(?P=ticks)(?!`))'
+    r'|\$\$(?P<display>(?:[^$\n]|\$(?!\$)|\n(?![ \t]*\n))+?)\$\$'
+    r'|\$(?![\s$])(?P<inline>(?:\\.|[^$\\\n]|\n(?![ \t]*\n))*?)(?<!\s)\$(?!\d)'
+    r'|\\\((?P<paren>' + _LINE + r'+?)\\\)'
+    r'|\\\[(?P<bracket>' + _LINE + r'+?)\\\]'
+    r'|\\(?P<command>[A-Za-z]+)'
+    r'|\\.',
+    re.DOTALL)
+_MATH_TOKENS = re.compile(
+    r'\\(?P<environment_command>begin|end)\s*\{(?P<environment>[A-Za-z]+\*?)\}'
+    r'|\\(?P<command>[A-Za-z]+)|\\.|[{}%&]',
+    re.DOTALL)
+_PATH_TAIL = re.compile(r'(?:\\[\w.-]+)+\\?')
+_ENVIRONMENT_NAME = re.compile(r'\s*\{([A-Za-z]+\*?)\}')
+_LEFT_RIGHT = re.compile(r'\\(?:left|right)(?![A-Za-z])(?:\s*\.)?')
+
+
+def _indent_width(indent):
+    return len(indent.expandtabs(4))
+
+
+def _repair_lists(lines, max_depth, fixes):
+    """Ramène les puces trop profondes au niveau `max_depth` (indentation de ce niveau)."""
+    levels = []  # Indentation de chaque niveau de la liste en cours.
+    for index, line in enumerate(lines):
+        match = _LIST_ITEM.fullmatch(line)
+        if match is None:
+            if line.strip() and not line[:1].isspace():
+                levels = []  # Paragraphe au bord gauche : fin de la liste.
+            continue
+        width = _indent_width(match.group(1))
+        while levels and width < levels[-1]:
+            levels.pop()
+        if not levels or width > levels[-1]:
+            levels.append(width)
+        if len(levels) > max_depth:
+            lines[index] = ' ' * levels[max_depth - 1] + match.group(2)
+            fixes['list_depth'] += 1
+
+
+def _table_cells(row):
+    row = row.strip()
+    cells = []
+    start = 0
+    for match in _CELL_TOKENS.finditer(row):
+        if match.group(0) == '|':
+            cells.append(row[start:match.start()].strip())
+            start = match.end()
+    cells.append(row[start:].strip())
+    if cells and not cells[0]:
+        cells = cells[1:]
+    if cells and not cells[-1] and row.rstrip().endswith('|'):
+        cells = cells[:-1]
+    return cells
+
+
+def _is_separator(cells):
+    return bool(cells) and all(_SEPARATOR_CELL.fullmatch(cell) for cell in cells)
+
+
+def _repair_table(rows, fixes):
+    """Tableau pipe : séparateur en deuxième ligne et même nombre de colonnes partout."""
+    parsed = [_table_cells(row) for row in rows]
+    separator_index = next((i for i, cells in enumerate(parsed) if _is_separator(cells)), None)
+    separator = parsed.pop(separator_index) if separator_index is not None else []
+    if not parsed:
+        return rows
+    width = max(len(cells) for cells in parsed)
+    if (separator_index == 1 and len(separator) == width
+            and all(len(cells) == width for cells in parsed)):
+        return rows
+    fixes['table'] += 1
+    separator = (separator + ['---'] * width)[:width]
+    parsed.insert(1, separator)
+    indent = rows[0][:len(rows[0]) - len(rows[0].lstrip())]
+    return [indent + '| ' + ' | '.join(cells + [''] * (width - len(cells))) + ' |' for cells in parsed]
+
+
+def _repair_blocks(lines, fixes):
+    """Tableaux mal formés, et `$$` non refermé dans un paragraphe (refermé à sa fin)."""
+    out = []
+    index = 0
+    while index < len(lines):
+        if lines[index].lstrip().startswith('|'):
+            end = index
+            while end < len(lines) and lines[end].lstrip().startswith('|'):
+                end += 1
+            rows = lines[index:end]
+            out.extend(_repair_table(rows, fixes) if len(rows) > 1 else rows)
+            index = end
+            continue
+        out.append(lines[index])
+        index += 1
+
+    paragraph_start = 0
+    for index in range(len(out) + 1):
+        if index == len(out) or not out[index].strip():
+            paragraph = out[paragraph_start:index]
+            if sum(len(_DISPLAY_DELIMITER.findall(line)) for line in paragraph) % 2 == 1:
+                out[index - 1] = out[index - 1].rstrip() + ' $$'
+                fixes['display_math'] += 1
+            paragraph_start = index + 1
+    return out
+
+
+def _repair_math(body, fixes, strict, display=False, environment=None):
+    """
+    Formule équilibrée : accolades, environnements, \\left / \\right, `%` et `&` échappés
+    hors alignement. `environment` : environnement ouvert autour de `body`, hors formule.
+    """
+    repaired = _BLACKBOARD.sub(r'\\mathbb{\1}', body)
+    pieces = []
+    stack = []
+    depth = 0
+    lefts = rights = 0
+    bare_alignment = False
+    position = 0
+    for match in _MATH_TOKENS.finditer(repaired):
+        pieces.append(repaired[position:match.start()])
+        position = match.end()
+        token = match.group(0)
+        command = match.group('command')
+        if match.group('environment_command') == 'begin':
+            stack.append(match.group('environment'))
+        elif match.group('environment_command') == 'end':
+            name = match.group('environment')
+            if name not in stack:
+                continue  # \\end sans \\begin : supprimé.
+            while stack[-1] != name:
+                pieces.append(f"\\end{{{stack.pop()}}}")
+            stack.pop()
+        elif command == 'left':
+            lefts += 1
+        elif command == 'right':
+            rights += 1
+        elif command and strict and command not in MATH_COMMANDS and command not in TEXT_COMMANDS:
+            token = f"\\mathrm{{{command}}}"
+        elif token == '{':
+            depth += 1
+        elif token == '}':
+            if depth == 0:
+                continue  # Accolade fermante orpheline : supprimée.
+            depth -= 1
+        elif token in ('%', '&'):
+            aligned = any(name in ALIGNMENT_ENVIRONMENTS for name in stack + [environment])
+            if token == '&' and not aligned and display and not stack and environment is None:
+                bare_alignment = True
+            elif token == '%' or not aligned:
+                token = '\\' + token
+        elif token == '\\\\' and display and not stack and environment is None:
+            bare_alignment = True
+        pieces.append(token)
+    pieces.append(repaired[position:])
+    pieces.append('}' * depth)
+    pieces.extend(f"\\end{{{name}}}" for name in reversed(stack))
+    result = ''.join(pieces)
+    if lefts != rights:
+        result = _LEFT_RIGHT.sub('', result)
+    if bare_alignment:
+        # `&` ou `\\\\` dans une formule centrée nue : c'est un alignement.
+        result = f"\\begin{{aligned}}{result}\\end{{aligned}}"
+    if result != body:
+        fixes['math'] += 1
+    return result
+
+
+def _arguments_end(text, position):
+    """
+    Fin des arguments d'une commande : [optionnel], {groupes}, puis chiffres collés
+    (`\\times5`). None si un groupe n'est pas refermé sur la ligne.
+    """
+    if text.startswith('[', position):
+        closing = text.find(']', position)
+        if closing == -1:
+            return None
+        position = closing + 1
+    while text.startswith('{', position):
+        depth = 0
+        for index in range(position, len(text)):
+            char = text[index]
+            if char == '\n':
+                return None
+            if char == '{' and text[index - 1] != '\\':
+                depth += 1
+            elif char == '}' and text[index - 1] != '\\':
+                depth -= 1
+                if depth == 0:
+                    position = index + 1
+                    break
+        else:
+            return None
+    while position < len(text) and text[position].isdigit():
+        position += 1
+    return position
+
+
+def _is_drive(text, position):
+    """Vrai si le `\\` en `position` suit une lettre de lecteur isolée (`C:`)."""
+    return (position >= 2 and text[position - 1] == ':' and text[position - 2].isalpha()
+            and (position == 2 or not text[position - 3].isalnum()))
+
+
+def _delimit(text, start, end, body, delimiter):
+    """
+    `body` (réparation de text[start:end]) entre `delimiter`, ou None si ces `$` risquent
+    de s'apparier à un `$` voisin. Une espace est ajoutée devant au besoin : précédé
+    d'un caractère, le `$` ouvrant pourrait refermer un `$` isolé plus haut.
+    """
+    span = text[start:end]
+    if not body or '$' in span or '`' in span or re.search(r'\n[ \t]*\n', span):
+        return None
+    if text[end:end + 1] == '$' or (delimiter == '$' and text[end:end + 1].isdigit()):
+        return None
+    before = text[start - 1:start]
+    space = ' ' if before and not before.isspace() else ''
+    return space + delimiter + body + delimiter
+
+
+def _repair_text(text, fixes, strict):
+    """Formules et commandes LaTeX d'un passage sans code délimité."""
+    pieces = []
+    position = 0
+    while True:
+        match = _TEXT_TOKENS.search(text, position)
+        if match is None:
+            break
+        pieces.append(text[position:match.start()])
+        position = match.end()
+        if match.group('code') is not None:
+            pieces.append(match.group(0))
+        elif match.group('display') is not None:
+            body = _repair_math(match.group('display'), fixes, strict, display=True)
+            pieces.append('$$' + body + '$$' if body.strip() else '')
+        elif match.group('inline') is not None:
+            # Une formule en ligne ne commence ni ne finit par une espace (règle de pandoc).
+            body = _repair_math(match.group('inline'), fixes, strict).strip()
+            pieces.append('$' + body + '$' if body else '')
+        elif match.group('paren') is not None or match.group('bracket') is not None:
+            # \\( ... \\) et \\[ ... \\] ne sont pas des formules pour pandoc.
+            display = match.group('bracket') is not None
+            inner = match.group('bracket' if display else 'paren')
+            body = _repair_math(inner.strip(), Counter(), strict, display=display).strip()
+            delimited = _delimit(text, match.start(), match.end(), body, '$$' if display else '$')
+            if delimited is None:
+                opening, closing = ('\\[', '\\]') if display else ('\\(', '\\)')
+                delimited = opening + _repair_text(inner, fixes, strict) + closing
+            else:
+                fixes['math'] += 1
+            pieces.append(delimited)
+        elif match.group('command') is not None:
+            command = match.group('command')
+            if command in ('begin', 'end'):
+                position = _repair_environment(text, match, pieces, fixes, strict)
+                continue
+            if command in TEXT_COMMANDS:
+                pieces.append(match.group(0))
+                continue
+            path = _is_drive(text, match.start()) and _PATH_TAIL.match(text, match.start())
+            if path:
+                # Chemin Windows (C:\\Users\\moi) : chaque `\\` est affiché tel quel.
+                pieces.append(path.group(0).replace('\\', '\\\\'))
+                position = path.end()
+                fixes['text_command'] += 1
+                continue
+            if command in MATH_COMMANDS:
+                fixes['text_command'] += 1
+                end = _arguments_end(text, position)
+                if end is not None:
+                    body = _repair_math(text[match.start():end], Counter(), strict)
+                    delimited = _delimit(text, match.start(), end, body, '$')
+                    if delimited is not None:
+                        pieces.append(delimited)
+                        position = end
+                        continue
+            elif not strict:
+                # LaTeX brut (\\section, \\item, \\href...) : laissé à LaTeX, comme avant.
+                pieces.append(match.group(0))
+                continue
+            else:
+                fixes['text_command'] += 1
+            pieces.append('\\' + match.group(0))  # Affichée telle quelle.
+        else:
+            pieces.append(match.group(0))
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+def _repair_environment(text, match, pieces, fixes, strict):
+    """\\begin{...} hors formule ; renvoie la position où reprendre l'analyse."""
+    name_match = _ENVIRONMENT_NAME.match(text, match.end())
+    closing = None
+    if match.group('command') == 'begin' and name_match:
+        name = name_match.group(1)
+        closing = re.compile(r'\\end\s*\{' + re.escape(name) + r'\}').search(text, name_match.end())
+    if closing is not None:
+        body = text[name_match.end():closing.start()]
+        if name in DISPLAY_MATH_ENVIRONMENTS:
+            pieces.append(text[match.start():name_match.end()]
+                          + _repair_math(body, fixes, strict, display=True, environment=name)
+                          + closing.group(0))
+            return closing.end()
+        if name in TEXT_ENVIRONMENTS or (not strict and name not in INNER_MATH_ENVIRONMENTS):
+            # LaTeX brut refermé : laissé à LaTeX (seulement les environnements connus en mode strict).
+            pieces.append(text[match.start():closing.end()])
+            return closing.end()
+        if name in INNER_MATH_ENVIRONMENTS:
+            region = _repair_math(text[match.start():closing.end()], Counter(), strict, display=True)
+            delimited = _delimit(text, match.start(), closing.end(), region, '$$')
+            if delimited is not None:
+                pieces.append(delimited)
+                fixes['environment'] += 1
+                return closing.end()
+    # \\end orphelin, environnement non refermé, ou inconnu en mode strict : affiché tel quel.
+    pieces.append('\\' + match.group(0))
+    fixes['environment'] += 1
+    return match.end()
+
+
+def _repair_passage(text, max_depth, fixes, strict):
+    """
+    Passage sans code délimité, réparé jusqu'à ce qu'une passe ne change plus rien : une
+    réparation peut en appeler une autre (`$$` isolé retiré, puis `\\[...\\]` converti).
+    """
+    for _ in range(MAX_REPAIR_PASSES):
+        pass_fixes = Counter()
+        lines = text.split('\n')
+        _repair_lists(lines, max_depth, pass_fixes)
+        repaired = _repair_text('\n'.join(_repair_blocks(lines, pass_fixes)), pass_fixes, strict)
+        if repaired == text:
+            break
+        fixes.update(pass_fixes)
+        text = repaired
+    return text
+
+
+def _starts_fence(text):
+    """Vrai si une ligne de `text` ouvre ou ferme un bloc de code délimité."""
+    return ('```' in text or '~~~' in text) and any(
+        line.lstrip().startswith(_FENCE) for line in text.split('\n'))
+
+
+def _repair_once(text, max_depth, fixes, strict):
+    """
+    Une réparation du texte, passage par passage entre les blocs de code. Renvoie (texte,
+    vrai si une réparation a fait apparaître une ligne de bloc de code : `}```` sans son `}`).
+    """
+    out = []
+    block = []
+    in_fence = False
+    new_fence = False
+
+    def flush():
+        nonlocal new_fence
+        if block:
+            passage = '\n'.join(block)
+            repaired = _repair_passage(passage, max_depth, fixes, strict)
+            new_fence = new_fence or (repaired != passage and _starts_fence(repaired))
+            out.append(repaired)
+            block.clear()
+
+    for line in text.split('\n'):
+        if line.lstrip().startswith(_FENCE):
+            if not in_fence:
+                flush()
+            in_fence = not in_fence
+            out.append(line)
+        elif in_fence:
+            out.append(line)
+        else:
+            block.append(line)
+    flush()
+    return '\n'.join(out), new_fence
+
+
+def repair_markdown(text, doc_type='lecon', strict=False):
+    """
+    Répare les constructions qui font échouer le rendu LaTeX (voir l'en-tête du module).
+    Renvoie (texte réparé, Counter des réparations par catégorie). Le texte renvoyé
+    ressort inchangé d'une nouvelle réparation.
+    """
+    fixes = Counter()
+    max_depth = MAX_LIST_DEPTH.get(doc_type, DEFAULT_MAX_LIST_DEPTH)
+    for _ in range(MAX_REPAIR_PASSES):
+        # Découpage en blocs de code modifié par la réparation : tout est repris.
+        text, new_fence = _repair_once(text, max_depth, fixes, strict)
+        if not new_fence:
+            break
+    return text, +fixes
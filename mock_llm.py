@@ -0,0 +1,377 @@
+# mock_llm.py - Fournisseur LLM simulé, pour travailler sans clés Gemini/OpenAI
+#
+# Activé par LLM_MOCK_ENABLED, il remplace les appels réels dans call_llm_api.
+# Les réponses reprennent la structure attendue par utils.create_pdf_with_pandoc
+# (bloc <bilingual_data>, séparateur ---CORRIGE---, diapositives `##`), avec une
+# latence, un taux d'erreur et un taux de timeout configurables par fournisseur.
+# Cela permet de tester localement les workers, les disjoncteurs et les caches.
+
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from config import (LLM_MOCK_LATENCY_DISTRIBUTION, LLM_MOCK_LATENCY_MEDIAN, LLM_MOCK_LATENCY_SPREAD,
+                    LLM_MOCK_TTFT, LLM_MOCK_ERROR_RATE, LLM_MOCK_TIMEOUT_RATE,
+                    LLM_MOCK_PROVIDER_OVERRIDES, LLM_MOCK_SEED)
+
+# Pas de l'attente simulée : les annulations et timeouts sont vérifiés à ce rythme.
+SLEEP_STEP = 0.05
+# Taille (en caractères) des morceaux envoyés en mode streaming.
+STREAM_CHUNK_SIZE = 40
+
+
+class MockLLMError(Exception):
+    """Erreur simulée d'un fournisseur (équivalent d'une réponse HTTP 5xx)."""
+
+
+def _sample_latency(profile, rng):
+    """Tire une durée de réponse complète (secondes) selon la distribution du profil."""
+    median, spread = profile['median'], profile['spread']
+    distribution = profile['distribution']
+    if distribution == 'fixed':
+        return median
+    if distribution == 'uniform':
+        return rng.uniform(median * (1 - spread), median * (1 + spread))
+    if distribution == 'normal':
+        return max(0.0, rng.gauss(median, median * spread))
+    if distribution == 'lognormal':
+        return rng.lognormvariate(math.log(median), spread)
+    raise ValueError(f"Distribution de latence inconnue : {distribution}")
+
+
+def _prompt_field(prompt, *labels):
+    """Récupère la valeur d'une ligne '- Libellé: valeur' des données du prompt."""
+    for label in labels:
+        match = re.search(rf"^- {label}\s*:\s*(.+)$", prompt, flags=re.MULTILINE)
+        if match:
+            return match.group(1).strip()
+    return "N/A"
+
+
+def _lesson_document(prompt):
+    matiere = _prompt_field(prompt, "Matière")
+    classe = _prompt_field(prompt, "Classe")
+    module = _prompt_field(prompt, "Module").upper()
+    lecon = _prompt_field(prompt, "Titre").upper()
+    return f"""**FICHE DE LEÇON APC**
+**Matière:** {matiere}
+**Classe:** {classe}
+**Durée:** 50 minutes
+**Module:** {module}
+**Leçon du jour:** {lecon}
+
+
+**OBJECTIFS PÉDAGOGIQUES**
+
+À la fin de cette leçon, les apprenants devront être capables de :
+- Définir les notions clés de la leçon.
+- Appliquer la méthode étudiée à un exemple simple.
+- Résoudre un problème de la vie courante.
+
+
+**PRÉREQUIS**
+
+- Connaître les quatre opérations de base.
+- Savoir lire un tableau.
+
+
+**SITUATION PROBLÈME**
+
+Au marché Mokolo de Yaoundé, une commerçante veut organiser ses ventes de la semaine. Aide-la à utiliser les notions de la leçon pour prendre la bonne décision.
+
+
+**DÉROULEMENT DE LA LEÇON**
+
+**Introduction (5 min):**
+*Quelles notions avons-nous vues lors de la leçon précédente ?*
+
+**Activité 1: Découverte (10 min):**
+- Les élèves observent la situation et relèvent les informations utiles.
+
+**Activité 2: Conceptualisation et TRACE ÉCRITE (20 min):**
+- **Trace Écrite:**
+
+**I. DÉFINITIONS**
+
+Une grandeur est une propriété que l'on peut mesurer. Par exemple, l'aire d'un carré de côté $a$ vaut $A = a^2$.
+
+**II. PROPRIÉTÉS**
+
+| Grandeur | Unité | Symbole |
+|:---|:---|:---:|
+| Longueur | mètre | m |
+| Masse | kilogramme | kg |
+
+$$E = m c^2$$
+
+**Activité 3: Application (10 min):**
+*Exercice : calculer l'aire d'un carré de côté 3 cm.*
+Corrigé : $A = 3^2 = 9$ cm².
+
+
+**DEVOIRS**
+
+- Exercice 1 : calculer l'aire d'un carré de côté 5 cm.
+- Exercice 2 : rédiger un court paragraphe sur l'utilisation de la leçon au quotidien.
+
+
+
+<bilingual_data>
+Grandeur;Quantity
+Mesure;Measurement
+Unité;Unit
+Aire;Area
+Carré;Square
+</bilingual_data>
+
+**RESSOURCES NUMÉRIQUES**
+- **[PhET Interactive Simulations](https://phet.colorado.edu)** : *Simulations interactives pour illustrer la leçon.*
+"""
+
+
+def _integration_document(prompt):
+    matiere = _prompt_field(prompt, "Matière")
+    classe = _prompt_field(prompt, "Classe")
+    return f"""**ACTIVITÉ D'INTÉGRATION**
+**Matière:** {matiere}
+**Classe:** {classe}
+**Durée:** 50 minutes
+
+
+**Palier de Compétence visé**
+
+Résoudre une situation complexe en mobilisant plusieurs leçons du module.
+
+
+**Ressources à mobiliser**
+
+- Savoirs : les définitions et propriétés des leçons précédentes.
+- Savoir-faire : calculer, comparer, justifier.
+
+
+**Contrôle des pré-requis**
+
+1. Rappeler la formule de l'aire d'un rectangle.
+2. Convertir 2,5 m en cm.
+
+
+**SITUATION D'INTÉGRATION (LE PROBLÈME)**
+
+La coopérative scolaire du lycée de Bafoussam veut clôturer un jardin rectangulaire de 12 m sur 8 m. Tu dois proposer un devis complet.
+
+
+**GUIDE DE RÉSOLUTION POUR L'ENSEIGNANT**
+
+- Faire identifier les données utiles.
+- Guider le calcul du périmètre : $P = 2(L + l)$.
+
+
+**PROPOSITION DE SOLUTION DÉTAILLÉE**
+
+$P = 2(12 + 8) = 40$ m. Avec un grillage à 1 500 FCFA le mètre, le coût est de 60 000 FCFA.
+"""
+
+
+def _evaluation_document(prompt):
+    matiere = _prompt_field(prompt, "Matière")
+    classe = _prompt_field(prompt, "Classe")
+    duree = _prompt_field(prompt, "Durée")
+    return f"""**ÉPREUVE DE {matiere.upper()}**
+**Classe :** {classe}
+**Durée :** {duree}
+
+
+**PARTIE I : ÉVALUATION DES RESSOURCES**
+
+**A. SAVOIRS**
+
+1. Définir : grandeur, unité.
+2. Répondre par vrai ou faux : l'aire d'un carré de côté $a$ est $4a$.
+
+**B. SAVOIR-FAIRE**
+
+1. Calculer l'aire d'un rectangle de 6 cm sur 4 cm.
+2. Résoudre l'équation $2x + 3 = 11$.
+
+
+**PARTIE II : ÉVALUATION DE LA COMPÉTENCE**
+
+**Situation Problème**
+
+Un agriculteur de Foumbot veut partager son champ de 1 200 m² en trois parcelles égales.
+
+- Tâche 1 : calculer l'aire de chaque parcelle.
+- Tâche 2 : proposer un plan de partage.
+
+---CORRIGE---
+
+**PARTIE I**
+
+**A. SAVOIRS**
+
+1. Une grandeur est une propriété mesurable ; une unité sert à l'exprimer.
+2. Faux : l'aire vaut $a^2$.
+
+**B. SAVOIR-FAIRE**
+
+1. $A = 6 \\times 4 = 24$ cm².
+2. $2x = 8$, donc $x = 4$.
+
+**PARTIE II**
+
+- Tâche 1 : $1\\,200 / 3 = 400$ m².
+- Tâche 2 : trois bandes de 400 m² chacune.
+"""
+
+
+def _digital_document(prompt):
+    matiere = _prompt_field(prompt, "Matière")
+    classe = _prompt_field(prompt, "Classe")
+    module = _prompt_field(prompt, "Module").upper()
+    lecon = _prompt_field(prompt, "Titre de la leçon").upper()
+    return f"""## Diapositive 1 : TITRE ET INTRODUCTION
+- **Matière :** {matiere}
+- **Classe :** {classe}
+- **Module :** {module}
+- **Titre de la leçon :** {lecon}
+- **Objectifs :**
+  - Définir les notions clés.
+  - Appliquer la méthode à un exemple.
+
+## Diapositive 2 : Prérequis
+- Les quatre opérations de base.
+- Question : combien font $7 \\times 8$ ?
+
+## Diapositive 3 : Application dans la vie réelle
+- Une commerçante du marché central de Douala calcule ses bénéfices.
+
+## Diapositive 4 : Concepts clés - Concept 1
+- Une grandeur se mesure avec une unité.
+- **Ressources :**
+  - [Khan Academy](https://fr.khanacademy.org)
+
+## Diapositive 5 : Concepts clés - Concept 2
+- L'aire d'un carré : $A = a^2$.
+
+## Diapositive 6 : Exercices d'application
+- Calculer l'aire d'un carré de côté 4 cm.
+
+## Diapositive 7 : Corrigé de l'exercice 1
+- $A = 4^2 = 16$ cm².
+"""
+
+
+# Type de document reconnu à partir d'une phrase propre à chaque prompt de core_logic.
+DOCUMENT_TEMPLATES = [
+    ("docimologie", _evaluation_document),
+    ("activité d'intégration", _integration_document),
+    ("leçon digitalisée", _digital_document),
+    ("fiche de préparation de leçon", _lesson_document),
+]
+
+
+def mock_document(prompt):
+    """Renvoie un document Markdown réaliste pour le type de prompt reçu (leçon par défaut)."""
+    for marker, build in DOCUMENT_TEMPLATES:
+        if marker in prompt:
+            return build(prompt)
+    return _lesson_document(prompt)
+
+
+class MockLLMProvider:
+    """
+    Simule un fournisseur : latence tirée d'une distribution, erreurs et timeouts
+    aléatoires. Le profil par défaut vient de config.py ; LLM_MOCK_PROVIDER_OVERRIDES
+    peut le modifier pour un fournisseur (ex : rendre Gemini instable pour tester
+    le fallback vers OpenAI).
+    """
+
+    def __init__(self, seed=None):
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._default_profile = {
+            'distribution': LLM_MOCK_LATENCY_DISTRIBUTION,
+            'median': LLM_MOCK_LATENCY_MEDIAN,
+            'spread': LLM_MOCK_LATENCY_SPREAD,
+            'ttft': LLM_MOCK_TTFT,
+            'error_rate': LLM_MOCK_ERROR_RATE,
+            'timeout_rate': LLM_MOCK_TIMEOUT_RATE,
+        }
+        if LLM_MOCK_PROVIDER_OVERRIDES:
+            try:
+                for provider, overrides in json.loads(LLM_MOCK_PROVIDER_OVERRIDES).items():
+                    self.configure(provider, **overrides)
+            except (ValueError, TypeError, AttributeError) as e:
+                logging.error(f"LLM_MOCK_PROVIDER_OVERRIDES invalide, ignoré : {e}")
+
+    def configure(self, provider, **overrides):
+        """Modifie le profil d'un fournisseur (distribution, median, spread, ttft, error_rate, timeout_rate)."""
+        unknown = set(overrides) - set(self._default_profile)
+        if unknown:
+            raise ValueError(f"Réglages inconnus pour le fournisseur simulé : {sorted(unknown)}")
+        with self._lock:
+            profile = dict(self._profiles.get(provider, self._default_profile))
+            profile.update(overrides)
+            self._profiles[provider] = profile
+
+    def profile(self, provider):
+        with self._lock:
+            return dict(self._profiles.get(provider, self._default_profile))
+
+    def _draw(self, provider):
+        """Tire au sort l'issue d'un appel : ('error' | 'timeout' | 'ok', latence totale)."""
+        profile = self.profile(provider)
+        with self._lock:
+            outcome = self._rng.random()
+            latency = _sample_latency(profile, self._rng)
+        if outcome < profile['error_rate']:
+            return 'error', min(latency, profile['ttft']), profile
+        if outcome < profile['error_rate'] + profile['timeout_rate']:
+            return 'timeout', math.inf, profile
+        return 'ok', latency, profile
+
+    @staticmethod
+    def _sleep(seconds, check_alive):
+        end = time.monotonic() + seconds
+        while True:
+            if check_alive:
+                check_alive()
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(SLEEP_STEP, remaining))
+
+    def generate(self, provider, prompt, timeout, on_chunk=None, check_alive=None):
+        """
+        Même contrat que les appels réels de core_logic : renvoie le texte complet et,
+        si `on_chunk` est fourni, le diffuse morceau par morceau. `check_alive` est
+        appelée pendant l'attente et lève une exception pour interrompre l'appel.
+        """
+        outcome, latency, profile = self._draw(provider)
+        if outcome == 'error':
+            self._sleep(latency, check_alive)
+            raise MockLLMError(f"{provider} (simulé) : 503 Service Unavailable")
+        if latency > timeout:
+            self._sleep(timeout, check_alive)
+            raise TimeoutError(f"{provider} (simulé) : pas de réponse après {timeout:.1f}s")
+
+        text = mock_document(prompt)
+        if not on_chunk:
+            self._sleep(latency, check_alive)
+            return text
+        chunks = [text[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(text), STREAM_CHUNK_SIZE)]
+        ttft = min(profile['ttft'], latency)
+        self._sleep(ttft, check_alive)
+        interval = (latency - ttft) / max(1, len(chunks) - 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                self._sleep(interval, check_alive)
+            on_chunk(chunk)
+        return text
+
+
+mock_llm = MockLLMProvider(seed=LLM_MOCK_SEED)
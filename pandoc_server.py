@@ -0,0 +1,177 @@
+# pandoc_server.py - Conversions pandoc via un processus `pandoc server` persistant
+#
+# pypandoc.convert_text lance un nouveau processus pandoc à chaque appel : démarrage
+# du runtime Haskell et initialisation des lecteurs payés à chaque PDF. Chaque
+# processus du pool de rendu garde donc son propre `pandoc server` (un petit pool au
+# total, un serveur par processus de rendu) et lui envoie les conversions texte ->
+# texte (markdown -> LaTeX/Beamer/Typst). Seul le moteur (xelatex, typst) est encore
+# lancé à chaque document.
+#
+# Le serveur est vérifié (GET /version) s'il n'a pas servi depuis un moment, et
+# relancé s'il est mort ou ne répond plus. Après plusieurs échecs de démarrage
+# d'affilée, les conversions repassent par pypandoc pendant un temps de pause.
+#
+# `pandoc server` écoute sur toutes les interfaces (pas d'option d'adresse) : le port
+# est tiré au hasard et n'est pas exposé hors du conteneur (voir Dockerfile, EXPOSE).
+
+import atexit
+import logging
+import socket
+import subprocess
+import threading
+import time
+import pypandoc
+import requests
+from config import (PANDOC_SERVER_ENABLED, PANDOC_SERVER_TIMEOUT, PANDOC_SERVER_HEALTH_INTERVAL,
+                    PANDOC_SERVER_COOLDOWN)
+from render_limits import run_pandoc
+
+# Démarrages ratés d'affilée avant de se replier sur pypandoc pendant PANDOC_SERVER_COOLDOWN.
+MAX_START_FAILURES = 2
+STARTUP_TIMEOUT = 5
+
+
+class PandocServerError(Exception):
+    """Levée quand le serveur pandoc ne peut pas être démarré ou ne répond pas."""
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class PandocServer:
+    """
+    Un processus `pandoc server` démarré à la première conversion. `convert_text`
+    a la même signature utile que pypandoc.convert_text et s'y replie de lui-même.
+    Utilisable depuis plusieurs threads : chacun a sa propre session HTTP.
+    """
+
+    def __init__(self, enabled, request_timeout, health_interval, cooldown):
+        self.enabled = enabled
+        self._request_timeout = request_timeout
+        self._health_interval = health_interval
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._process = None
+        self._url = None
+        self._last_ok = 0.0
+        self._start_failures = 0
+        self._disabled_until = 0.0
+        self._sessions = threading.local()
+        self.restarts = 0
+        self.fallbacks = 0
+        atexit.register(self.stop)
+
+    @property
+    def _http(self):
+        # requests.Session n'est pas garantie sûre entre threads : une session par thread.
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        return session
+
+    def _start(self):
+        self.stop()
+        port = _free_port()
+        command = [pypandoc.get_pandoc_path(), 'server', f'--port={port}',
+                   f'--timeout={int(self._request_timeout)}']
+        self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                break
+            if self._healthy():
+                logging.info(f"Serveur pandoc démarré sur le port {port} (pid {self._process.pid}).")
+                return
+            time.sleep(0.1)
+        self.stop()
+        raise PandocServerError("Le serveur pandoc n'a pas démarré.")
+
+    def _healthy(self):
+        try:
+            response = self._http.get(f"{self._url}/version", timeout=2)
+        except requests.RequestException:
+            return False
+        if response.ok:
+            self._last_ok = time.monotonic()
+            return True
+        return False
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            self._process = None
+
+    def _ensure_running(self):
+        """Démarre, vérifie ou relance le serveur ; renvoie False s'il faut utiliser pypandoc."""
+        if time.monotonic() < self._disabled_until:
+            return False
+        alive = self._process is not None and self._process.poll() is None
+        if alive and (time.monotonic() - self._last_ok < self._health_interval or self._healthy()):
+            return True
+        if self._process is not None:
+            logging.warning("Serveur pandoc arrêté ou sans réponse, redémarrage.")
+            self.restarts += 1
+        try:
+            self._start()
+            self._start_failures = 0
+            return True
+        except (OSError, PandocServerError) as e:
+            self._start_failures += 1
+            logging.error(f"Démarrage du serveur pandoc impossible : {e}")
+            if self._start_failures >= MAX_START_FAILURES:
+                self._disabled_until = time.monotonic() + self._cooldown
+                self._start_failures = 0
+                logging.error(f"Serveur pandoc désactivé pendant {self._cooldown:.0f}s, conversions via pypandoc.")
+            return False
+
+    def _post(self, payload, timeout=None):
+        http_timeout = self._request_timeout + 5
+        if timeout:
+            http_timeout = min(http_timeout, timeout)
+        response = self._http.post(self._url, json=payload, headers={'Accept': 'application/json'},
+                                   timeout=http_timeout)
+        response.raise_for_status()
+        result = response.json()
+        self._last_ok = time.monotonic()
+        if 'error' in result:
+            # Erreur de conversion (entrée invalide) : même exception que pypandoc.
+            raise RuntimeError(f"Erreur de conversion pandoc : {result['error']}")
+        return result['output']
+
+    def convert_text(self, source, to, format, standalone=False, timeout=None):
+        """
+        Convertit `source` du format `format` vers `to` ; lève RuntimeError si pandoc échoue.
+        `timeout` : temps restant du rendu (voir render_limits.RenderDeadline).
+        """
+        if self.enabled:
+            with self._lock:
+                running = self._ensure_running()
+            if running:
+                payload = {'text': source, 'from': format, 'to': to, 'standalone': standalone}
+                for attempt in range(2):
+                    try:
+                        return self._post(payload, timeout)
+                    except requests.RequestException as e:
+                        # Serveur tombé pendant la conversion : une relance, puis repli.
+                        logging.warning(f"Serveur pandoc injoignable ({e}).")
+                        with self._lock:
+                            self._last_ok = 0.0
+                            if attempt or not self._ensure_running():
+                                break
+            with self._lock:
+                self.fallbacks += 1
+        # Repli : un processus pandoc par conversion, sous les limites de render_limits.py.
+        extra_args = ['--standalone'] if standalone else []
+        return run_pandoc(source, [f'--from={format}', f'--to={to}'] + extra_args, timeout=timeout)
+
+
+pandoc_server = PandocServer(PANDOC_SERVER_ENABLED, PANDOC_SERVER_TIMEOUT,
+                             PANDOC_SERVER_HEALTH_INTERVAL, PANDOC_SERVER_COOLDOWN)
@@ -0,0 +1,108 @@
+# prerender.py - Rendu anticipé du PDF juste après la génération
+#
+# Sans cela, l'enseignant attend le LLM, puis attend encore pandoc/xelatex quand il
+# clique sur "Télécharger". Dès qu'une génération se termine, son PDF (ou sa
+# présentation Beamer) est rendu en arrière-plan et déposé dans le cache de rendu,
+# sous la même clé que celle que calculera /api/generate-pdf.
+#
+# Un registre des rendus en cours permet à /api/generate-pdf d'attendre un rendu
+# anticipé déjà lancé plutôt que de le refaire ; si l'entrée a été évincée ou si le
+# rendu anticipé a échoué, /api/generate-pdf rend le document lui-même.
+
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config import PRERENDER_ENABLED, PRERENDER_WORKERS, RENDER_TIMEOUT
+from render_pool import render_pool, RenderQueueFull
+from render_cache import render_cache
+from export_formats import output_extension
+
+
+class PreRenderer:
+    """
+    Quelques threads qui attendent le pool de rendu (render_pool.py) pour le compte
+    des générations terminées. Ils n'occupent jamais plus de `max_workers` places
+    de la file de rendu, qui reste disponible pour les téléchargements.
+    """
+
+    def __init__(self, max_workers, enabled=True):
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prerender')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.joined = 0
+
+    def schedule(self, render_key, **render_kwargs):
+        """
+        Lance en arrière-plan le rendu de `render_key` (arguments de
+        create_pdf_with_pandoc, sans `filename`), sauf s'il est déjà en cache ou en cours.
+        """
+        if not (self.enabled and render_cache.enabled):
+            return
+        with self._lock:
+            extension = output_extension(render_kwargs['output_format'])
+            if render_key in self._in_flight or render_cache.contains(render_key, extension):
+                self.skipped += 1
+                return
+            future = self._executor.submit(self._render, render_key, render_kwargs)
+            self._in_flight[render_key] = future
+            self.scheduled += 1
+        future.add_done_callback(lambda _: self._forget(render_key))
+
+    def _forget(self, render_key):
+        with self._lock:
+            self._in_flight.pop(render_key, None)
+
+    def _render(self, render_key, render_kwargs):
+        extension = output_extension(render_kwargs['output_format'])
+        with tempfile.TemporaryDirectory() as out_dir:
+            filename = os.path.join(out_dir, f"prerender{extension}")
+            try:
+                success = render_pool.render(filename=filename, **render_kwargs)
+            except RenderQueueFull:
+                # Pool saturé par des téléchargements : ils passent avant le rendu anticipé.
+                with self._lock:
+                    self.skipped += 1
+                return False
+            except Exception as e:
+                logging.warning(f"Rendu anticipé {render_key[:12]} impossible : {e}")
+                success = False
+            if success:
+                render_cache.store(render_key, filename, extension)
+        with self._lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+        return success
+
+    def wait(self, render_key, timeout=RENDER_TIMEOUT):
+        """
+        Attend le rendu anticipé de `render_key` s'il est en cours. Renvoie True s'il
+        a abouti (le PDF est alors dans le cache), False s'il n'y en a pas ou s'il a échoué.
+        """
+        with self._lock:
+            future = self._in_flight.get(render_key)
+        if future is None:
+            return False
+        with self._lock:
+            self.joined += 1
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return False
+
+    def snapshot(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'in_flight': len(self._in_flight),
+                    'scheduled': self.scheduled, 'completed': self.completed, 'failed': self.failed,
+                    'skipped': self.skipped, 'joined': self.joined}
+
+
+prerenderer = PreRenderer(PRERENDER_WORKERS, enabled=PRERENDER_ENABLED)
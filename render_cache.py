@@ -0,0 +1,180 @@
+# render_cache.py - Cache sur disque des PDF (et exports DOCX / HTML) déjà rendus
+#
+# xelatex est de loin l'opération la plus coûteuse de l'application, et un même
+# document est souvent téléchargé plusieurs fois (nouveau clic sur "Télécharger",
+# ré-export depuis l'historique). Les PDF sont conservés sur disque sous le hash
+# de tout ce qui détermine leur contenu ; le dossier est borné en taille (LRU).
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from config import RENDER_CACHE_ENABLED, RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES
+from export_formats import EXPORT_FORMATS
+from generation_cache import template_version
+
+# Fichiers qui déterminent le rendu : les modifier invalide toutes les entrées du cache.
+RENDER_TEMPLATE_FILES = [
+    'utils.py',
+    'latex_formats.py',
+    'typst_engine.py',
+    'export_formats.py',
+    'markdown_preprocess.py',
+    'config.py',
+    'static/img/barcode.png',
+    'static/img/camtrade_pass.png',
+]
+
+
+def _render_template_version():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    digests = []
+    for relative_path in RENDER_TEMPLATE_FILES:
+        try:
+            with open(os.path.join(base_dir, relative_path), 'rb') as f:
+                digests.append(hashlib.sha256(f.read()).hexdigest())
+        except OSError:
+            digests.append(None)
+    return template_version(*digests)
+
+
+RENDER_TEMPLATE_VERSION = _render_template_version()
+
+# Extensions des fichiers du cache : PDF et formats d'export (export_formats.py).
+CACHED_EXTENSIONS = ('.pdf',) + tuple(extension for extension, _ in EXPORT_FORMATS.values())
+
+
+def make_render_key(markdown_text, lang_contenu_code, doc_type, output_format, pdf_engine='latex'):
+    """Clé du PDF produit pour ces entrées avec la version actuelle des templates."""
+    payload = {
+        'markdown': markdown_text,
+        'lang_contenu_code': lang_contenu_code,
+        'doc_type': doc_type,
+        'output_format': output_format,
+        'pdf_engine': pdf_engine,
+        'template_version': RENDER_TEMPLATE_VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    # Un lien physique évite de recopier le PDF ; supprimer l'un des deux noms ne touche pas l'autre.
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class RenderCache:
+    """
+    Un fichier `<clé><extension>` par document (`.pdf`, `.docx`...). La date de modification sert de date
+    de dernier accès : elle est rafraîchie à chaque succès, et les fichiers les
+    plus anciens sont supprimés quand le dossier dépasse `max_bytes`.
+    Le dossier peut être partagé par plusieurs processus.
+    """
+
+    def __init__(self, directory, max_bytes, enabled=True):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, extension='.pdf'):
+        return os.path.join(self._directory, f"{key}{extension}")
+
+    def contains(self, key, extension='.pdf'):
+        """Indique si `key` est en cache, sans compter de succès ni d'échec."""
+        return self.enabled and os.path.exists(self._path(key, extension))
+
+    def fetch(self, key, destination, extension='.pdf'):
+        """Copie le fichier en cache vers `destination` ; renvoie False s'il est absent."""
+        if not self.enabled:
+            return False
+        path = self._path(key, extension)
+        try:
+            _link_or_copy(path, destination)
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        except OSError as e:
+            logging.error(f"Erreur de lecture du cache de rendu : {e}")
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, source, extension='.pdf'):
+        """Ajoute le fichier `source` au cache (une erreur est journalisée, jamais propagée)."""
+        if not self.enabled:
+            return
+        path = self._path(key, extension)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            _link_or_copy(source, temp_path)
+            os.replace(temp_path, path)
+            os.utime(path)
+            self._evict()
+        except OSError as e:
+            logging.error(f"Erreur d'écriture dans le cache de rendu : {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self._directory) as it:
+            for entry in it:
+                if not entry.name.endswith(CACHED_EXTENSIONS):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self._max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+            if total <= self._max_bytes:
+                break
+        logging.info(f"Cache de rendu réduit à {total / 1024 / 1024:.1f} Mo.")
+
+    def snapshot(self):
+        stats = {'enabled': self.enabled, 'hits': self.hits, 'misses': self.misses}
+        if self.enabled:
+            entries = self._entries()
+            stats.update({'entries': len(entries), 'bytes': sum(size for _, size, _ in entries),
+                          'max_bytes': self._max_bytes})
+        return stats
+
+
+def _build_cache():
+    try:
+        return RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES, enabled=RENDER_CACHE_ENABLED)
+    except OSError as e:
+        logging.error(f"Impossible d'initialiser le cache de rendu : {e}")
+        return RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES, enabled=False)
+
+
+render_cache = _build_cache()
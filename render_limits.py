@@ -0,0 +1,190 @@
+# render_limits.py - Limites de ressources des sous-processus de rendu (pandoc, xelatex, typst)
+#
+# pypandoc.convert_text et subprocess.run ne bornaient ni la durée, ni la mémoire, ni la
+# taille de la sortie : une sortie de LLM pathologique (tableau sans fin, listes imbriquées
+# à l'infini) pouvait faire tourner xelatex jusqu'à ce que gunicorn tue le worker entier.
+# Chaque sous-processus de rendu est maintenant lancé dans son propre groupe de processus,
+# sous des limites du noyau (setrlimit : temps CPU, mémoire, taille des fichiers écrits)
+# héritées par ses enfants (pandoc -> xelatex). Passé le délai en temps réel, tout le
+# groupe est tué. Le PDF produit est enfin limité en nombre de pages.
+#
+# Tout dépassement lève RenderLimitExceeded : c'est le document qui est en cause, le
+# réessayer avec un autre moteur ne ferait que consommer les mêmes ressources.
+
+import logging
+import os
+import re
+import resource
+import signal
+import subprocess
+import time
+import zlib
+import pypandoc
+from config import (RENDER_SUBPROCESS_TIMEOUT, RENDER_CPU_SECONDS, RENDER_MEMORY_MB,
+                    RENDER_MAX_FILE_MB, RENDER_MAX_PAGES)
+
+# Délai entre SIGXCPU (limite souple) et SIGKILL (limite dure), en secondes de CPU.
+CPU_GRACE_SECONDS = 5
+
+LIMIT_MESSAGES = {
+    'timeout': "délai dépassé",
+    'cpu': "temps CPU dépassé",
+    'memory': "mémoire insuffisante",
+    'file_size': "fichier de sortie trop volumineux",
+    'pages': "document trop long",
+}
+
+# Messages d'erreur des outils à court de mémoire (GHC pour pandoc, Rust pour typst, TeX).
+_MEMORY_ERRORS = ('out of memory', 'memory allocation of', 'Cannot allocate memory', 'MemoryError')
+
+
+class RenderLimitExceeded(Exception):
+    """
+    Levée quand un rendu dépasse une limite : `limit` est une clé de LIMIT_MESSAGES.
+    Le document lui-même est en cause, inutile de le rendre à nouveau.
+    """
+
+    def __init__(self, limit, detail):
+        # Les deux arguments dans args : l'exception traverse le pool de processus (pickle).
+        super().__init__(limit, detail)
+        self.limit = limit
+        self.detail = detail
+
+    def __str__(self):
+        return self.detail
+
+
+class RenderDeadline:
+    """
+    Échéance d'un rendu complet : Typst, le préambule précompilé puis pandoc classique, en
+    repli l'un de l'autre, se partagent RENDER_SUBPROCESS_TIMEOUT au lieu d'en recevoir
+    chacun autant (le pool de rendu abandonne l'attente après RENDER_TIMEOUT).
+    """
+
+    def __init__(self, budget=RENDER_SUBPROCESS_TIMEOUT):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget if budget else None
+
+    def timeout(self):
+        """Délai du prochain sous-processus (0 : sans limite) ; lève RenderLimitExceeded s'il est écoulé."""
+        if self.expires_at is None:
+            return 0
+        remaining = self.expires_at - time.monotonic()
+        if remaining <= 0:
+            raise RenderLimitExceeded('timeout', f"Rendu non terminé en {self.budget:.0f}s.")
+        return remaining
+
+
+def _limits_setter(cpu_seconds, memory_mb, max_file_mb):
+    """Fonction exécutée dans le processus enfant, juste avant exec : applique les limites."""
+    def apply_limits():
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + CPU_GRACE_SECONDS))
+        if memory_mb:
+            memory_bytes = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        if max_file_mb:
+            file_bytes = max_file_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_FSIZE, (file_bytes, file_bytes))
+    return apply_limits
+
+
+def _kill_group(process):
+    """Tue tout le groupe du processus (xelatex lancé par pandoc compris)."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _breached_limit(returncode, stderr):
+    """Limite atteinte d'après la fin du processus, ou None (échec ordinaire ou succès)."""
+    if returncode == 0:
+        return None
+    if returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        return 'cpu'
+    if returncode == -signal.SIGXFSZ or 'File too large' in stderr:
+        return 'file_size'
+    if any(message in stderr for message in _MEMORY_ERRORS):
+        return 'memory'
+    return None
+
+
+def run_limited(command, timeout=None, input=None, cwd=None, env=None):
+    """
+    Équivalent de subprocess.run(command, capture_output=True, text=True) sous les limites
+    de rendu. Renvoie le CompletedProcess, code de retour non nul compris ; lève
+    RenderLimitExceeded si une limite est atteinte.
+    """
+    timeout = RENDER_SUBPROCESS_TIMEOUT if timeout is None else timeout
+    name = os.path.basename(command[0])
+    process = subprocess.Popen(
+        command, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8', errors='replace',
+        cwd=cwd, env=env, start_new_session=True,
+        preexec_fn=_limits_setter(RENDER_CPU_SECONDS, RENDER_MEMORY_MB, RENDER_MAX_FILE_MB))
+    try:
+        stdout, stderr = process.communicate(input, timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        _kill_group(process)
+        process.communicate()
+        raise RenderLimitExceeded('timeout', f"{name} n'a pas terminé en {timeout:.0f}s.")
+    finally:
+        # Processus restants du groupe (enfant orphelin, ou interruption) : tués eux aussi.
+        _kill_group(process)
+        if process.poll() is None:
+            process.wait()
+
+    limit = _breached_limit(process.returncode, stderr)
+    if limit is not None:
+        raise RenderLimitExceeded(limit, f"{name} : {LIMIT_MESSAGES[limit]} ({stderr[-300:].strip()})")
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def run_pandoc(source, args, timeout=None, cwd=None):
+    """
+    pandoc (celui de pypandoc) sous les limites de rendu, `source` sur l'entrée standard.
+    Renvoie la sortie standard ; lève RuntimeError si pandoc échoue, comme pypandoc.
+    """
+    result = run_limited([pypandoc.get_pandoc_path(), *args], timeout=timeout, input=source, cwd=cwd)
+    if result.returncode != 0:
+        raise RuntimeError(f"Pandoc a échoué (code {result.returncode}) : {result.stderr[-1500:]}")
+    return result.stdout
+
+
+_PAGES_DICT = re.compile(rb'<<(?:(?!<<|>>).)*?/Type\s*/Pages\b(?:(?!<<|>>).)*?>>', re.DOTALL)
+_COUNT = re.compile(rb'/Count\s+(\d+)')
+_OBJECT_STREAM = re.compile(rb'/Type\s*/ObjStm\b.*?stream\r?\n', re.DOTALL)
+
+
+def _pages_counts(data):
+    return [int(count) for pages in _PAGES_DICT.findall(data) for count in _COUNT.findall(pages)]
+
+
+def pdf_page_count(path):
+    """
+    Nombre de pages du PDF, lu dans ses arbres /Pages (y compris dans les flux d'objets
+    compressés de xdvipdfmx). None si la structure n'est pas reconnue.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    counts = _pages_counts(data)
+    if not counts:
+        for match in _OBJECT_STREAM.finditer(data):
+            try:
+                counts += _pages_counts(zlib.decompressobj().decompress(data[match.end():]))
+            except zlib.error:
+                continue
+    return max(counts) if counts else None
+
+
+def check_page_count(path, max_pages=RENDER_MAX_PAGES):
+    """Supprime le PDF et lève RenderLimitExceeded s'il dépasse `max_pages` pages."""
+    if not max_pages:
+        return
+    pages = pdf_page_count(path)
+    if pages is None:
+        logging.warning(f"Nombre de pages illisible, limite non vérifiée : {path}")
+    elif pages > max_pages:
+        os.remove(path)
+        raise RenderLimitExceeded('pages', f"{LIMIT_MESSAGES['pages'].capitalize()} : {pages} pages (maximum {max_pages}).")
@@ -0,0 +1,168 @@
+# render_pool.py - Pool de processus dédié au rendu des PDF (pandoc + xelatex)
+#
+# Un rendu Beamer peut consommer plus de 10 s de CPU. Exécuté dans le worker web,
+# il bloque les réponses du chat ; une rafale de téléchargements (toute une classe
+# d'enseignants qui termine en même temps) peut alors rendre l'application muette.
+# Les rendus passent donc par un pool de processus séparé, à file d'attente bornée.
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from config import RENDER_POOL_WORKERS, RENDER_QUEUE_MAX, RENDER_TIMEOUT, LLM_LATENCY_WINDOW, RENDER_WARMUP_ENABLED, PDF_ENGINE
+from llm_health import LatencyTracker
+from render_limits import RenderLimitExceeded
+
+
+class RenderQueueFull(Exception):
+    """Levée quand trop de rendus sont déjà en cours ou en attente."""
+
+
+class RenderTimeout(Exception):
+    """Levée quand un rendu n'a pas abouti dans le délai imparti."""
+
+
+def _render_in_worker(kwargs):
+    """Exécutée dans un processus du pool : renvoie (succès, durée du rendu en secondes)."""
+    from utils import create_pdf_with_pandoc
+    started = time.perf_counter()
+    success = create_pdf_with_pandoc(**kwargs)
+    return success, time.perf_counter() - started
+
+
+class RenderPool:
+    """
+    Pool de processus créé au premier rendu (après le fork des workers gunicorn).
+    Les processus sont lancés en mode 'spawn' : ils ne copient pas les threads
+    ni les connexions ouvertes du worker web.
+    """
+
+    def __init__(self, max_workers, max_pending, timeout):
+        self._max_workers = max_workers
+        self._max_pending = max_pending
+        self._timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.limited = 0
+        self.latency = LatencyTracker(LLM_LATENCY_WINDOW)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                logging.info(f"Pool de rendu PDF démarré ({self._max_workers} processus).")
+            return self._executor
+
+    def _reset_executor(self, executor):
+        # Un processus mort (ex : tué par le système) rend tout le pool inutilisable.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def render(self, **kwargs):
+        """
+        Rend un document avec utils.create_pdf_with_pandoc (mêmes arguments) et
+        attend le résultat. Renvoie True/False comme create_pdf_with_pandoc.
+        Lève RenderQueueFull si la file est pleine, RenderTimeout si le rendu
+        dépasse le délai, RenderLimitExceeded si le document dépasse une limite
+        de rendu (voir render_limits.py).
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise RenderQueueFull(f"{self._max_pending} rendus déjà en cours ou en attente.")
+        with self._lock:
+            self._pending += 1
+        started = time.perf_counter()
+        try:
+            executor = self._get_executor()
+            future = executor.submit(_render_in_worker, kwargs)
+        except Exception:
+            self._release()
+            with self._lock:
+                self.failed += 1
+            raise
+        # Place libérée à la fin du rendu, et non de l'attente : un rendu abandonné sur
+        # délai dépassé occupe encore son processus (future.cancel() n'arrête pas un
+        # rendu commencé) et compte dans la file jusqu'à ce qu'il se termine.
+        future.add_done_callback(lambda _future: self._release())
+        try:
+            try:
+                success, render_seconds = future.result(timeout=self._timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                raise RenderTimeout(f"Rendu non terminé après {self._timeout:.0f}s.")
+            except BrokenProcessPool:
+                self._reset_executor(executor)
+                raise
+            except RenderLimitExceeded:
+                with self._lock:
+                    self.limited += 1
+                raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+
+        total_seconds = time.perf_counter() - started
+        doc_kind = kwargs.get('output_format', 'pdf')
+        self.latency.record(f"render:{doc_kind}:{kwargs.get('pdf_engine') or PDF_ENGINE}", render_seconds)
+        self.latency.record("queue_wait", max(0.0, total_seconds - render_seconds))
+        with self._lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+        return success
+
+    def warm_up(self):
+        """
+        Démarre les processus du pool et y rend de petits documents (voir
+        latex_formats.warmup_jobs) : formats LaTeX construits, polices et
+        modules chargés avant le premier vrai téléchargement.
+        """
+        from latex_formats import warmup_jobs
+        started = time.perf_counter()
+        for job in warmup_jobs():
+            with tempfile.TemporaryDirectory() as out_dir:
+                try:
+                    self.render(filename=os.path.join(out_dir, 'warmup.pdf'), **job)
+                except Exception as e:
+                    logging.warning(f"Rendu de préchauffage impossible ({job['output_format']}) : {e}")
+        logging.info(f"Pool de rendu préchauffé en {time.perf_counter() - started:.1f}s.")
+
+    def warm_up_in_background(self):
+        """Préchauffe le pool sans bloquer le démarrage du worker."""
+        if not RENDER_WARMUP_ENABLED:
+            return
+        threading.Thread(target=self.warm_up, name='render-warmup', daemon=True).start()
+
+    def snapshot(self):
+        """État du pool pour /api/metrics : profondeur de file et temps de rendu."""
+        with self._lock:
+            pending = self._pending
+            running = min(pending, self._max_workers)
+            return {'workers': self._max_workers, 'max_pending': self._max_pending,
+                    'running': running, 'queued': pending - running,
+                    'completed': self.completed, 'failed': self.failed, 'rejected': self.rejected,
+                    'limited': self.limited,
+                    'latency': self.latency.snapshot()}
+
+
+render_pool = RenderPool(RENDER_POOL_WORKERS, RENDER_QUEUE_MAX, RENDER_TIMEOUT)
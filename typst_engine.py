@@ -0,0 +1,144 @@
+# typst_engine.py - Moteur PDF rapide : pandoc -> Typst au lieu de pandoc -> xelatex
+#
+# Typst compile un document en quelques centaines de millisecondes, sans TeX Live.
+# pandoc convertit le markdown en balisage Typst (corps seulement) ; ce module
+# l'enveloppe dans une mise en page équivalente aux templates LaTeX de utils.py :
+#   - document ('pdf') : images d'en-tête, bloc titre, tableaux (jeu bilingue),
+#     séparateurs du corrigé ;
+#   - présentation ('beamer') : une page 4:3 par titre de niveau 2, page de titre
+#     avec les images, bandeau de titre et pied de page façon Madrid/beaver.
+# Nécessite pandoc >= 3.1.2 (écrivain typst) et le binaire `typst` (voir Dockerfile).
+# En cas d'échec, utils.py revient au rendu LaTeX.
+
+import os
+import shutil
+import tempfile
+from pandoc_server import pandoc_server
+from render_limits import run_limited, RenderDeadline
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Typst ne lit que les fichiers sous --root. La racine est le dossier temporaire de la
+# compilation, où sont copiées les images d'en-tête : un bloc ```{=typst}``` du markdown
+# reçu (read("/proc/self/environ")...) ne peut rien lire d'autre.
+HEADER_IMAGES = (os.path.join(BASE_DIR, 'static/img/barcode.png'),
+                 os.path.join(BASE_DIR, 'static/img/camtrade_pass.png'))
+HEADER_IMAGE_NAMES = tuple(os.path.basename(path) for path in HEADER_IMAGES)
+
+# Couleur principale du thème Beamer 'beaver'.
+SLIDE_COLOR = 'rgb("#8b0000")'
+
+
+class TypstEngineError(Exception):
+    """Levée quand le rendu Typst est impossible (outil absent, compilation en échec)."""
+
+
+def typst_string(value):
+    """Littéral de chaîne Typst (titre, auteur, date viennent de config.TITLES)."""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# Définitions utilisées par le balisage de pandoc (#horizontalrule) et communes aux deux mises en page.
+_COMMON_PRELUDE = """#let horizontalrule = align(center, line(length: 50%, stroke: 0.5pt))
+#set document(title: {title}, author: {author})
+#set text(lang: {lang}, font: ("Liberation Serif", "DejaVu Serif"), size: {size})
+#set par(justify: true)
+#show link: set text(fill: blue)
+"""
+
+_DOCUMENT_TEMPLATE = """#set page(paper: "a4", margin: 1in, numbering: "1")
+#set table(stroke: 0.5pt)
+
+#align(center)[
+  #grid(columns: 2, column-gutter: 1cm, align: horizon,
+    image({image_1}, width: 6cm),
+    image({image_2}, height: 2.5cm))
+  #v(1cm)
+  #text(size: 17pt, {title})
+  #v(0.6em)
+  #text(size: 12pt, {author})
+  #v(0.3em)
+  #text(size: 12pt, {date})
+]
+#v(1cm)
+
+"""
+
+_SLIDES_TEMPLATE = """#set page(paper: "presentation-4-3", margin: (x: 1.2cm, top: 1cm, bottom: 1.2cm),
+  footer: context [
+    #set text(size: 7pt, fill: white)
+    #grid(columns: (1fr, 1fr, auto), column-gutter: 0pt,
+      box(fill: {color}.darken(30%), width: 100%, inset: 4pt, align(center, {author})),
+      box(fill: {color}, width: 100%, inset: 4pt, align(center, {title})),
+      box(fill: {color}, inset: 4pt)[#counter(page).display() / #counter(page).final().first()])
+  ])
+#set par(justify: false)
+#show heading.where(level: 1): it => {{
+  pagebreak(weak: true)
+  align(center + horizon, block(fill: {color}, inset: 12pt, radius: 4pt,
+    text(fill: white, size: 16pt, weight: "bold", it.body)))
+}}
+#show heading.where(level: 2): it => {{
+  pagebreak(weak: true)
+  block(fill: {color}, width: 100%, inset: 8pt, radius: 3pt,
+    text(fill: white, size: 13pt, weight: "bold", it.body))
+  v(0.4em)
+}}
+
+#align(center + horizon)[
+  #block(fill: {color}, width: 100%, inset: 10pt, radius: 4pt,
+    text(fill: white, size: 16pt, weight: "bold", {title}))
+  #v(0.6em)
+  #text({author})
+  #v(0.3em)
+  #text(size: 9pt, {date})
+  #v(0.8em)
+  #grid(columns: 2, column-gutter: 0.5cm, align: horizon,
+    image({image_1}, width: 4cm),
+    image({image_2}, height: 1.5cm))
+]
+
+"""
+
+
+def build_typst_source(body_markdown, title, author, date, lang, output_format, pandoc_format='markdown',
+                       timeout=None):
+    """Source Typst complète : mise en page + corps converti par pandoc."""
+    try:
+        body = pandoc_server.convert_text(body_markdown, 'typst', pandoc_format, timeout=timeout)
+    except (RuntimeError, OSError) as e:
+        raise TypstEngineError(f"Conversion pandoc -> typst impossible : {e}") from e
+
+    values = {
+        'title': typst_string(title), 'author': typst_string(author), 'date': typst_string(date),
+        'lang': typst_string(lang), 'color': SLIDE_COLOR,
+        'image_1': typst_string(HEADER_IMAGE_NAMES[0]), 'image_2': typst_string(HEADER_IMAGE_NAMES[1]),
+    }
+    prelude = _COMMON_PRELUDE.format(size='11pt' if output_format == 'beamer' else '12pt', **values)
+    template = _SLIDES_TEMPLATE if output_format == 'beamer' else _DOCUMENT_TEMPLATE
+    return prelude + template.format(**values) + body
+
+
+def compile_typst(source, filename, timeout=None):
+    """Compile `source` en PDF dans `filename` avec le binaire typst, sous les limites de rendu."""
+    typst_binary = shutil.which('typst')
+    if typst_binary is None:
+        raise TypstEngineError("Binaire 'typst' introuvable.")
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_path = os.path.join(work_dir, 'document.typ')
+        with open(source_path, 'w', encoding='utf-8') as f:
+            f.write(source)
+        for image_path in HEADER_IMAGES:
+            shutil.copy(image_path, work_dir)
+        result = run_limited([typst_binary, 'compile', '--root', work_dir, source_path, filename], timeout=timeout)
+        if result.returncode != 0:
+            raise TypstEngineError(f"typst a échoué : {result.stderr[-1500:]}")
+
+
+def render_pdf(body_markdown, filename, title, author, date, lang, output_format, pandoc_format='markdown',
+               deadline=None):
+    """Rend le document avec Typst, avant l'échéance `deadline` ; lève TypstEngineError en cas d'échec."""
+    deadline = deadline or RenderDeadline()
+    source = build_typst_source(body_markdown, title, author, date, lang, output_format, pandoc_format,
+                                timeout=deadline.timeout())
+    compile_typst(source, filename, timeout=deadline.timeout())
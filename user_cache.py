@@ -0,0 +1,114 @@
+# user_cache.py - Ligne `users` de l'utilisateur connecté, lue une fois pour toute la requête
+#
+# Chaque requête authentifiée faisait deux allers-retours Supabase avant même d'atteindre
+# la route : load_user (select('*')) puis check_session (select('session_token') sur la
+# même ligne). Depuis Francfort, 30 à 80 ms chacun : l'essentiel de la latence d'une
+# étape de menu. La ligne complète, jeton de session compris, est maintenant lue en une
+# seule requête, partagée par load_user et check_session (flask.g), et gardée
+# USER_CACHE_TTL secondes en mémoire du processus pour les clics suivants.
+#
+# Les écritures de cette instance sur la ligne (compteur de générations, jeton de session,
+# formule) passent par user_cache.update, qui invalide l'entrée. Une modification faite
+# ailleurs (autre instance, manage_users.py) est vue au plus USER_CACHE_TTL secondes plus
+# tard : une session ouverte sur une autre instance ne déconnecte donc celle-ci qu'après
+# ce délai. USER_CACHE_TTL=0 ne garde que le partage au sein de la requête.
+
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_request_context
+import database
+from config import USER_CACHE_TTL, USER_CACHE_MAX_ENTRIES
+
+
+class UserCache:
+    """Cache LRU des lignes `users`, avec expiration courte et invalidation à l'écriture."""
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _request_rows():
+        """Lignes déjà lues pendant la requête en cours, ou None hors requête (jobs)."""
+        if not has_request_context():
+            return None
+        if 'user_rows' not in g:
+            g.user_rows = {}
+        return g.user_rows
+
+    def _cached(self, key):
+        if self._ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            row, stored_at = entry
+            if time.monotonic() - stored_at > self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return row
+
+    def _store(self, key, row):
+        if self._ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (row, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id):
+        """
+        Ligne complète de l'utilisateur (session_token compris), ou None s'il n'existe pas.
+        Renvoie une copie : la modifier ne change pas le cache.
+        """
+        key = str(user_id)
+        request_rows = self._request_rows()
+        if request_rows is not None and key in request_rows:
+            row = request_rows[key]
+            return dict(row) if row is not None else None
+
+        row = self._cached(key)
+        if row is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            response = database.supabase.table('users').select('*').eq('id', user_id).single().execute()
+            row = response.data or None
+            if row is not None:
+                self._store(key, row)
+        if request_rows is not None:
+            request_rows[key] = row
+        return dict(row) if row is not None else None
+
+    def invalidate(self, user_id):
+        """Oublie la ligne : la prochaine lecture repart de la base."""
+        key = str(user_id)
+        with self._lock:
+            self._entries.pop(key, None)
+        request_rows = self._request_rows()
+        if request_rows is not None:
+            request_rows.pop(key, None)
+
+    def update(self, user_id, values):
+        """Met à jour la ligne dans la base, puis l'invalide. Renvoie la réponse Supabase."""
+        try:
+            return database.supabase.table('users').update(values).eq('id', user_id).execute()
+        finally:
+            # Invalidée même en cas d'erreur : l'écriture a pu aboutir côté base.
+            self.invalidate(user_id)
+
+    def snapshot(self):
+        with self._lock:
+            entries = len(self._entries)
+        return {'entries': entries, 'ttl': self._ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+user_cache = UserCache()
@@ -1,19 +1,57 @@
 # utils.py - Avec la fonction complète de Colab
 
 import logging
-import re
-import pypandoc
 import datetime
-import locale
 import os
-from config import TITLES # Assurez-vous que TITLES est bien dans config.py
+from config import TITLES, LATEX_FORMAT_ENABLED, PDF_ENGINE # Assurez-vous que TITLES est bien dans config.py
+from latex_formats import render_pdf, DUMP_MARKER_YAML
+import typst_engine
+from export_formats import EXPORT_FORMATS, render_export
+from markdown_preprocess import prepare_markdown
+from render_limits import RenderLimitExceeded, RenderDeadline, run_pandoc, check_page_count
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
 
-def create_pdf_with_pandoc(text, filename="document.pdf", lang_contenu_code='fr', doc_type='lecon', output_format='pdf'):
+# Noms des mois et forme de la date par langue de contenu. Remplace locale.setlocale,
+# qui modifiait l'état global du processus à chaque rendu : deux rendus simultanés dans
+# des langues différentes (threads, workers gthread) pouvaient échanger leurs dates.
+MONTH_NAMES = {
+    'fr': ['janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet', 'août',
+           'septembre', 'octobre', 'novembre', 'décembre'],
+    'en': ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+           'September', 'October', 'November', 'December'],
+    'de': ['Januar', 'Februar', 'März', 'April', 'Mai', 'Juni', 'Juli', 'August',
+           'September', 'Oktober', 'November', 'Dezember'],
+    'es': ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto',
+           'septiembre', 'octubre', 'noviembre', 'diciembre'],
+    'it': ['gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno', 'luglio', 'agosto',
+           'settembre', 'ottobre', 'novembre', 'dicembre'],
+    'zh': ['1月', '2月', '3月', '4月', '5月', '6月', '7月', '8月', '9月', '10月', '11月', '12月'],
+    'ar': ['يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو', 'يوليو', 'أغسطس',
+           'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر'],
+}
+DATE_FORMATS = {
+    'de': "{day:02d}. {month} {year}",
+    'es': "{day:02d} de {month} de {year}",
+    'zh': "{year}年{month}{day}日",
+}
+
+
+def format_date(date, lang_code):
+    """Date en toutes lettres dans la langue `lang_code` (anglais pour une langue inconnue)."""
+    months = MONTH_NAMES.get(lang_code, MONTH_NAMES['en'])
+    date_format = DATE_FORMATS.get(lang_code, "{day:02d} {month} {year}")
+    return date_format.format(day=date.day, month=months[date.month - 1], year=date.year)
+
+
+def create_pdf_with_pandoc(text, filename="document.pdf", lang_contenu_code='fr', doc_type='lecon', output_format='pdf', pdf_engine=None):
     """
     Crée un PDF (standard ou présentation Beamer) en utilisant les titres appropriés
     et en insérant un en-tête d'images personnalisé.
+    `pdf_engine` : 'latex' ou 'typst' (config.PDF_ENGINE par défaut) ; LaTeX sert de repli.
+    `output_format` 'docx' ou 'html' : document modifiable écrit par pandoc seul (voir export_formats.py).
+    Renvoie False en cas d'échec, mais lève RenderLimitExceeded si le document dépasse
+    une limite de rendu (durée, mémoire, pages : voir render_limits.py).
     """
     try:
         # --- CORRECTION DE SÉCURITÉ ---
@@ -23,74 +61,24 @@ def create_pdf_with_pandoc(text, filename="document.pdf", lang_contenu_code='fr'
         # --- FIN DE LA CORRECTION ---
         logging.info(f"Création du document : {filename} (type: {doc_type}, format: {output_format})")
 
-        # --- ÉTAPE DE NETTOYAGE ET NORMALISATION ---
-        # Cette partie est spécifiquement pour les présentations Beamer afin d'éviter les erreurs LaTeX.
-        if output_format == 'beamer':
-            # Assure que les titres de diapositive sont bien séparés.
-            text = re.sub(r'\s*(##\s)', r'\n\n\1', text)
-            # Aplatit les listes trop profondes qui causent l'erreur "Too deeply nested".
-            text = re.sub(r'^\s{4,}[\*\-]\s', '  - ', text, flags=re.MULTILINE)
-            # Échappe les underscores (_) sauf s'ils sont dans une URL.
-            lines = text.split('\n')
-            processed_lines = []
-            for line in lines:
-                if 'http' not in line:
-                    line = line.replace('_', '\\_')
-                processed_lines.append(line)
-            text = '\n'.join(processed_lines)
-            # Rétablit les `##` qui auraient pu être échappés.
-            text = text.replace('\\#\\# ', '## ')
-
-        # 1. Séparation du texte principal et des données du jeu bilingue.
-        parts = re.split(r'<bilingual_data>.*?</bilingual_data>', text, flags=re.IGNORECASE | re.DOTALL)
-        main_markdown_raw = parts[0]
-        bilingual_data_match = re.search(r'<bilingual_data>(.*?)</bilingual_data>', text, flags=re.IGNORECASE | re.DOTALL)
-        bilingual_data_raw = bilingual_data_match.group(1) if bilingual_data_match else ""
-
-        # 2. Nettoyage du texte principal des commentaires HTML.
-        main_markdown_final = re.sub(r'<!--.*?-->', '', main_markdown_raw, flags=re.DOTALL).strip().replace('bilingual_data', '')
-
-        # 3. Construction du tableau Markdown pour le jeu bilingue.
-        markdown_table = ""
-        if bilingual_data_raw:
-            bilingual_content = re.sub(r'<!--.*?-->', '', bilingual_data_raw, flags=re.DOTALL).strip()
-            lines = [line.strip() for line in bilingual_content.split('\n') if line.strip() and ';' in line]
-            if lines:
-                table_title = TITLES.get(lang_contenu_code, TITLES['fr'])['JEU_BILINGUE']
-                markdown_table += f"\n\n**{table_title}**\n\n"
-                lang_map_display = {'fr': 'Français', 'en': 'English', 'de': 'Deutsch', 'es': 'Español', 'it': 'Italiano', 'zh': '中文', 'ar': 'العربية'}
-                langue_source_nom = lang_map_display.get(lang_contenu_code, lang_contenu_code.capitalize())
-                headers = ['N°', langue_source_nom, 'English'] if lang_contenu_code == 'fr' else ['N°', langue_source_nom, 'Français']
-                markdown_table += f"| {headers[0]} | {headers[1]} | {headers[2]} |\n"
-                markdown_table += "|:---:|:---|:---|\n"
-                for i, line in enumerate(lines):
-                    parts = [p.strip() for p in line.split(';')]
-                    if len(parts) == 2:
-                        markdown_table += f"| {i+1} | {parts[0]} | {parts[1]} |\n"
-
-        # 4. Assemblage du document Markdown final.
-        final_markdown_doc = ""
-        # Cas spécial pour l'évaluation : on gère la séparation du corrigé.
-        if doc_type == 'evaluation':
-            corrige_title = TITLES.get(lang_contenu_code, TITLES['fr']).get('EVAL_CORRIGE_TITRE', 'CORRIGÉ DÉTAILLÉ')
-            # On utilise le texte brut d'origine qui contient le séparateur.
-            final_markdown_doc = re.sub(r'---\s*CORRIGE\s*---', f"\n\n---\n\n**{corrige_title}**\n\n---", text, flags=re.IGNORECASE)
-        else:
-            # Pour tous les autres documents (leçon), on combine le contenu et le jeu bilingue.
-            final_markdown_doc = main_markdown_final + markdown_table
+        # 1-4. Nettoyage Beamer, jeu bilingue, commentaires, corrigé : un seul passage (voir markdown_preprocess.py).
+        document_body = prepare_markdown(text, lang_contenu_code, doc_type, output_format)
 
         # 5. Préparation de l'en-tête YAML et du code pour les images.
         selected_titles = TITLES.get(lang_contenu_code, TITLES['fr'])
-        try:
-            locale.setlocale(locale.LC_TIME, f'{lang_contenu_code}_{lang_contenu_code.upper()}.UTF-8' if lang_contenu_code not in ['zh', 'ar'] else 'en_US.UTF-8')
-        except locale.Error:
-            locale.setlocale(locale.LC_TIME, '') # Fallback sur la locale système.
-        formatted_date = datetime.date.today().strftime('%d %B %Y')
+        formatted_date = format_date(datetime.date.today(), lang_contenu_code)
         
         # Logique des titres (inchangée)
         pdf_title = selected_titles.get('PDF_TITLE', 'Document')
         pdf_author = selected_titles.get('PDF_AUTHOR', 'TCHATCHI AI')
         
+        # 5 bis. Export DOCX / HTML : même contenu que le PDF, écrit directement par pandoc, sans LaTeX.
+        if output_format in EXPORT_FORMATS:
+            render_export(output_format, document_body, filename, pdf_title, pdf_author,
+                          formatted_date, lang_contenu_code)
+            logging.info(f"Document '{filename}' créé avec succès.")
+            return True
+
         # 6. Construction de la source complète du document à convertir.
         yaml_header = ""
         document_source = ""
@@ -106,12 +94,13 @@ documentclass: beamer
 theme: Madrid
 colortheme: beaver
 header-includes:
+- {DUMP_MARKER_YAML}
 - \\usepackage{{graphicx}}
 - \\titlegraphic{{\\centering \\includegraphics[width=4cm]{{static/img/barcode.png}} \\hspace{{0.5cm}} \\includegraphics[height=1.5cm]{{static/img/camtrade_pass.png}} \\par}}
 ---
 """
             # Pour Beamer, on utilise le contenu SANS le jeu bilingue.
-            document_source = yaml_header + main_markdown_final
+            document_source = yaml_header + document_body
         
         else: # Pour les PDF standards (leçon, évaluation, etc.)
             # Code LaTeX pour insérer les images en haut de la page dans une table invisible.
@@ -125,6 +114,8 @@ header-includes:
 \vspace{1cm}
 """
             # En-tête YAML pour un document standard.
+            # La police est choisie par \setmainfont APRÈS le marqueur de fin de préambule
+            # (et non par 'mainfont:') : XeTeX ne sait pas enregistrer une police dans un format.
             yaml_header = f"""
 ---
 title: "{pdf_title}"
@@ -132,8 +123,8 @@ author: "{pdf_author}"
 date: "{formatted_date}"
 lang: "{lang_contenu_code}"
 geometry: "margin=1in"
-mainfont: "Liberation Serif"
 header-includes:
+- {DUMP_MARKER_YAML}
 - \\usepackage{{graphicx}}
 - \\usepackage{{amsmath}}
 - \\usepackage{{amssymb}}
@@ -143,7 +134,7 @@ header-includes:
 ---
 """
             # On combine : En-tête YAML + Code des images + Contenu complet du document.
-            document_source = yaml_header + header_images_latex + final_markdown_doc
+            document_source = yaml_header + header_images_latex + document_body
 
         # 7. Conversion avec Pandoc.
         extra_args = ['--pdf-engine=xelatex']
@@ -153,13 +144,48 @@ header-includes:
             pandoc_format = 'markdown+smart' # 'smart' est utile pour Beamer.
             extra_args.extend(['-t', 'beamer'])
 
-        pypandoc.convert_text(document_source, 'pdf', format=pandoc_format,
-                              outputfile=filename,
-                              extra_args=extra_args)
+        rendered = False
+        # Une seule échéance pour tout le rendu : chaque repli ne reçoit que le temps restant.
+        deadline = RenderDeadline()
+
+        # 7.0 Moteur Typst (voir typst_engine.py) : même contenu, sans les en-têtes LaTeX.
+        if (pdf_engine or PDF_ENGINE) == 'typst':
+            try:
+                typst_engine.render_pdf(document_body, filename, pdf_title, pdf_author, formatted_date,
+                                        lang_contenu_code, output_format, pandoc_format, deadline=deadline)
+                rendered = True
+            except RenderLimitExceeded:
+                raise  # Document en cause : LaTeX n'y arriverait pas mieux.
+            except Exception as e:
+                logging.warning(f"Rendu Typst impossible, rendu LaTeX : {e}")
+
+        # 7.1 Rendu rapide avec le préambule précompilé (voir latex_formats.py).
+        if not rendered and LATEX_FORMAT_ENABLED:
+            try:
+                render_pdf(document_source, pandoc_format, 'beamer' if output_format == 'beamer' else 'latex', filename,
+                           deadline=deadline)
+                rendered = True
+            except RenderLimitExceeded:
+                raise
+            except Exception as e:
+                logging.warning(f"Rendu avec préambule précompilé impossible, rendu classique : {e}")
+
+        # 7.2 Rendu classique : pandoc enchaîne lui-même la conversion et xelatex,
+        # sous les limites de render_limits.py (le format de sortie vient de l'extension).
+        if not rendered:
+            run_pandoc(document_source, [f'--from={pandoc_format}', f'--output={filename}'] + extra_args,
+                       timeout=deadline.timeout())
+
+        # 8. Un PDF de plusieurs centaines de pages trahit un contenu emballé.
+        check_page_count(filename)
 
         logging.info(f"PDF '{filename}' créé avec succès.")
         return True
 
+    except RenderLimitExceeded as e:
+        # Remontée telle quelle : l'appelant distingue un document trop lourd d'une panne.
+        logging.error(f"Limite de rendu dépassée pour {filename} : {e}")
+        raise
     except Exception as e:
         logging.error(f"Erreur DÉFINITIVE lors de la création du PDF avec Pandoc: {e}")
         # Affiche le début du document source en cas d'erreur pour faciliter le débogage.